@@ -9,24 +9,80 @@
 #
 # Description:
 # This code focuses on impact of data transmission frequency on 5G V2N2V delay,draw the violin-plot
+#
+# Usage:
+#   python Draw_Violin_Plot_With_Impact_Of_Data_Transmission_On_Delay.py \
+#     --group 10  "data/Urban road/3-Data transmission frequency/100ms/n8/v30/v2v_info-0"*.txt \
+#     --group 20  "data/Urban road/1-n8/v30/urban_n8_v30_run0"*.txt \
+#     --group 33  "data/Urban road/3-Data transmission frequency/30ms/n8/v30/v2v_info-0"*.txt \
+#     --group 100 "data/Urban road/3-Data transmission frequency/10ms/n8/v30/v2v_info-0"*.txt \
+#     --out violin_frequency.png
+#   (add --show to open a window; render_figures.py batches this headless)
 ###############################################################################
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-
-data = pd.read_csv('', delimiter='\s+')
-data1 = pd.read_csv('', delimiter='\s+')
-data2 = pd.read_csv('', delimiter='\s+')
-data3 = pd.read_csv('', delimiter='\s+')
-data4 = pd.read_csv('', delimiter='\s+')
-data5 = pd.read_csv('', delimiter='\s+')
-data6 = pd.read_csv('', delimiter='\s+')
-data7 = pd.read_csv('', delimiter='\s+')
-
-sns.violinplot(x=10, y='delay(ms)', data=data,color='#397FC7')#,bw=0.0)
-sns.violinplot(x=20, y='delay(ms)', data=data1,color='#397FC7')#,bw=0.0)
-sns.violinplot(x=33, y='delay(ms)', data=data2,color='#397FC7')#,bw=0.0)
-sns.violinplot(x=100, y='delay(ms)', data=data3,color='#397FC7')#,bw=0.0)
-
-plt.savefig("",dpi=900)
-plt.show()
+import argparse
+import sys
+
+import profiling
+
+FREQUENCY_COLUMN = 'frequency(Hz)'
+
+
+def read_groups(groups):
+    # groups: [(label, [file, ...]), ...] -> one frame with a frequency column, in group order
+    import pandas as pd
+    from trace_cache import load_trace
+
+    frames = []
+    for label, files in groups:
+        for f in files:
+            df = load_trace(f, columns=['delay(ms)'])
+            df[FREQUENCY_COLUMN] = label
+            frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def draw(groups, figsize=None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    data = read_groups(groups)
+    fig, ax = plt.subplots(figsize=figsize)
+    sns.violinplot(x=FREQUENCY_COLUMN, y='delay(ms)', data=data, order=[label for label, _ in groups],
+                   color='#397FC7', ax=ax)#,bw=0.0)
+    return fig
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Violin plot of delay per data transmission frequency.")
+    p.add_argument('--group', nargs='+', action='append', required=True, metavar=('LABEL', 'FILE'),
+                   help='Frequency label followed by its trace files; repeat per violin')
+    p.add_argument('--out', required=True, help='Output figure path')
+    p.add_argument('--dpi', type=int, default=900, help='Figure DPI (default 900)')
+    p.add_argument('--show', action='store_true', help='Also open an interactive window')
+    profiling.add_arguments(p)
+    args = p.parse_args(argv)
+    for g in args.group:
+        if len(g) < 2:
+            p.error(f"--group {g[0]} needs at least one file")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiling.enable(args, 'draw_violin')
+    try:
+        with profiling.stage('draw'):
+            fig = draw([(g[0], g[1:]) for g in args.group])
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    with profiling.stage('savefig'):
+        fig.savefig(args.out, dpi=args.dpi)
+    import matplotlib.pyplot as plt
+    if args.show:
+        plt.show()
+    plt.close(fig)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,43 +9,98 @@
 #
 # Description:
 # This code focuses on impact of communication delay on position deviation at a speed of 30 km/h.including RSRP Delay and Distance
+#
+# Usage:
+#   python Draw_With_Impact_Of_Delay_On_Position_Deviation.py \
+#     --input "data/Urban road/2-n78/v30/urban_n78_v30_run01.txt" --out delay_position.png
+#   (add --show to open a window; render_figures.py batches this headless)
+#
+#   Long traces are thinned to --max-points samples per panel (min/max per time
+#   bucket by default, so delay spikes are kept; --decimate lttb or none), and
+#   --rasterize draws the dense layers as an image inside vector outputs.
 ###############################################################################
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
+import argparse
+import sys
+
+import profiling
+from decimate import METHODS
+
+
+def draw(path, max_points=4000, method='minmax', rasterize=False):
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from decimate import decimate
+    from trace_cache import load_trace
+
+    plt.rcParams['font.sans-serif'] = ['SimHei']
+    # the pose columns follow the ten named ones without a header of their own
+    data = load_trace(path)
+    utmx=data["utmX(m)"]
+    utmy=data["utmY(m)"]
+    currentx=data["currentX(m)"]
+    currenty=data["currentY"]
+    distance_diff = np.sqrt((utmx - currentx)**2 + (utmy - currenty)**2)
+
+    subtime=(data["sub_time(ms)"]-data["sub_time(ms)"][0])/1000
+    delay=data["delay(ms)"]
+    rsrp=data["rsrp(db)"]
+
+    t = subtime.to_numpy(dtype=float)
+    def thin(series):
+        values = series.to_numpy(dtype=float)
+        idx = decimate(t, values, max_points, method)
+        return t[idx], values[idx]
+
+    fig, axs = plt.subplots(3, 1, figsize=(12, 8))
 
-plt.rcParams['font.sans-serif'] = ['SimHei']
+    axs[0].scatter(*thin(rsrp),color='#2C91E0', label="RSRP",marker='.', rasterized=rasterize)
+    axs[0].tick_params(axis='both', labelsize=13)
+    axs[0].set_xticks([])
+    axs[0].set_ylabel('RSRP (dBm)', fontsize=15, labelpad=7)
+    axs[0].set_yticks(range(-100, -60, 5))
 
-data = pd.read_csv('', delimiter='\s+')
-utmx=data["utmX(m)"]
-utmy=data["utmY(m)"]
-currentx=data["currentX(m)"]
-currenty=data["currentY(m)"]
-distance_diff = np.sqrt((utmx - currentx)**2 + (utmy - currenty)**2)
+    axs[1].plot(*thin(delay),color='#3ABF99', linewidth=1, label="delay",marker='o',markersize=3, rasterized=rasterize)
+    axs[1].tick_params(axis='both', labelsize=13)
+    axs[1].set_xticks([])
+    axs[1].set_ylabel('Delay (ms)', fontsize=15, labelpad=17)
 
-subtime=(data["sub_time(ms)"]-data["sub_time(ms)"][0])/1000
-delay=data["delay(ms)"]
-rsrp=data["rsrp(db)"]
 
-fig, axs = plt.subplots(3, 1, figsize=(12, 8))
+    axs[2].plot(*thin(distance_diff),color='#F0A73A', linewidth=1,label="distance" ,marker='*',markersize=3, rasterized=rasterize)
+    axs[2].tick_params(axis='both', labelsize=13)
+    axs[2].set_xlabel('Time (s)', fontsize=15)
+    axs[2].set_ylabel('Distance (m)', fontsize=15, labelpad=28)
+    return fig
 
-axs[0].scatter(subtime, rsrp,color='#2C91E0', label="RSRP",marker='.')
-axs[0].tick_params(axis='both', labelsize=13)
-axs[0].set_xticks([])
-axs[0].set_ylabel('RSRP (dBm)', fontsize=15, labelpad=7)
-axs[0].set_yticks(range(-100, -60, 5))
 
-axs[1].plot(subtime, delay,color='#3ABF99', linewidth=1, label="delay",marker='o',markersize=3)
-axs[1].tick_params(axis='both', labelsize=13)
-axs[1].set_xticks([])
-axs[1].set_ylabel('Delay (ms)', fontsize=15, labelpad=17)
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="RSRP, delay and position deviation over time for one run.")
+    p.add_argument('--input', required=True, help='Trace file with currentX/currentY columns')
+    p.add_argument('--out', required=True, help='Output figure path')
+    p.add_argument('--dpi', type=int, default=900, help='Figure DPI (default 900)')
+    p.add_argument('--max-points', type=int, default=4000, help='Samples drawn per panel at most (default 4000)')
+    p.add_argument('--decimate', default='minmax', choices=METHODS, help="Downsampling method (default minmax)")
+    p.add_argument('--rasterize', action='store_true', help='Rasterize the scatter/line layers (smaller pdf/svg)')
+    p.add_argument('--show', action='store_true', help='Also open an interactive window')
+    profiling.add_arguments(p)
+    return p.parse_args(argv)
 
 
-axs[2].plot(subtime, distance_diff,color='#F0A73A', linewidth=1,label="distance" ,marker='*',markersize=3)
-axs[2].tick_params(axis='both', labelsize=13)
-axs[2].set_xlabel('Time (s)', fontsize=15)
-axs[2].set_ylabel('Distance (m)', fontsize=15, labelpad=28)
+def main(argv=None):
+    args = parse_args(argv)
+    profiling.enable(args, 'draw_position_deviation')
+    try:
+        with profiling.stage('draw'):
+            fig = draw(args.input, args.max_points, args.decimate, args.rasterize)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Error: cannot draw {args.input}: {e!r}", file=sys.stderr)
+        sys.exit(1)
+    with profiling.stage('savefig'):
+        fig.savefig(args.out, dpi=args.dpi)
+    import matplotlib.pyplot as plt
+    if args.show:
+        plt.show()
+    plt.close(fig)
 
-plt.savefig("",dpi=900)
 
-plt.show()
+if __name__ == '__main__':
+    main()
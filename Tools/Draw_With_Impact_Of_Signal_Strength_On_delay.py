@@ -9,16 +9,22 @@
 # Description:
 #This code mainly reads the xlsx file and plots the probability of occurrence of delays greater than 100ms and delays
 # between 50ms and 100ms at different signal strengths with speeds of 30km/h, 40km/h, and 50km/h respectively.
+#
+# Usage:
+#   python Draw_With_Impact_Of_Signal_Strength_On_delay.py --out RSRP_Delay.png
+#   # probabilities computed from the aggregate cube instead of the published values
+#   python Draw_With_Impact_Of_Signal_Strength_On_delay.py --cube cube.npz --query "n8" --out RSRP_Delay.png
+#   # the urban runs are at 20, 30 and 40 km/h (velocities without runs are skipped with a warning)
+#   python Draw_With_Impact_Of_Signal_Strength_On_delay.py --cube cube.npz --query "urban" --velocities 20 30 40
+#   (add --show to open a window; render_figures.py batches this headless)
 ###############################################################################
-import pandas as pd
-import matplotlib.pyplot as plt
-
+import argparse
+import sys
 
-plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']
-plt.rcParams['axes.unicode_minus'] = False
+import profiling
 
 
-data = {
+DATA = {
     'range': ['30       40       50 \nWeak Signal', '30       40       50 \nModerate Signal', '30       40       50 \nStrong Signal'], # 'Weak Signal', 'Moderate Signal', 'Strong Signal'
     'V30-Delay:>100ms': [0.074647887, 0.046973803, 0.000337154],
     'V30-Delay:50~100ms': [0.021126761, 0.01535682, 0.000337154],
@@ -28,49 +34,109 @@ data = {
     'V50-Delay:50~100ms': [0.025179856, 0.031158715, 0.000297354]
 }
 
-df = pd.DataFrame(data)
 
-fig, ax = plt.subplots(figsize=(10, 6))
+# (>100ms, 50~100ms) bar colours per velocity, in order
+COLORS = [('#ABC6E4', '#C39398'), ('#FCDABA', '#A7D2BA'), ('#D0CADE', '#E7E6D4'), ('#B7B7B7', '#E2C2A8')]
+SIGNALS = ['Weak Signal', 'Moderate Signal', 'Strong Signal']
+
+
+def data_from_cube(cube_file, query='', velocities=(30, 40, 50)):
+    # same layout as DATA, computed from the aggregate cube (see aggregate_cube.py)
+    from aggregate_cube import AggregateCube, delay_class_probabilities
+
+    probs = delay_class_probabilities(AggregateCube.load(cube_file), query, [float(v) for v in velocities])
+    velocities = list(probs['>100'])
+    spacing = '       '.join(f'{v:g}' for v in velocities)
+    data = {'range': [f'{spacing} \n{signal}' for signal in SIGNALS]}
+    for v in velocities:
+        data[f'V{v:g}-Delay:>100ms'] = probs['>100'][float(v)]
+        data[f'V{v:g}-Delay:50~100ms'] = probs['50-100'][float(v)]
+    return data
+
+
+def draw(data=DATA):
+    import pandas as pd
+    import matplotlib.pyplot as plt
+
+    plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']
+    plt.rcParams['axes.unicode_minus'] = False
+    df = pd.DataFrame(data)
+    velocities = [c[1:-len('-Delay:>100ms')] for c in df.columns if c.endswith('-Delay:>100ms')]
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+
+
+    x = range(len(df['range']))
 
 
-x = range(len(df['range']))
+    for i, v in enumerate(velocities):
+        over, mid = f'V{v}-Delay:>100ms', f'V{v}-Delay:50~100ms'
+        ax.bar([p + 0.1 * i for p in x], df[over], width=0.1, label=over,color=COLORS[i][0])
+        ax.bar([p + 0.1 * i for p in x], df[mid], width=0.1, bottom=df[over], label=mid,color=COLORS[i][1])
 
 
-ax.bar(x, df['V30-Delay:>100ms'], width=0.1, label='V30-Delay:>100ms',color='#ABC6E4')
-ax.bar(x, df['V30-Delay:50~100ms'], width=0.1, bottom=df['V30-Delay:>100ms'], label='V30-Delay:50~100ms',color='#C39398')
+    ax.set_xticks([p + 0.1 * (len(velocities) - 1) / 2 for p in x])
+    ax.set_xticklabels(df['range'])
 
 
-ax.bar([p + 0.1 for p in x], df['V40-Delay:>100ms'], width=0.1, label='V40-Delay:>100ms',color='#FCDABA')
-ax.bar([p + 0.1 for p in x], df['V40-Delay:50~100ms'], width=0.1, bottom=df['V40-Delay:>100ms'], label='V40-Delay:50~100ms',color='#A7D2BA')
+    ax.set_xlabel('RSRP', fontsize=12)
+    ax.set_ylabel('Probability', fontsize=12)
 
-ax.bar([p + 0.2 for p in x], df['V50-Delay:>100ms'], width=0.1, label='V50-Delay:>100ms',color='#D0CADE')
-ax.bar([p + 0.2 for p in x], df['V50-Delay:50~100ms'], width=0.1, bottom=df['V50-Delay:>100ms'], label='V50-Delay:50~100ms',color='#E7E6D4')
+    ax.legend()
 
 
-ax.set_xticks([p + 0.1 for p in x])
-ax.set_xticklabels(df['range'])
+    ax_inset = fig.add_axes([0.78, 0.4, 0.2, 0.3])  # 右上角位置
+    for i, v in enumerate(velocities):
+        over, mid = f'V{v}-Delay:>100ms', f'V{v}-Delay:50~100ms'
+        ax_inset.bar(0.1 * i, df[over][2], width=0.02, color=COLORS[i][0])
+        ax_inset.bar(0.1 * i, df[mid][2], width=0.02, bottom=df[over][2], color=COLORS[i][1])
 
 
-ax.set_xlabel('RSRP', fontsize=12)
-ax.set_ylabel('Probability', fontsize=12)
+    ax_inset.set_xticks([0.1 * (len(velocities) - 1) / 2])
+    ax_inset.set_xticklabels(['                          '.join(velocities) + ' \nStrong Signal'], fontsize=8)
+    ax_inset.set_ylim(0, max(0.002, 1.2 * float((df[[f'V{v}-Delay:>100ms' for v in velocities]].values[2]
+                                                  + df[[f'V{v}-Delay:50~100ms' for v in velocities]].values[2]).max())))
 
-ax.legend()
+    plt.tight_layout()
+    return fig
 
 
-ax_inset = fig.add_axes([0.78, 0.4, 0.2, 0.3])  # 右上角位置
-ax_inset.bar(0, df['V30-Delay:>100ms'][2], width=0.02, color='#ABC6E4')
-ax_inset.bar(0, df['V30-Delay:50~100ms'][2], width=0.02, bottom=df['V30-Delay:>100ms'][2], color='#C39398')
-ax_inset.bar(0.1, df['V40-Delay:>100ms'][2], width=0.02, color='#FCDABA')
-ax_inset.bar(0.1, df['V40-Delay:50~100ms'][2], width=0.02, bottom=df['V40-Delay:>100ms'][2], color='#A7D2BA')
-ax_inset.bar(0.2, df['V50-Delay:>100ms'][2], width=0.02, color='#D0CADE')
-ax_inset.bar(0.2, df['V50-Delay:50~100ms'][2], width=0.02, bottom=df['V50-Delay:>100ms'][2], color='#E7E6D4')
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Probability of delay >100 ms and 50-100 ms by signal strength and speed.")
+    p.add_argument('--out', default='RSRP_Delay.png', help='Output figure path (default RSRP_Delay.png)')
+    p.add_argument('--dpi', type=int, default=900, help='Figure DPI (default 900)')
+    p.add_argument('--cube', help='Aggregate cube (aggregate_cube.py); without it the published values are drawn')
+    p.add_argument('--query', default='', help='Run selection within the cube, e.g. "urban, n8"')
+    p.add_argument('--velocities', nargs='+', type=float, default=[30, 40, 50], help='Velocities to compare (default 30 40 50)')
+    p.add_argument('--show', action='store_true', help='Also open an interactive window')
+    profiling.add_arguments(p)
+    return p.parse_args(argv)
 
 
-ax_inset.set_xticks([0.1])
-ax_inset.set_xticklabels(['30                          40                          50 \nStrong Signal'], fontsize=8)
-ax_inset.set_ylim(0, 0.002)
+def main(argv=None):
+    args = parse_args(argv)
+    profiling.enable(args, 'draw_signal_strength')
+    if args.cube:
+        if len(args.velocities) > len(COLORS):
+            print(f"At most {len(COLORS)} velocities can be drawn", file=sys.stderr)
+            sys.exit(2)
+        try:
+            with profiling.stage('load'):
+                data = data_from_cube(args.cube, args.query, args.velocities)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        data = DATA
+    with profiling.stage('draw'):
+        fig = draw(data)
+    with profiling.stage('savefig'):
+        fig.savefig(args.out, dpi=args.dpi)
+    import matplotlib.pyplot as plt
+    if args.show:
+        plt.show()
+    plt.close(fig)
 
-plt.tight_layout()
-plt.savefig('RSRP_Delay.png', dpi=900)
-plt.show()
 
+if __name__ == '__main__':
+    main()
@@ -10,36 +10,58 @@ Usage examples:
   # analyze specific files and write Excel
   python rsrp_delay_analysis.py --inputs v2v_info01.txt v2v_info02.txt v2v_info03.txt --output rsrp_delay.xlsx
 
-  # analyze all txt files in a folder and write CSV
+  # analyze all txt files in a folder and write CSV (merged copies such as all.txt
+  # are skipped unless --include-derived)
   python rsrp_delay_analysis.py --input-folder data/ --pattern "*.txt" --output rsrp_delay.csv --out-format csv
 
+  # select runs from the dataset catalog (see dataset_catalog.py)
+  python rsrp_delay_analysis.py --catalog catalog.csv --query "n78, v>=50, arterial" --output rsrp_delay.csv
+
+  # count files in 8 worker processes (results are identical to the serial run)
+  python rsrp_delay_analysis.py --input-folder data/ --pattern "**/*.txt" --jobs 8 --output rsrp_delay.csv
+
+  # growing logs: remember per-file byte offsets and partial counts, parse only appended lines next time
+  python rsrp_delay_analysis.py --input-folder data/ --pattern "**/*.txt" --incremental stats.state.json --output rsrp_delay.csv
+
   # change column indices (zero-based), e.g., delay in col 2, rsrp in col 9 (default)
   python rsrp_delay_analysis.py --inputs file1.txt --delay-col 2 --rsrp-col 9
 
 Notes:
 - Default behavior skips the first line of each file (assumed header). Use --skip-rows 0 to disable.
 - The script is robust to malformed lines and will skip rows that cannot be parsed.
-- Requires: xlsxwriter (only if writing xlsx). Install via `pip install xlsxwriter`.
+- Files are parsed with the shared trace_loader (pandas C parser).
+- With --incremental, a file that shrank or whose already-counted bytes changed is recounted from the start.
+- Requires: numpy, pandas; xlsxwriter (only if writing xlsx). Install via `pip install xlsxwriter`.
 """
 
 import argparse
-import glob
 import os
 import sys
 from collections import OrderedDict
+from functools import lru_cache
+
+import profiling
+from dataset_catalog import query_files, run_files
+from incremental import IncrementalState, read_new_bytes
 
 def parse_args():
     p = argparse.ArgumentParser(description="RSRP vs Delay summary across text files.")
     group = p.add_mutually_exclusive_group(required=True)
     group.add_argument("--inputs", nargs="+", help="List of input text files to process.")
     group.add_argument("--input-folder", help="Folder containing input files to process (use with --pattern).")
+    group.add_argument("--query", help="Select run files from the dataset catalog, e.g. \"n78, v>=50, arterial\".")
+    p.add_argument("--catalog", default="catalog.csv", help="Catalog built by dataset_catalog.py (used with --query).")
     p.add_argument("--pattern", default="*.txt", help="Glob pattern when using --input-folder (default '*.txt').")
+    p.add_argument("--include-derived", action="store_true", help="With --input-folder, keep merged copies such as all.txt.")
     p.add_argument("--output", default="rsrp_delay.xlsx", help="Output file path (xlsx or csv).")
     p.add_argument("--out-format", choices=["xlsx", "csv"], help="Force output format (derived from --output if omitted).")
     p.add_argument("--delay-col", type=int, default=2, help="Zero-based column index for delay (default 2).")
     p.add_argument("--rsrp-col", type=int, default=9, help="Zero-based column index for RSRP (default 9).")
     p.add_argument("--skip-rows", type=int, default=1, help="Number of header lines to skip per file (default 1).")
+    p.add_argument("--jobs", type=int, default=1, help="Worker processes; 0 = one per CPU (default 1, serial).")
+    p.add_argument("--incremental", metavar="STATE", help="State file of per-file offsets and partial counts; only lines appended since the last run are parsed.")
     p.add_argument("--quiet", action="store_true", help="Suppress progress messages.")
+    profiling.add_arguments(p)
     return p.parse_args()
 
 def collect_files(args):
@@ -50,67 +72,106 @@ def collect_files(args):
                 files.append(f)
             else:
                 print(f"Warning: input file not found: {f}", file=sys.stderr)
+    elif args.query is not None:
+        files = query_files(args.catalog, args.query)
+        if not files:
+            print(f"No catalog entries matched query: {args.query}", file=sys.stderr)
     else:
-        # folder + pattern
-        pattern = os.path.join(args.input_folder, args.pattern)
-        files = sorted(glob.glob(pattern))
+        # folder + pattern; merged copies (all.txt, ...) would count their runs twice
+        files = run_files(args.input_folder, args.pattern, args.include_derived)
         if not files:
-            print(f"No files matched pattern: {pattern}", file=sys.stderr)
+            print(f"No files matched pattern: {os.path.join(args.input_folder, args.pattern)}", file=sys.stderr)
     return files
 
-def bucket_rsrp(rsrp_value):
-    # returns key string for given rsrp numeric value
-    if rsrp_value > -75:
-        return "-75"
-    elif rsrp_value > -85:
-        return "-85"
-    elif rsrp_value > -90:
-        return "-90"
-    elif rsrp_value > -95:
-        return "-95"
-    else:
-        return "<-95"
+# RSRP buckets (right-closed: <=-95, (-95,-90], ..., >-75), labelled by their upper bound as before
+RSRP_EDGES = [-95, -90, -85, -75]
+RSRP_LABELS = ["<-95", "-95", "-90", "-85", "-75"]
+
+RSRP_KEYS = RSRP_LABELS[::-1]
+
+@lru_cache(maxsize=None)
+def _axes():
+    # built on first count: numpy (via binning) is not needed for --help or catalog lookups
+    import numpy as np
+    from binning import Axis
+    # delay classes <50, 50<=delay<=100, >100 (the lower edge is nudged so that 50 itself is in 50-100)
+    return [Axis('rsrp', RSRP_EDGES, labels=RSRP_LABELS),
+            Axis('delay', [np.nextafter(50, -np.inf), 100], labels=["<50", "50-100", ">100"])]
+
+def count_file(fpath, delay_col, rsrp_col, skip_rows=1):
+    """
+    Count one file. Returns (table, n_rows) where table[i] = [delay>100, 50<=delay<=100, total]
+    for RSRP bucket RSRP_KEYS[i]. Runs in worker processes with --jobs.
+    """
+    # the loader (and pandas) is imported on first use, so --help and catalog lookups start fast
+    from trace_loader import read_columns
+    return count_values(read_columns(fpath, [delay_col, rsrp_col], skip_rows=skip_rows))
+
+def count_values(values):
+    # values: (n, 2) array of delay, rsrp; rows that are too short or not numeric (NaN) are skipped
+    import numpy as np
+    from binning import count_table
+    values = values[~np.isnan(values).any(axis=1)]
+    counts = count_table({'rsrp': values[:, 1], 'delay': values[:, 0]}, _axes())[::-1]
+    table = [[int(row[2]), int(row[1]), int(row.sum())] for row in counts]
+    return table, len(values)
+
+def count_file_incremental(fpath, delay_col, rsrp_col, skip_rows, entry):
+    """
+    Like count_file, but parses only the lines appended since `entry` (a state entry
+    from a previous run, or None). Returns (table, n_rows, new_entry).
+    """
+    from trace_loader import parse_columns
+    data, entry, reset = read_new_bytes(fpath, entry)
+    table, n_rows = count_values(parse_columns(data, [delay_col, rsrp_col], skip_rows=skip_rows if reset else 0))
+    if not reset and entry['partial'] is not None:
+        old_table, old_rows = entry['partial']
+        table = [[a + b for a, b in zip(new, old)] for new, old in zip(table, old_table)]
+        n_rows += old_rows
+    entry['partial'] = [table, n_rows]
+    return table, n_rows, entry
+
+def _count_file_safe(task):
+    fpath, delay_col, rsrp_col, skip_rows, entry = task
+    try:
+        if entry is False:
+            return count_file(fpath, delay_col, rsrp_col, skip_rows), None
+        return count_file_incremental(fpath, delay_col, rsrp_col, skip_rows, entry), None
+    except Exception as e:
+        return None, str(e)
 
-def process_files(files, delay_col, rsrp_col, skip_rows=1, quiet=False):
+def process_files(files, delay_col, rsrp_col, skip_rows=1, quiet=False, jobs=1, state=None):
     # Ordered keys to preserve output order
-    rsrp_ranges = OrderedDict([("-75",[0,0,0]),("-85",[0,0,0]),("-90",[0,0,0]),("-95",[0,0,0]),("<-95",[0,0,0])])
+    rsrp_ranges = OrderedDict((key, [0, 0, 0]) for key in RSRP_KEYS)
     total_count = 0
     processed_files = 0
 
-    for fpath in files:
-        try:
-            with open(fpath, "r", encoding="utf-8", errors="ignore") as fh:
-                # skip header lines
-                for _ in range(skip_rows):
-                    next(fh, None)
-                for line in fh:
-                    parts = line.strip().split()
-                    if not parts:
-                        continue
-                    # Ensure enough columns
-                    if len(parts) <= max(delay_col, rsrp_col):
-                        continue
-                    try:
-                        delay = float(parts[delay_col])
-                        rsrp = float(parts[rsrp_col])
-                    except Exception:
-                        # Unable to parse numeric values; skip row
-                        continue
-
-                    total_count += 1
-                    key = bucket_rsrp(rsrp)
-                    # increment total rsrp count
-                    rsrp_ranges[key][2] += 1
-                    # categorize delay
-                    if delay > 100:
-                        rsrp_ranges[key][0] += 1
-                    elif 50 <= delay <= 100:
-                        rsrp_ranges[key][1] += 1
-            processed_files += 1
-            if not quiet:
-                print(f"Processed {fpath}")
-        except Exception as e:
-            print(f"Error reading {fpath}: {e}", file=sys.stderr)
+    # with an IncrementalState each task carries its file's entry (None = not seen yet); False = full read
+    tasks = [(fpath, delay_col, rsrp_col, skip_rows, state.get(fpath) if state is not None else False) for fpath in files]
+    if jobs > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # map() keeps input order, so messages and merging match the serial path
+            results = pool.map(_count_file_safe, tasks, chunksize=max(1, len(tasks) // (jobs * 4)))
+            results = list(results)
+    else:
+        results = map(_count_file_safe, tasks)
+
+    # merge the per-file partial tables
+    for fpath, (result, error) in zip(files, results):
+        if error is not None:
+            print(f"Error reading {fpath}: {error}", file=sys.stderr)
+            continue
+        table, n_rows = result[:2]
+        if state is not None:
+            state.put(fpath, result[2])
+        for key, counts in zip(RSRP_KEYS, table):
+            for j in range(3):
+                rsrp_ranges[key][j] += counts[j]
+        total_count += n_rows
+        processed_files += 1
+        if not quiet:
+            print(f"Processed {fpath}")
 
     return rsrp_ranges, total_count, processed_files
 
@@ -145,6 +206,23 @@ def write_output_csv(outfile, rsrp_ranges, total_count):
             pct2 = (value[1]/total_count*100) if total_count>0 else 0.0
             writer.writerow([key, value[0], value[1], value[2], pct1, pct2, total_count])
 
+def write_output(args, outfmt, rsrp_ranges, total_count):
+    if outfmt == "xlsx":
+        try:
+            write_output_xlsx(args.output, rsrp_ranges, total_count)
+            if not args.quiet:
+                print(f"Wrote Excel output to {args.output}")
+        except Exception as e:
+            print(f"Failed to write XLSX output: {e}", file=sys.stderr)
+            # fallback to csv
+            csv_out = os.path.splitext(args.output)[0] + ".csv"
+            write_output_csv(csv_out, rsrp_ranges, total_count)
+            print(f"Wrote CSV fallback to {csv_out}")
+    else:
+        write_output_csv(args.output, rsrp_ranges, total_count)
+        if not args.quiet:
+            print(f"Wrote CSV output to {args.output}")
+
 def print_summary(rsrp_ranges, total_count, processed_files):
     print("\nSummary:")
     print(f"Files processed: {processed_files}, Total records analysed: {total_count}\n")
@@ -155,6 +233,7 @@ def print_summary(rsrp_ranges, total_count, processed_files):
 
 def main():
     args = parse_args()
+    profiling.enable(args, "rsrp_delay_analysis")
     # determine output format
     if args.out_format:
         outfmt = args.out_format
@@ -162,33 +241,31 @@ def main():
         _, ext = os.path.splitext(args.output)
         outfmt = "xlsx" if ext.lower() in [".xlsx",".xls"] else "csv"
 
-    files = collect_files(args)
+    with profiling.stage("discover"):
+        files = collect_files(args)
     if not files:
         print("No input files found. Exiting.", file=sys.stderr)
         sys.exit(2)
 
-    rsrp_ranges, total_count, processed_files = process_files(files, args.delay_col, args.rsrp_col, args.skip_rows, args.quiet)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    state = None
+    if args.incremental:
+        state = IncrementalState.load(args.incremental, params={"delay_col": args.delay_col, "rsrp_col": args.rsrp_col,
+                                                                "skip_rows": args.skip_rows})
+    with profiling.stage("count") as st:
+        rsrp_ranges, total_count, processed_files = process_files(files, args.delay_col, args.rsrp_col, args.skip_rows,
+                                                                  args.quiet, jobs, state)
+        st.add(rows=total_count)
+    if state is not None:
+        state.save()
 
     # ensure output directory exists
     outdir = os.path.dirname(os.path.abspath(args.output))
     if outdir and not os.path.exists(outdir):
         os.makedirs(outdir, exist_ok=True)
 
-    if outfmt == "xlsx":
-        try:
-            write_output_xlsx(args.output, rsrp_ranges, total_count)
-            if not args.quiet:
-                print(f"Wrote Excel output to {args.output}")
-        except Exception as e:
-            print(f"Failed to write XLSX output: {e}", file=sys.stderr)
-            # fallback to csv
-            csv_out = os.path.splitext(args.output)[0] + ".csv"
-            write_output_csv(csv_out, rsrp_ranges, total_count)
-            print(f"Wrote CSV fallback to {csv_out}")
-    else:
-        write_output_csv(args.output, rsrp_ranges, total_count)
-        if not args.quiet:
-            print(f"Wrote CSV output to {args.output}")
+    with profiling.stage("write"):
+        write_output(args, outfmt, rsrp_ranges, total_count)
 
     if not args.quiet:
         print_summary(rsrp_ranges, total_count, processed_files)
@@ -0,0 +1,243 @@
+"""
+aggregate_cube.py
+
+Materialized count cube: runs x RSRP bin x SINR bin x delay class.
+
+Every run file (non-derived entry of the dataset catalog) contributes one
+count table computed with binning.count_table; the tables are stored side by
+side together with the run's scenario, network, velocity, period and
+direction, so any slice - e.g. "n8, urban" by velocity and signal strength -
+is a sum over a few hundred small arrays instead of a rescan of the text
+files. `update` re-walks the data folder and recounts only runs that are new
+or whose size/mtime changed; runs whose file disappeared are dropped.
+
+Bins (the finer RSRP bins are those of the RSRP statistics tool; SIGNAL_CLASSES
+merges them into the weak/moderate/strong classes of the signal-strength figure):
+  rsrp(db)   <=-95, (-95,-90], (-90,-85], (-85,-75], >-75
+  sinr(db)   <=0, (0,10], (10,20], >20
+  delay(ms)  <50, 50-100, >100   (50 and 100 are in 50-100)
+
+The cube is one .npz file (counts plus JSON metadata, no pickles), replaced
+atomically on save.
+
+Usage examples:
+  # build, or bring up to date after adding runs
+  python aggregate_cube.py update --data-root data/ --cube cube.npz
+
+  # delay classes by velocity and signal class for n8 urban runs, in milliseconds
+  python aggregate_cube.py table --cube cube.npz --query "n8, urban" --by velocity --signal-classes
+
+  # the signal-strength figure, served from the cube (n8 has runs at 30, 40 and 50 km/h;
+  # the urban runs are at 20, 30 and 40 km/h, so pick those velocities for them)
+  python Draw_With_Impact_Of_Signal_Strength_On_delay.py --cube cube.npz --query "n8" --out RSRP_Delay.png
+  python Draw_With_Impact_Of_Signal_Strength_On_delay.py --cube cube.npz --query "urban" --velocities 20 30 40 --out RSRP_Delay_urban.png
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import profiling
+from binning import Axis, count_table
+from dataset_catalog import DATA_EXTENSIONS, parse_path, parse_query
+
+CUBE_VERSION = 1
+
+AXES = [
+    Axis('rsrp(db)', [-95, -90, -85, -75]),
+    Axis('sinr(db)', [0, 10, 20]),
+    # the lower edge is nudged so that 50 itself is in 50-100, as in the RSRP statistics tool
+    Axis('delay(ms)', [np.nextafter(50, -np.inf), 100], labels=['<50', '50-100', '>100']),
+]
+
+# signal class -> RSRP bins of AXES[0]
+SIGNAL_CLASSES = {'weak': [0, 1], 'moderate': [2, 3], 'strong': [4]}
+
+# catalog fields kept per run (the dimensions runs can be grouped or filtered by)
+RUN_FIELDS = ['relpath', 'scenario', 'network', 'velocity', 'period_ms', 'direction', 'run', 'size', 'mtime_ns']
+
+
+class AggregateCube:
+    def __init__(self, runs: Optional[List[dict]] = None, counts: Optional[np.ndarray] = None):
+        self.axes = AXES
+        self.shape = tuple(ax.n_bins for ax in self.axes)
+        self.runs = runs or []
+        self.counts = counts if counts is not None else np.zeros((0,) + self.shape, dtype='int64')
+
+    @classmethod
+    def load(cls, path: str) -> 'AggregateCube':
+        with np.load(path, allow_pickle=False) as npz:
+            meta = json.loads(str(npz['meta']))
+            counts = npz['counts']
+        if meta.get('version') != CUBE_VERSION:
+            raise ValueError(f"{path}: cube version {meta.get('version')}, expected {CUBE_VERSION}")
+        cube = cls(meta['runs'], counts)
+        if counts.shape[1:] != cube.shape:
+            raise ValueError(f"{path}: cube bins {counts.shape[1:]} differ from {cube.shape}; rebuild it")
+        return cube
+
+    def save(self, path: str):
+        meta = {'version': CUBE_VERSION, 'axes': [[ax.column, ax.edges.tolist(), ax.right] for ax in self.axes],
+                'runs': self.runs}
+        outdir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(outdir, exist_ok=True)
+        tmp = os.path.join(outdir, f'.{os.path.basename(path)}.tmp.npz')
+        np.savez_compressed(tmp, counts=self.counts, meta=np.array(json.dumps(meta)))
+        os.replace(tmp, path)
+
+    def update(self, data_root: str, quiet: bool = True) -> Tuple[int, int, int]:
+        """Bring the cube in line with the run files under data_root; returns (added, refreshed, removed)."""
+        from trace_cache import load_columns
+
+        known = {r['relpath']: i for i, r in enumerate(self.runs)}
+        runs, tables = [], []
+        added = refreshed = 0
+        for dirpath, dirnames, filenames in os.walk(data_root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if not name.lower().endswith(DATA_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, name)
+                relpath = os.path.relpath(path, data_root).replace(os.sep, '/')
+                meta = parse_path(relpath)
+                if meta['derived']:
+                    continue
+                st = os.stat(path)
+                i = known.get(relpath)
+                if i is not None and self.runs[i]['size'] == st.st_size and self.runs[i]['mtime_ns'] == st.st_mtime_ns:
+                    runs.append(self.runs[i])
+                    tables.append(self.counts[i])
+                    continue
+                try:
+                    cols = load_columns(path, [ax.column for ax in self.axes])
+                except (OSError, ValueError) as e:
+                    print(f"Warning: skipping {path}: {e}", file=sys.stderr)
+                    continue
+                meta.update(relpath=relpath, size=st.st_size, mtime_ns=st.st_mtime_ns)
+                runs.append({k: meta.get(k) for k in RUN_FIELDS})
+                tables.append(count_table(cols, self.axes))
+                if i is None:
+                    added += 1
+                else:
+                    refreshed += 1
+                if not quiet:
+                    print(f"{'added' if i is None else 'updated':8s} {relpath}")
+        removed = len(set(known) - {r['relpath'] for r in runs})
+        self.runs = runs
+        self.counts = np.stack(tables) if tables else np.zeros((0,) + self.shape, dtype='int64')
+        return added, refreshed, removed
+
+    def mask(self, query: str = '') -> np.ndarray:
+        """Boolean mask over runs for a dataset_catalog query ('n8, v>=30, urban')."""
+        predicates, _ = parse_query(query)
+        return np.array([all(p(r) for p in predicates) for r in self.runs], dtype=bool)
+
+    def table(self, query: str = '', by: Sequence[str] = ()) -> Dict[tuple, np.ndarray]:
+        """Sum the runs matching `query`, grouped by run fields; {group values: counts[rsrp, sinr, delay]}."""
+        out = {}
+        for i in np.flatnonzero(self.mask(query)):
+            key = tuple(self.runs[i].get(f) for f in by)
+            if key in out:
+                out[key] = out[key] + self.counts[i]
+            else:
+                out[key] = self.counts[i].copy()
+        return out
+
+
+def signal_classes(counts: np.ndarray) -> Dict[str, np.ndarray]:
+    """Collapse the RSRP axis (first axis) of a table into SIGNAL_CLASSES."""
+    return {name: counts[bins].sum(axis=0) for name, bins in SIGNAL_CLASSES.items()}
+
+
+def delay_class_probabilities(cube: AggregateCube, query: str, velocities: Sequence[float]) -> Dict[str, Dict[float, List[float]]]:
+    """
+    P(delay class | signal class, velocity) for the runs matching `query`:
+    {'>100' | '50-100': {velocity: [weak, moderate, strong]}}.
+    Velocities without matching runs are left out with a warning; if none has
+    any, ValueError is raised.
+    """
+    tables = cube.table(query, by=('velocity',))
+    out = {'>100': {}, '50-100': {}}
+    available = sorted(k[0] for k in tables if k[0] is not None)
+    for v in velocities:
+        counts = tables.get((v,))
+        if counts is None:
+            print(f"Warning: no runs with velocity {v:g} match query {query!r} "
+                  f"(velocities there: {', '.join(f'{a:g}' for a in available) or 'none'}); skipped", file=sys.stderr)
+            continue
+        per_class = signal_classes(counts.sum(axis=1))   # sinr summed out -> {class: [<50, 50-100, >100]}
+        for label, j in (('>100', 2), ('50-100', 1)):
+            out[label][v] = [float(c[j] / c.sum()) if c.sum() else 0.0 for c in per_class.values()]
+    if not out['>100']:
+        raise ValueError(f"No runs with velocity {' / '.join(f'{v:g}' for v in velocities)} match query {query!r}")
+    return out
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Build and slice the RSRP x SINR x delay-class count cube.")
+    sub = p.add_subparsers(dest='command', required=True)
+    u = sub.add_parser('update', help='Create the cube, or recount new/changed runs and drop removed ones.')
+    u.add_argument('--data-root', required=True, help='Root of the dataset (the data/ folder).')
+    u.add_argument('--cube', default='cube.npz', help='Cube file (default cube.npz).')
+    u.add_argument('--rebuild', action='store_true', help='Ignore an existing cube and recount every run.')
+    u.add_argument('--quiet', action='store_true', help='Suppress per-file messages.')
+    profiling.add_arguments(u)
+    t = sub.add_parser('table', help='Print delay-class counts of a slice of the cube.')
+    t.add_argument('--cube', default='cube.npz', help='Cube file (default cube.npz).')
+    t.add_argument('--query', default='', help='Run selection, e.g. "n8, urban, v>=30".')
+    t.add_argument('--by', nargs='*', default=[], help='Run fields to group by (scenario network velocity period_ms direction run).')
+    t.add_argument('--signal-classes', action='store_true', help='Weak/moderate/strong instead of the RSRP bins.')
+    t.add_argument('--sinr', action='store_true', help='Keep the SINR bins instead of summing over them.')
+    profiling.add_arguments(t)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, f'aggregate_cube {args.command}')
+    if args.command == 'update':
+        t0 = time.perf_counter()
+        with profiling.stage('load'):
+            cube = AggregateCube.load(args.cube) if os.path.exists(args.cube) and not args.rebuild else AggregateCube()
+        with profiling.stage('update'):
+            added, refreshed, removed = cube.update(args.data_root, quiet=args.quiet)
+        with profiling.stage('save'):
+            cube.save(args.cube)
+        print(f"Cube {args.cube}: {len(cube.runs)} runs, {int(cube.counts.sum())} rows "
+              f"({added} added, {refreshed} updated, {removed} removed) in {time.perf_counter() - t0:.2f} s")
+        return
+
+    try:
+        with profiling.stage('load'):
+            cube = AggregateCube.load(args.cube)
+        with profiling.stage('slice'):
+            tables = cube.table(args.query, by=args.by)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+    rsrp_ax, sinr_ax, delay_ax = cube.axes
+    print('\t'.join(list(args.by) + ['rsrp'] + (['sinr'] if args.sinr else []) + delay_ax.labels + ['total']))
+
+    def key_sort(item):
+        return tuple((v is None, v if v is not None else 0) for v in item[0])
+
+    for key, counts in sorted(tables.items(), key=key_sort):
+        rows = signal_classes(counts) if args.signal_classes else dict(zip(rsrp_ax.labels, counts))
+        for rsrp_label, c in rows.items():
+            sub_rows = zip(sinr_ax.labels, c) if args.sinr else [(None, c.sum(axis=0))]
+            for sinr_label, d in sub_rows:
+                fields = ['' if k is None else str(k) for k in key] + [rsrp_label]
+                if args.sinr:
+                    fields.append(sinr_label)
+                print('\t'.join(fields + [str(int(n)) for n in d] + [str(int(d.sum()))]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+benchmark.py
+
+Timing and peak-memory benchmarks of the tools' hot paths, recorded as JSON
+lines so that runs of different versions on the same machine can be compared.
+
+Each case runs in a fresh Python process (so imports, caches and the peak RSS
+of one case do not leak into the next), --repeat times; the record keeps every
+wall time, the best and median, and the peak RSS of the child (ru_maxrss)
+minus what the interpreter and imports took before the case started.
+
+Cases (the data root is a real or synth_traces.py tree):
+  stats_process_files   Statisticians_..._RSRP.process_files over every file
+  merge_stream          merge_txt_to_xlsx.main --stream (text + xlsx)
+  prepare_data          plot_delay_by_velocity.prepare_data, velocity column binned
+  read_trace            trace_loader.read_trace of every file
+  binning               binning.count_files, RSRP x SINR x delay class
+  rolling_stats         rolling_stats.rolling_stats + find_episodes
+  spatial_build         spatial_index.SpatialIndex.from_files + heatmap
+  handover              handover.process_files
+With --cache off (default) CICV5G_NO_CACHE is set and every run gets its own
+empty cache directory, so each case parses text (tools that always read
+through the cache, like rolling_stats, also pay for filling it); --cache warm
+points the cases at a cache filled before timing.
+
+Usage examples:
+  # synthetic trees at 1x and 10x, then the suite on both
+  python synth_traces.py --like data/ --output /tmp/x1 --scale 1
+  python synth_traces.py --like data/ --output /tmp/x10 --scale 10
+  python benchmark.py --data /tmp/x1 --data /tmp/x10 --results bench.jsonl
+
+  # a subset, compared with the last recorded results of the same host
+  python benchmark.py --data /tmp/x10 --cases stats_process_files prepare_data --results bench.jsonl --compare
+
+Dependencies:
+  numpy, pandas (merge_stream: xlsxwriter)
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import profiling
+from dataset_catalog import run_files
+from profiling import git_revision
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def data_files(root: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(root, '**', '*.txt'), recursive=True))
+
+
+def case_stats_process_files(root, workdir):
+    from Statisticians_Number_Of_Different_Delay_Based_On_RSRP import process_files
+    files = data_files(root)
+    _, rows, _ = process_files(files, 2, 9, quiet=True)
+    return rows
+
+
+def case_merge_stream(root, workdir):
+    import merge_txt_to_xlsx
+    sys.argv = ['merge_txt_to_xlsx.py', '--input-folder', root, '--pattern', '**/*.txt', '--stream',
+                '--output-txt', os.path.join(workdir, 'all.txt'), '--output-xlsx', os.path.join(workdir, 'all.xlsx')]
+    with contextlib.redirect_stdout(io.StringIO()):
+        merge_txt_to_xlsx.main()
+    with open(os.path.join(workdir, 'all.txt'), 'rb') as fh:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: fh.read(1 << 20), b'')) - 1
+
+
+def case_prepare_data(root, workdir):
+    import plot_delay_by_velocity as pdv
+    args = pdv.parse_args(['--input-folder', root, '--pattern', '**/*.txt', '--vel-col-name', 'velocity(m/s)',
+                           '--vel-unit', 'kmh', '--vel-bin', '10', '--quiet'])
+    groups = pdv.prepare_data(data_files(root), args)
+    return int(sum(len(v) for v in groups.values()))
+
+
+def case_read_trace(root, workdir):
+    from trace_cache import load_trace
+    return sum(len(load_trace(f)) for f in data_files(root))
+
+
+def case_binning(root, workdir):
+    from binning import count_files, parse_axis
+    axes = [parse_axis('rsrp=-95,-90,-85,-75'), parse_axis('sinr=0,10,20'), parse_axis('delay=50,100:left')]
+    counts, _ = count_files(data_files(root), axes)
+    return int(counts.sum())
+
+
+def case_rolling_stats(root, workdir):
+    from rolling_stats import find_episodes, load_runs, rolling_stats
+    rs = load_runs(run_files(root))
+    rolling_stats(rs)
+    find_episodes(rs)
+    return len(rs)
+
+
+def case_spatial_build(root, workdir):
+    from spatial_index import SpatialIndex
+    idx = SpatialIndex.from_files(run_files(root))
+    idx.heatmap()
+    return len(idx)
+
+
+def case_handover(root, workdir):
+    from handover import process_files
+    _, _, _, rows, _ = process_files(run_files(root), 2000, 2000, 100, 100)
+    return rows
+
+
+CASES: Dict[str, Callable] = {
+    'stats_process_files': case_stats_process_files,
+    'merge_stream': case_merge_stream,
+    'prepare_data': case_prepare_data,
+    'read_trace': case_read_trace,
+    'binning': case_binning,
+    'rolling_stats': case_rolling_stats,
+    'spatial_build': case_spatial_build,
+    'handover': case_handover,
+}
+
+
+def _maxrss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_case_here(name: str, root: str) -> dict:
+    """Run one case in this process (the child side of run_case)."""
+    sys.path.insert(0, TOOLS_DIR)
+    # import the case's modules first so that the memory figure is the work, not the imports
+    import numpy, pandas  # noqa: F401
+    workdir = tempfile.mkdtemp(prefix='cicv5g-bench-')
+    try:
+        base = _maxrss_mb()
+        t0 = time.perf_counter()
+        rows = CASES[name](root, workdir)
+        seconds = time.perf_counter() - t0
+        peak = _maxrss_mb()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'seconds': seconds, 'rows': int(rows), 'peak_rss_mb': round(peak, 1), 'delta_rss_mb': round(peak - base, 1)}
+
+
+def run_case(name: str, root: str, env: dict) -> dict:
+    """Run one case in a child process and return its measurement."""
+    cold = 'CICV5G_CACHE_DIR' not in env
+    if cold:
+        env = dict(env, CICV5G_CACHE_DIR=tempfile.mkdtemp(prefix='cicv5g-bench-cache-'))
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, '--data', root],
+                              capture_output=True, text=True, env=env, cwd=TOOLS_DIR)
+    finally:
+        if cold:
+            shutil.rmtree(env['CICV5G_CACHE_DIR'], ignore_errors=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def environment() -> dict:
+    import numpy
+    import pandas
+    return {'host': platform.node(), 'cpus': os.cpu_count(), 'machine': platform.machine(),
+            'python': platform.python_version(), 'numpy': numpy.__version__, 'pandas': pandas.__version__,
+            'revision': git_revision()}
+
+
+def load_results(path: str) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def previous(results: List[dict], record: dict) -> Optional[dict]:
+    """Latest earlier record of the same case, data size and host."""
+    same = [r for r in results if r['case'] == record['case'] and r['host'] == record['host']
+            and r['rows'] == record['rows'] and r['cache'] == record['cache'] and 'best_s' in r]
+    return same[-1] if same else None
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Time and memory-profile the tools' hot paths.")
+    p.add_argument('--data', action='append', help='Data root to benchmark on (repeatable)')
+    p.add_argument('--cases', nargs='+', choices=sorted(CASES), help='Cases to run (default: all)')
+    p.add_argument('--repeat', type=int, default=3, help='Runs per case (default 3)')
+    p.add_argument('--cache', choices=['off', 'warm'], default='off', help='Trace cache during the cases (default off)')
+    p.add_argument('--results', default='benchmarks.jsonl', help='JSON-lines file the records are appended to')
+    p.add_argument('--compare', action='store_true', help='Print the change against the previous record of each case')
+    p.add_argument('--list', action='store_true', help='List the cases and exit')
+    p.add_argument('--child', help=argparse.SUPPRESS)
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        print(json.dumps(run_case_here(args.child, args.data[0])))
+        return
+    profiling.enable(args, 'benchmark')
+    if args.list:
+        for name in CASES:
+            print(name)
+        return
+    if not args.data:
+        print("--data is required", file=sys.stderr)
+        sys.exit(2)
+
+    env_info = environment()
+    history = load_results(args.results)
+    env = dict(os.environ)
+    cache_dir = None
+    if args.cache == 'off':
+        env['CICV5G_NO_CACHE'] = '1'
+        env.pop('CICV5G_CACHE_DIR', None)
+    else:
+        cache_dir = tempfile.mkdtemp(prefix='cicv5g-bench-cache-')
+        env['CICV5G_CACHE_DIR'] = cache_dir
+        env.pop('CICV5G_NO_CACHE', None)
+    cases = args.cases or list(CASES)
+    try:
+        with open(args.results, 'a', encoding='utf-8') as out:
+            for root in args.data:
+                files = data_files(root)
+                if not files:
+                    print(f"Warning: no .txt files under {root}", file=sys.stderr)
+                    continue
+                if cache_dir:
+                    subprocess.run([sys.executable, os.path.join(TOOLS_DIR, 'trace_cache.py'), '--input-folder', root,
+                                    '--pattern', '**/*.txt'], env=env, capture_output=True)
+                size = sum(os.path.getsize(f) for f in files)
+                for name in cases:
+                    record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'case': name, 'data': os.path.abspath(root),
+                              'files': len(files), 'bytes': size, 'cache': args.cache, **env_info}
+                    try:
+                        with profiling.stage(name) as st:
+                            runs = [run_case(name, root, env) for _ in range(args.repeat)]
+                            st.add(rows=sum(r['rows'] for r in runs))
+                    except RuntimeError as e:
+                        print(f"{name:22s} FAILED: {e}", file=sys.stderr)
+                        record['error'] = str(e)
+                        out.write(json.dumps(record) + '\n')
+                        continue
+                    seconds = [r['seconds'] for r in runs]
+                    record.update(rows=runs[0]['rows'], seconds=[round(s, 4) for s in seconds],
+                                  best_s=round(min(seconds), 4), median_s=round(statistics.median(seconds), 4),
+                                  peak_rss_mb=max(r['peak_rss_mb'] for r in runs),
+                                  delta_rss_mb=max(r['delta_rss_mb'] for r in runs))
+                    line = (f"{name:22s} {record['rows']:>10d} rows  best {record['best_s']:8.3f} s  "
+                            f"median {record['median_s']:8.3f} s  peak {record['peak_rss_mb']:8.1f} MB "
+                            f"(+{record['delta_rss_mb']:.1f})")
+                    prev = previous(history, record) if args.compare else None
+                    if prev:
+                        line += (f"  vs {prev.get('revision') or '?'}: time x{record['best_s'] / prev['best_s']:.2f}, "
+                                 f"memory x{record['peak_rss_mb'] / prev['peak_rss_mb']:.2f}")
+                    print(line)
+                    out.write(json.dumps(record) + '\n')
+                    out.flush()
+    finally:
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == '__main__':
+    main()
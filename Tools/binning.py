@@ -0,0 +1,249 @@
+"""
+binning.py
+
+Vectorized N-dimensional binning of trace columns.
+
+An Axis is a column plus a list of bin edges. count_table() turns any number
+of axes into one integer count table in a single NumPy pass: every column is
+binned with np.digitize, the per-axis bin indices are folded into one flat
+cell index and np.bincount does the counting. Tables of different files have
+the same shape, so per-file tables are simply added together.
+
+Edges are closed on the right by default, i.e. the bins of edges [a, b] are
+x <= a, a < x <= b and x > b (the RSRP buckets used by the statistics tool);
+pass right=False for a <= x < b. Rows with a missing value in any binned
+column are not counted. group_quantile() gives per-group quantiles once rows
+have a group index (a grid cell, a time bin, ...); the analysis tools share it
+and format_value(), their CSV number format.
+
+Usage examples:
+  # RSRP x SINR x delay-class table for every run under data/ (merged copies such
+  # as all.txt are skipped unless --include-derived)
+  python binning.py --input-folder data/ --pattern "**/*.txt" \\
+      --axis "rsrp=-95,-90,-85,-75" --axis "sinr=0,10,20" --axis "delay=50,100:left" --output table.csv
+
+  # same, for runs selected from the dataset catalog (see dataset_catalog.py)
+  python binning.py --catalog catalog.csv --query "n78, v>=50" --axis "rsrp=-95,-90,-85,-75" --axis "delay=50,100"
+
+  # from another tool
+  from binning import Axis, count_table
+  counts = count_table({'rsrp(db)': rsrp, 'delay(ms)': delay},
+                       [Axis('rsrp(db)', [-95, -90, -85, -75]), Axis('delay(ms)', [50, 100], right=False)])
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from typing import List, Mapping, Optional, Sequence
+
+import numpy as np
+
+import profiling
+
+# short names accepted on the command line
+COLUMN_ALIASES = {
+    'delay': 'delay(ms)',
+    'rsrp': 'rsrp(db)',
+    'sinr': 'sinr(db)',
+    'velocity': 'velocity(m/s)',
+    'heading': 'heading(rad)',
+}
+
+
+class Axis:
+    """One binned column: `edges` must be increasing; there are len(edges) + 1 bins."""
+
+    def __init__(self, column: str, edges: Sequence[float], right: bool = True,
+                 labels: Optional[Sequence[str]] = None):
+        self.column = column
+        self.edges = np.asarray(edges, dtype='float64')
+        if self.edges.ndim != 1 or len(self.edges) == 0 or np.any(np.diff(self.edges) <= 0):
+            raise ValueError(f"Edges for {column} must be a non-empty increasing list, got {list(edges)}")
+        self.right = right
+        if labels is None:
+            labels = default_labels(self.edges, right)
+        elif len(labels) != self.n_bins:
+            raise ValueError(f"{column}: {len(labels)} labels given for {self.n_bins} bins")
+        self.labels = list(labels)
+
+    @property
+    def n_bins(self) -> int:
+        return len(self.edges) + 1
+
+    def index(self, values) -> np.ndarray:
+        """Bin index (0 .. n_bins-1) of every value."""
+        return np.digitize(np.asarray(values, dtype='float64'), self.edges, right=self.right)
+
+    def __repr__(self):
+        return f"Axis({self.column!r}, {self.edges.tolist()}, right={self.right})"
+
+
+def _fmt(edge: float) -> str:
+    return f"{edge:g}"
+
+
+def default_labels(edges: Sequence[float], right: bool = True) -> List[str]:
+    e = [_fmt(x) for x in edges]
+    if right:
+        return [f"<={e[0]}"] + [f"({a},{b}]" for a, b in zip(e, e[1:])] + [f">{e[-1]}"]
+    return [f"<{e[0]}"] + [f"[{a},{b})" for a, b in zip(e, e[1:])] + [f">={e[-1]}"]
+
+
+def count_table(columns: Mapping[str, object], axes: Sequence[Axis]) -> np.ndarray:
+    """
+    Count rows per cell of the grid spanned by `axes`.
+
+    `columns` maps column name -> 1-D array (all the same length). Returns an
+    int64 array of shape (axes[0].n_bins, axes[1].n_bins, ...).
+    """
+    shape = tuple(ax.n_bins for ax in axes)
+    values = [np.asarray(columns[ax.column], dtype='float64') for ax in axes]
+    valid = np.ones(len(values[0]) if values else 0, dtype=bool)
+    for v in values:
+        valid &= ~np.isnan(v)
+    if not valid.all():
+        values = [v[valid] for v in values]
+    flat = np.ravel_multi_index([ax.index(v) for ax, v in zip(axes, values)], shape)
+    return np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+
+
+def iter_cells(counts: np.ndarray, axes: Sequence[Axis]):
+    """Yield (labels tuple, count) for every cell in C order."""
+    for idx in np.ndindex(counts.shape):
+        yield tuple(ax.labels[i] for ax, i in zip(axes, idx)), int(counts[idx])
+
+
+def group_quantile(groups: np.ndarray, values: np.ndarray, n_groups: int, q: float) -> np.ndarray:
+    """Inverted-CDF q-quantile of `values` per group id (0..n_groups-1); NaN for empty groups."""
+    order = np.lexsort((values, groups))
+    counts = np.bincount(groups, minlength=n_groups)
+    offsets = np.r_[0, np.cumsum(counts)[:-1]]
+    rank = np.maximum(np.ceil(q * counts).astype('int64'), 1) - 1
+    out = np.full(n_groups, np.nan)
+    filled = counts > 0
+    out[filled] = values[order[offsets[filled] + rank[filled]]]
+    return out
+
+
+def parse_axis(spec: str) -> Axis:
+    """Parse 'column=e1,e2,...[:left|:right]', e.g. 'rsrp=-95,-90,-85,-75' or 'delay(ms)=50,100:left'."""
+    if '=' not in spec:
+        raise ValueError(f"Axis spec {spec!r} must look like column=e1,e2,...")
+    column, edges = spec.split('=', 1)
+    column = COLUMN_ALIASES.get(column.strip().lower(), column.strip())
+    right = True
+    if ':' in edges:
+        edges, side = edges.rsplit(':', 1)
+        if side.strip() not in ('left', 'right'):
+            raise ValueError(f"Axis spec {spec!r}: closed side must be 'left' or 'right'")
+        right = side.strip() == 'right'
+    try:
+        values = [float(x) for x in edges.split(',') if x.strip()]
+    except ValueError:
+        raise ValueError(f"Axis spec {spec!r}: edges must be numbers") from None
+    return Axis(column, values, right=right)
+
+
+def count_files(files: Sequence[str], axes: Sequence[Axis], quiet: bool = True):
+    """Sum count_table over trace files (parsed through the cache). Returns (counts, files_used)."""
+    from trace_cache import load_trace
+
+    counts = np.zeros(tuple(ax.n_bins for ax in axes), dtype='int64')
+    used = 0
+    names = list(dict.fromkeys(ax.column for ax in axes))
+    for f in files:
+        try:
+            df = load_trace(f, columns=names)
+        except (OSError, ValueError) as e:
+            print(f"Warning: skipping {f}: {e}", file=sys.stderr)
+            continue
+        counts += count_table({n: df[n].to_numpy(dtype='float64', na_value=np.nan) for n in names}, axes)
+        used += 1
+        if not quiet:
+            print(f"Processed {f}")
+    return counts, used
+
+
+def format_value(v) -> str:
+    """CSV cell of a number: '' for NaN, integers without a decimal point, else 6 significant digits (mm for UTM)."""
+    if isinstance(v, str):
+        return v
+    v = float(v)
+    if np.isnan(v):
+        return ''
+    return str(int(v)) if v.is_integer() else f'{v:.6g}' if abs(v) < 1e5 else f'{v:.3f}'
+
+
+def write_table_csv(outfile: str, counts: np.ndarray, axes: Sequence[Axis]):
+    outdir = os.path.dirname(os.path.abspath(outfile))
+    os.makedirs(outdir, exist_ok=True)
+    total = int(counts.sum())
+    with open(outfile, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow([ax.column for ax in axes] + ['count', 'percent'])
+        for labels, n in iter_cells(counts, axes):
+            writer.writerow(list(labels) + [n, (n / total * 100) if total > 0 else 0.0])
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="N-dimensional count tables over trace columns.")
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument('--inputs', nargs='+', help='Trace files to count')
+    group.add_argument('--input-folder', help='Folder containing trace files (use with --pattern)')
+    group.add_argument('--query', help='Select run files from the dataset catalog, e.g. "n78, v>=50, arterial"')
+    p.add_argument('--catalog', default='catalog.csv', help='Catalog built by dataset_catalog.py (used with --query)')
+    p.add_argument('--pattern', default='**/*.txt', help="Glob pattern, recursive (default '**/*.txt')")
+    p.add_argument('--include-derived', action='store_true', help='With --input-folder, keep merged copies such as all.txt')
+    p.add_argument('--axis', action='append', required=True,
+                   help="Binned column, 'column=e1,e2,...[:left|:right]'; repeat for more dimensions")
+    p.add_argument('--output', help='Write the table as CSV (one row per cell)')
+    p.add_argument('--quiet', action='store_true', help='Suppress progress messages')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, 'binning')
+    try:
+        axes = [parse_axis(s) for s in args.axis]
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    with profiling.stage('discover'):
+        if args.inputs:
+            files = args.inputs
+        elif args.query is not None:
+            from dataset_catalog import query_files
+            files = query_files(args.catalog, args.query)
+        else:
+            from dataset_catalog import run_files
+            files = run_files(args.input_folder, args.pattern, args.include_derived)
+    if not files:
+        print("No input files found. Exiting.", file=sys.stderr)
+        sys.exit(2)
+
+    t0 = time.perf_counter()
+    with profiling.stage('count') as st:
+        counts, used = count_files(files, axes, quiet=args.quiet)
+        st.add(rows=counts.sum())
+    elapsed = time.perf_counter() - t0
+
+    if args.output:
+        with profiling.stage('write'):
+            write_table_csv(args.output, counts, axes)
+        print(f"Wrote {args.output}")
+    if not args.quiet or not args.output:
+        total = int(counts.sum())
+        print(f"\nFiles: {used}, rows counted: {total}, cells: {counts.size}, elapsed: {elapsed:.3f} s")
+        for labels, n in iter_cells(counts, axes):
+            print(f"  {'  '.join(f'{l:>12s}' for l in labels)}  {n:10d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+bootstrap_compare.py
+
+Bootstrap confidence intervals for delay statistics of catalog selections,
+and for their differences: mean, p95 (--quantile) and the share of delays
+above 100 ms (--threshold), e.g. n8 against n78, or one speed against
+another.
+
+Consecutive samples of a run are strongly autocorrelated (delays come in
+bursts at 20 Hz), so rows are not resampled one by one, which would give
+intervals far too narrow. Whole units are resampled instead, each selection
+independently:
+  --unit run     every run is one unit (default; the runs are the
+                 independent repetitions of a measurement)
+  --unit block   runs are cut into contiguous blocks of --block-seconds,
+                 for selections with only a few runs
+A selection with fewer than 5 units gets a warning.
+
+The resampling is vectorized. A batch of replicates is one NumPy index
+matrix (replicates x units) of drawn units. It is turned into unit weights,
+and each statistic is a product of those weights with per-unit sums: row
+counts, delay sums, counts above the threshold, and per-unit delay
+histograms for the quantile. So the cost does not grow with the number of
+rows. The histogram keeps the delay values around the quantile of the
+pooled data; the few replicates whose quantile falls outside that window
+are recomputed with the full histogram. Batches are spread over --jobs
+processes and seeded from --seed, so results do not depend on --jobs.
+
+Selections use the syntax of trace_query.py (path terms and column terms)
+and are read from the catalog. Every selection after the first is compared
+with the first. Intervals are percentile intervals; p is the two-sided
+bootstrap p-value of "difference = 0".
+
+Usage examples:
+  # n8 vs n78 on urban roads, 10,000 resamples, all cores
+  python bootstrap_compare.py --catalog catalog.csv --select "n8, urban" --select "n78, urban" --jobs 0
+
+  # speeds on n8, 5 s blocks, results as CSV
+  python bootstrap_compare.py --catalog catalog.csv --select "n8, v=20" --select "n8, v=30" --select "n8, v=40" \\
+      --unit block --block-seconds 5 --output outputs/n8_speeds.csv
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+import profiling
+
+STATISTICS = ['mean', 'quantile', 'over_rate']
+
+MIN_UNITS = 5
+
+# share of the pooled data kept on either side of the quantile in the narrow histogram
+_QUANTILE_WINDOW = 0.05
+
+
+class Sample:
+    """Per-unit sufficient statistics of one selection's delays."""
+
+    def __init__(self, label: str, units: Sequence[np.ndarray], quantile: float, threshold: float):
+        self.label = label
+        self.quantile = quantile
+        self.n = np.array([len(u) for u in units], dtype='float64')
+        self.sums = np.array([u.sum() for u in units], dtype='float64')
+        self.over = np.array([(u > threshold).sum() for u in units], dtype='float64')
+        values = np.concatenate(units)
+        self.values, inverse = np.unique(values, return_inverse=True)
+        unit_of_row = np.repeat(np.arange(len(units)), [len(u) for u in units])
+        # float32 counts are exact up to 2**24 rows per replicate
+        self.hist = np.zeros((len(units), len(self.values)), dtype='float32')
+        np.add.at(self.hist, (unit_of_row, inverse), 1)
+        # narrow histogram: [values below lo] + values lo..hi + [values above hi]
+        cum = np.cumsum(self.hist.sum(axis=0)) / len(values)
+        self.lo = int(np.searchsorted(cum, max(quantile - _QUANTILE_WINDOW, 0.0)))
+        self.hi = int(np.searchsorted(cum, min(quantile + _QUANTILE_WINDOW, 1.0)))
+        self.narrow = np.column_stack([self.hist[:, :self.lo].sum(axis=1), self.hist[:, self.lo:self.hi + 1],
+                                       self.hist[:, self.hi + 1:].sum(axis=1)])
+
+    @property
+    def units(self) -> int:
+        return len(self.n)
+
+    @property
+    def rows(self) -> int:
+        return int(self.n.sum())
+
+    def _quantile(self, hist: np.ndarray, total: np.ndarray) -> np.ndarray:
+        # smallest bin whose cumulative count reaches quantile * total (the inverted CDF)
+        cum = np.cumsum(hist, axis=1)
+        return np.argmax(cum >= (self.quantile * total)[:, None] - 1e-6, axis=1)
+
+    def statistics(self, weights: np.ndarray) -> np.ndarray:
+        """STATISTICS for every row of `weights` (replicates x units): array (3, replicates)."""
+        total = weights @ self.n
+        idx = self._quantile(weights.astype('float32') @ self.narrow, total)
+        q = np.empty(len(weights))
+        inside = (idx > 0) & (idx < self.narrow.shape[1] - 1)
+        q[inside] = self.values[self.lo + idx[inside] - 1]
+        if not inside.all():
+            w = weights[~inside].astype('float32')
+            q[~inside] = self.values[self._quantile(w @ self.hist, total[~inside])]
+        return np.vstack([weights @ self.sums / total, q, weights @ self.over / total])
+
+    def estimate(self) -> np.ndarray:
+        return self.statistics(np.ones((1, self.units)))[:, 0]
+
+
+def unit_weights(rng: np.random.Generator, replicates: int, units: int) -> np.ndarray:
+    """Draw an index matrix (replicates x units) of units with replacement; return how often each unit was drawn."""
+    drawn = rng.integers(0, units, size=(replicates, units))
+    flat = drawn + (np.arange(replicates) * units)[:, None]
+    return np.bincount(flat.ravel(), minlength=replicates * units).reshape(replicates, units).astype('float64')
+
+
+_samples: List[Sample] = []
+
+
+def _init_worker(samples: List[Sample]):
+    global _samples
+    _samples = samples
+
+
+def _replicate_batch(task):
+    """Worker: (seed sequence, replicates) -> array (selections, 3, replicates)."""
+    seed, replicates = task
+    rng = np.random.default_rng(seed)
+    return np.stack([s.statistics(unit_weights(rng, replicates, s.units)) for s in _samples])
+
+
+def bootstrap(samples: List[Sample], resamples: int = 10000, batch: int = 500, seed: int = 0, jobs: int = 1) -> np.ndarray:
+    """Bootstrap replicates of every sample's STATISTICS: array (selections, 3, resamples)."""
+    sizes = [min(batch, resamples - start) for start in range(0, resamples, batch)]
+    tasks = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+    if jobs > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(samples,)) as pool:
+            parts = list(pool.map(_replicate_batch, tasks))
+    else:
+        _init_worker(samples)
+        parts = [_replicate_batch(t) for t in tasks]
+    return np.concatenate(parts, axis=2)
+
+
+def split_units(delays: np.ndarray, unit: str, rows_per_block: int) -> List[np.ndarray]:
+    if unit == 'run' or len(delays) <= rows_per_block:
+        return [delays]
+    return np.array_split(delays, np.arange(rows_per_block, len(delays), rows_per_block))
+
+
+def load_sample(entries: List[Dict[str, object]], query: str, unit: str = 'run', block_seconds: float = 10.0,
+                quantile: float = 0.95, threshold: float = 100.0) -> Optional[Sample]:
+    """Sample of the delays selected by `query` (trace_query.py syntax), or None if nothing matches."""
+    from trace_query import run_query
+
+    df, _ = run_query(entries, query, columns=['delay(ms)'])
+    periods = {e['relpath']: e.get('period_ms') or 50 for e in entries}
+    units = []
+    for source, group in df.groupby('source', observed=True, sort=False):
+        d = group['delay(ms)'].to_numpy(dtype='float64', na_value=np.nan)
+        d = d[~np.isnan(d)]
+        if len(d):
+            units += split_units(d, unit, max(1, int(round(block_seconds * 1000 / periods.get(source, 50)))))
+    return Sample(query, units, quantile, threshold) if units else None
+
+
+def interval(replicates: np.ndarray, confidence: float):
+    alpha = (1 - confidence) / 2
+    return np.quantile(replicates, alpha, axis=-1), np.quantile(replicates, 1 - alpha, axis=-1)
+
+
+def p_value(diff: np.ndarray) -> np.ndarray:
+    """Two-sided bootstrap p-value of 'difference = 0', per statistic (rows of diff)."""
+    n = diff.shape[-1]
+    below = ((diff <= 0).sum(axis=-1) + 1) / (n + 1)
+    above = ((diff >= 0).sum(axis=-1) + 1) / (n + 1)
+    return np.minimum(1.0, 2 * np.minimum(below, above))
+
+
+def compare(samples: List[Sample], replicates: np.ndarray, confidence: float = 0.95) -> List[Dict[str, object]]:
+    """One row per selection and statistic: estimate and interval, and for later selections the difference to the first."""
+    rows = []
+    base_est = samples[0].estimate()
+    for i, s in enumerate(samples):
+        est = s.estimate()
+        lo, hi = interval(replicates[i], confidence)
+        if i:
+            diff = replicates[i] - replicates[0]
+            d_lo, d_hi = interval(diff, confidence)
+            p = p_value(diff)
+        for k, stat in enumerate(STATISTICS):
+            row = {'selection': s.label, 'statistic': stat, 'units': s.units, 'rows': s.rows,
+                   'estimate': est[k], 'ci_low': lo[k], 'ci_high': hi[k]}
+            if i:
+                row.update(diff=est[k] - base_est[k], diff_low=d_lo[k], diff_high=d_hi[k], p=p[k])
+            rows.append(row)
+    return rows
+
+
+FIELDS = ['selection', 'statistic', 'units', 'rows', 'estimate', 'ci_low', 'ci_high', 'diff', 'diff_low', 'diff_high', 'p']
+
+
+def write_csv(outfile: str, rows: List[Dict[str, object]]):
+    os.makedirs(os.path.dirname(os.path.abspath(outfile)), exist_ok=True)
+    with open(outfile, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.DictWriter(fh, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: ('' if row.get(k) is None else row[k]) for k in FIELDS})
+
+
+def stat_names(quantile: float, threshold: float) -> Dict[str, str]:
+    return {'mean': 'mean (ms)', 'quantile': f'p{quantile * 100:g} (ms)', 'over_rate': f'>{threshold:g} ms rate'}
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Bootstrap confidence intervals for delay statistics of catalog selections.")
+    p.add_argument('--select', action='append', required=True,
+                   help='Selection (trace_query.py syntax), e.g. "n8, urban"; repeat; later ones are compared with the first')
+    p.add_argument('--catalog', default='catalog.csv', help='Catalog built by dataset_catalog.py (default catalog.csv)')
+    p.add_argument('--unit', choices=['run', 'block'], default='run', help='Resampled unit (default run)')
+    p.add_argument('--block-seconds', type=float, default=10.0, help='Block length for --unit block (default 10 s)')
+    p.add_argument('--resamples', type=int, default=10000, help='Bootstrap replicates (default 10000)')
+    p.add_argument('--batch', type=int, default=500, help='Replicates per index matrix (default 500)')
+    p.add_argument('--confidence', type=float, default=0.95, help='Interval coverage (default 0.95)')
+    p.add_argument('--quantile', type=float, default=0.95, help='Delay quantile (default 0.95)')
+    p.add_argument('--threshold', type=float, default=100.0, help='Delay threshold of the rate, ms (default 100)')
+    p.add_argument('--seed', type=int, default=0, help='Random seed (default 0)')
+    p.add_argument('--jobs', type=int, default=1, help='Worker processes; 0 = one per CPU (default 1, serial)')
+    p.add_argument('--output', help='Write the table as CSV')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, 'bootstrap_compare')
+    if not 0 < args.quantile < 1 or not 0 < args.confidence < 1:
+        print("Error: --quantile and --confidence must be in (0, 1)", file=sys.stderr)
+        sys.exit(2)
+    if not os.path.exists(args.catalog):
+        print(f"Catalog {args.catalog} not found (build it with dataset_catalog.py build)", file=sys.stderr)
+        sys.exit(2)
+    from dataset_catalog import read_catalog
+
+    entries = read_catalog(args.catalog)
+    samples = []
+    with profiling.stage('load') as st:
+        for query in args.select:
+            try:
+                sample = load_sample(entries, query, args.unit, args.block_seconds, args.quantile, args.threshold)
+            except ValueError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                sys.exit(2)
+            if sample is None:
+                print(f"Error: no delays selected by {query!r}", file=sys.stderr)
+                sys.exit(1)
+            if sample.units < MIN_UNITS:
+                print(f"Warning: {query!r} has only {sample.units} {args.unit}s; its intervals are unreliable"
+                      + (" (try --unit block)" if args.unit == 'run' else ''), file=sys.stderr)
+            samples.append(sample)
+            st.add(rows=sample.rows)
+
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    t0 = time.perf_counter()
+    with profiling.stage('resample'):
+        replicates = bootstrap(samples, args.resamples, args.batch, args.seed, jobs)
+    elapsed = time.perf_counter() - t0
+    rows = compare(samples, replicates, args.confidence)
+    if args.output:
+        with profiling.stage('write'):
+            write_csv(args.output, rows)
+        print(f"Wrote {args.output}")
+
+    names = stat_names(args.quantile, args.threshold)
+    pct = f"{args.confidence * 100:g} %"
+    print(f"{args.resamples} resamples of {args.unit}s in {elapsed:.2f} s; {pct} percentile intervals")
+    for s in samples:
+        print(f"\n{s.label!r}: {s.units} {args.unit}s, {s.rows} rows")
+        for row in (r for r in rows if r['selection'] == s.label):
+            fmt = '.4f' if row['statistic'] == 'over_rate' else '.1f'
+            line = (f"  {names[row['statistic']]:16s} {row['estimate']:{fmt}} "
+                    f"[{row['ci_low']:{fmt}}, {row['ci_high']:{fmt}}]")
+            if 'diff' in row:
+                line += (f"   vs first: {row['diff']:+{fmt}} [{row['diff_low']:+{fmt}}, {row['diff_high']:+{fmt}}]"
+                         f"  p={row['p']:.4f}")
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+cicv5g.py
+
+Single entry point for the tools: `cicv5g.py COMMAND [ARGS...]` runs the
+main() of the tool behind COMMAND with ARGS, exactly as if the script had
+been called directly (same options, outputs and exit status).
+
+Only the selected tool is imported, and the tools import pandas, matplotlib
+and seaborn inside the functions that need them where only some of their
+paths do, so listing the commands or asking a command for --help does not
+pay for libraries the command will not use.
+
+Usage examples:
+  python cicv5g.py                       # list the commands
+  python cicv5g.py rsrp-stats --input-folder data/ --pattern "**/*.txt" --output rsrp_delay.csv
+  python cicv5g.py merge --input-folder data/ --pattern "**/*.txt" --stream
+  python cicv5g.py velocity-box --help
+
+  # as a command: alias cicv5g='python /path/to/Tools/cicv5g.py'
+
+Dependencies:
+  those of the selected tool
+"""
+import importlib
+import os
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# command -> (module, summary), in the order they are listed
+COMMANDS = {
+    'merge': ('merge_txt_to_xlsx', 'Merge trace files into one text file and an Excel workbook'),
+    'rsrp-stats': ('Statisticians_Number_Of_Different_Delay_Based_On_RSRP', 'Delay classes per RSRP bucket'),
+    'velocity-box': ('plot_delay_by_velocity', 'Box plot of delay per velocity'),
+    'violin': ('Draw_Violin_Plot_With_Impact_Of_Data_Transmission_On_Delay', 'Violin plot of delay per transmission frequency'),
+    'deviation': ('Draw_With_Impact_Of_Delay_On_Position_Deviation', 'RSRP, delay and position deviation of one run'),
+    'signal': ('Draw_With_Impact_Of_Signal_Strength_On_delay', 'Delay-class probabilities by signal strength and speed'),
+    'deviation-stats': ('position_deviation', 'Lateral/longitudinal deviation vs delay for every run with pose columns'),
+    'catalog': ('dataset_catalog', 'Build and query the dataset catalog'),
+    'query': ('trace_query', 'Rows matching path and column filters, with file pruning'),
+    'parquet': ('parquet_dataset', 'Export every run once as partitioned Parquet, or scan an export'),
+    'cube': ('aggregate_cube', 'RSRP x SINR x delay-class count cube'),
+    'bins': ('binning', 'N-dimensional count tables over trace columns'),
+    'rolling': ('rolling_stats', 'Rolling delay statistics and outage episodes'),
+    'spatial': ('spatial_index', 'Delay near a point or route, and heatmaps'),
+    'handover': ('handover', 'Delay, RSRP and SINR around serving-cell changes'),
+    'sketch': ('quantile_sketch', 'Streaming delay percentiles'),
+    'compare': ('bootstrap_compare', 'Bootstrap intervals of delay statistics between selections'),
+    'load': ('trace_loader', 'Per-layout summary of trace files'),
+    'cache': ('trace_cache', 'Build or clear the parsed-trace cache'),
+    'schema': ('trace_schema', 'Compact schema memory report and timestamp check'),
+    'live': ('live_ingest', 'Live ingest service with rolling statistics'),
+    'emulate': ('delay_emulator', 'UDP relay delaying datagrams by recorded delays'),
+    'render': ('render_figures', 'Render the figures of a spec file'),
+    'synth': ('synth_traces', 'Scaled synthetic copy of the dataset'),
+    'bench': ('benchmark', 'Time and memory benchmarks of the hot paths'),
+}
+
+
+def usage() -> str:
+    width = max(len(name) for name in COMMANDS)
+    lines = ['usage: cicv5g COMMAND [ARGS...]', '', 'commands:']
+    lines += [f'  {name:{width}s}  {summary}' for name, (_, summary) in COMMANDS.items()]
+    lines += ['', "Run 'cicv5g COMMAND --help' for the options of a command."]
+    return '\n'.join(lines)
+
+
+def run(command: str, args):
+    """Run the main() of `command` with command-line arguments `args`."""
+    module_name = COMMANDS[command][0]
+    if TOOLS_DIR not in sys.path:
+        sys.path.insert(0, TOOLS_DIR)
+    module = importlib.import_module(module_name)
+    # the tools parse sys.argv; argv[0] names the command in their usage and error messages
+    sys.argv = [f'cicv5g {command}'] + list(args)
+    return module.main()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return
+    command = argv[0]
+    if command not in COMMANDS:
+        import difflib
+        close = difflib.get_close_matches(command, COMMANDS, n=3)
+        hint = f" (did you mean {', '.join(close)}?)" if close else ''
+        print(f"cicv5g: unknown command {command!r}{hint}\n\n{usage()}", file=sys.stderr)
+        sys.exit(2)
+    run(command, argv[1:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""
+dataset_catalog.py
+
+Build a catalog of the CICV5G dataset from the directory tree and filenames,
+and select files from it by query without opening them.
+
+The metadata lives only in paths such as
+  Urban road/2-n78/v20/urban_n78_v20_run03.txt
+  Urban road/3-Data transmission frequency/10ms/n8/v30/v2v_info-01.txt
+  Rural and off-road/south_n8_v10_05.txt
+  W2S/n8/V30/w2s_n8_v30_run01.txt
+The builder walks data/ once and records, per file: scenario, network mode
+(n8/n78), velocity (km/h), sampling period (ms, 50 unless the path says
+otherwise), direction (w2s/s2w), run number, row count, pub_time span and
+the min/max of the delay, RSRP, SINR and logged speed columns (used by
+trace_query.py to skip files that cannot match a row filter).
+Merged copies (all.txt, westn8all.txt, v40n78.txt, *.csv, *.xlsx - anything
+without a run number or not a .txt) are flagged `derived` so that queries do
+not count the same samples twice.
+
+Query syntax: comma-separated terms, all of which must hold.
+  bare words     match scenario, network or direction   (arterial, n78, w2s)
+  comparisons    velocity|v, period|ms, run, rows        (v>=50, period=10, run<3)
+  derived        include merged copies as well
+
+Usage examples:
+  # build the catalog (row counts come from the parsed-file cache)
+  python dataset_catalog.py build --data-root data/ --output catalog.csv
+
+  # list files: n78, at least 50 km/h, arterial road
+  python dataset_catalog.py query --catalog catalog.csv "n78, v>=50, arterial"
+
+  # other tools accept the same query
+  python Statisticians_Number_Of_Different_Delay_Based_On_RSRP.py --catalog catalog.csv --query "n8, urban"
+"""
+import argparse
+import csv
+import glob
+import os
+import re
+import sys
+from typing import Dict, List, Optional
+
+import profiling
+
+DATA_EXTENSIONS = ('.txt', '.csv', '.xlsx')
+
+SCENARIOS = {
+    'arterial road': 'arterial',
+    'urban road': 'urban',
+    'rural and off-road': 'rural',
+    'w2s': 'w2s',
+}
+
+FIELDS = ['path', 'relpath', 'scenario', 'network', 'velocity', 'period_ms', 'direction', 'run',
+          'derived', 'format', 'layout', 'rows', 't_start', 't_end', 'size', 'mtime_ns',
+          'delay_min', 'delay_max', 'rsrp_min', 'rsrp_max', 'sinr_min', 'sinr_max', 'speed_min', 'speed_max']
+
+NUMERIC_FIELDS = {'velocity', 'period_ms', 'run', 'rows', 't_start', 't_end', 'size', 'mtime_ns'}
+
+# per-file min/max statistics: catalog field prefix -> trace column (stored as <prefix>_min, <prefix>_max)
+STAT_COLUMNS = {'delay': 'delay(ms)', 'rsrp': 'rsrp(db)', 'sinr': 'sinr(db)', 'speed': 'velocity(m/s)'}
+FLOAT_FIELDS = {f'{k}_{s}' for k in STAT_COLUMNS for s in ('min', 'max')}
+
+DEFAULT_PERIOD_MS = 50
+
+# query aliases -> catalog field
+QUERY_FIELDS = {'v': 'velocity', 'velocity': 'velocity', 'period': 'period_ms', 'ms': 'period_ms',
+                'period_ms': 'period_ms', 'run': 'run', 'rows': 'rows'}
+
+_TOKEN_SPLIT = re.compile(r'[_\-\s]+')
+_TERM = re.compile(r'^(\w+)\s*(<=|>=|==|!=|<|>|=|≤|≥)\s*([-+]?\d+(?:\.\d+)?)$')
+_OPS = {
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b, '≤': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b, '≥': lambda a, b: a >= b,
+    '=': lambda a, b: a == b, '==': lambda a, b: a == b, '!=': lambda a, b: a != b,
+}
+
+
+def parse_path(relpath: str) -> Dict[str, object]:
+    """Extract metadata from a path relative to the data root."""
+    parts = relpath.replace('\\', '/').split('/')
+    dirs, filename = parts[:-1], parts[-1]
+    stem, ext = os.path.splitext(filename)
+    file_tokens = [t.lower() for t in _TOKEN_SPLIT.split(stem) if t]
+    dir_tokens = [t.lower() for d in dirs for t in _TOKEN_SPLIT.split(d) if t]
+
+    meta = {'scenario': SCENARIOS.get(dirs[0].lower()) if dirs else None, 'network': None, 'velocity': None,
+            'period_ms': DEFAULT_PERIOD_MS, 'direction': None, 'run': None, 'format': ext.lower().lstrip('.')}
+
+    # filename tokens take precedence over directory tokens
+    for tokens in (dir_tokens, file_tokens):
+        for tok in tokens:
+            if tok in ('n8', 'n78'):
+                meta['network'] = tok
+            elif re.fullmatch(r'v\d+', tok):
+                meta['velocity'] = int(tok[1:])
+            elif re.fullmatch(r'\d+ms', tok):
+                meta['period_ms'] = int(tok[:-2])
+            elif tok in ('w2s', 's2w'):
+                meta['direction'] = tok
+    if meta['velocity'] is None:
+        # e.g. "Arterial road/n78/50/..."
+        numeric_dirs = [d for d in dirs if d.isdigit()]
+        if numeric_dirs:
+            meta['velocity'] = int(numeric_dirs[-1])
+
+    run_tokens = [t for t in file_tokens if re.fullmatch(r'run\d+', t)]
+    if run_tokens:
+        meta['run'] = int(run_tokens[-1][3:])
+    elif len(file_tokens) > 1 and file_tokens[-1].isdigit():
+        meta['run'] = int(file_tokens[-1])
+
+    meta['derived'] = meta['format'] != 'txt' or meta['run'] is None
+    return meta
+
+
+def column_stats(cols) -> Dict[str, object]:
+    """t_start/t_end and the STAT_COLUMNS min/max fields of one file's columns ({name: array})."""
+    # imported here so that loading/querying a catalog does not pull in numpy
+    import numpy as np
+
+    stats = {'t_start': None, 't_end': None}
+    pub = cols.get('pub_time(ms)')
+    if pub is not None and len(pub):
+        stats['t_start'] = int(np.min(pub))
+        stats['t_end'] = int(np.max(pub))
+    for key, col in STAT_COLUMNS.items():
+        values = np.asarray(cols[col], dtype='float64') if col in cols else np.empty(0)
+        values = values[~np.isnan(values)]
+        stats[f'{key}_min'] = float(values.min()) if len(values) else None
+        stats[f'{key}_max'] = float(values.max()) if len(values) else None
+    return stats
+
+
+def _trace_stats(path: str) -> Dict[str, object]:
+    # imported here so that loading/querying a catalog does not pull in pandas
+    from trace_cache import ensure_entry, load_columns
+
+    _, entry_meta, _ = ensure_entry(path)
+    stats = {'layout': entry_meta['layout'], 'rows': entry_meta['rows']}
+    stats.update(column_stats(load_columns(path, ['pub_time(ms)'] + list(STAT_COLUMNS.values()))))
+    return stats
+
+
+def build_catalog(data_root: str, quiet: bool = True) -> List[Dict[str, object]]:
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(data_root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.lower().endswith(DATA_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, name)
+            relpath = os.path.relpath(path, data_root).replace(os.sep, '/')
+            entry = {'path': os.path.abspath(path), 'relpath': relpath, 'layout': None, 'rows': None, 't_start': None, 't_end': None}
+            entry.update(parse_path(relpath))
+            st = os.stat(path)
+            entry['size'] = st.st_size
+            entry['mtime_ns'] = st.st_mtime_ns
+            if entry['format'] == 'txt':
+                try:
+                    entry.update(_trace_stats(path))
+                except (OSError, ValueError) as e:
+                    print(f"Warning: could not read {path}: {e}", file=sys.stderr)
+            entries.append(entry)
+            if not quiet:
+                print(f"{'derived' if entry['derived'] else 'run':7s} {str(entry['rows']):>8s}  {relpath}")
+    return entries
+
+
+def write_catalog(entries: List[Dict[str, object]], outfile: str):
+    outdir = os.path.dirname(os.path.abspath(outfile))
+    os.makedirs(outdir, exist_ok=True)
+    with open(outfile, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.DictWriter(fh, fieldnames=FIELDS)
+        writer.writeheader()
+        for entry in entries:
+            writer.writerow({k: ('' if entry.get(k) is None else entry[k]) for k in FIELDS})
+
+
+def read_catalog(catalog_file: str) -> List[Dict[str, object]]:
+    """Entries of a catalog CSV; relative paths (e.g. in a parquet_dataset.py manifest) are resolved against its folder."""
+    base = os.path.dirname(os.path.abspath(catalog_file))
+    entries = []
+    with open(catalog_file, 'r', newline='', encoding='utf-8') as fh:
+        for row in csv.DictReader(fh):
+            entry = {}
+            for k, v in row.items():
+                if v == '':
+                    entry[k] = None
+                elif k in NUMERIC_FIELDS:
+                    entry[k] = int(v)
+                elif k in FLOAT_FIELDS:
+                    entry[k] = float(v)
+                elif k == 'derived':
+                    entry[k] = v == 'True'
+                else:
+                    entry[k] = v
+            if entry.get('path') and not os.path.isabs(entry['path']):
+                entry['path'] = os.path.join(base, entry['path'])
+            entries.append(entry)
+    return entries
+
+
+def parse_query(query: str):
+    """Return (predicates, include_derived) for a query string (see module docstring)."""
+    predicates = []
+    include_derived = False
+    for term in (t.strip() for t in query.split(',')):
+        if not term:
+            continue
+        low = term.lower()
+        if low == 'derived':
+            include_derived = True
+            continue
+        m = _TERM.match(low)
+        if m:
+            field = QUERY_FIELDS.get(m.group(1))
+            if field is None:
+                raise ValueError(f"Unknown query field {m.group(1)!r} in {term!r}")
+            op, value = _OPS[m.group(2)], float(m.group(3))
+            predicates.append(lambda e, f=field, op=op, v=value: e.get(f) is not None and op(e[f], v))
+        elif re.fullmatch(r'[\w\-]+', low):
+            predicates.append(lambda e, w=low: w in (e.get('scenario'), e.get('network'), e.get('direction')))
+        else:
+            raise ValueError(f"Cannot parse query term {term!r}")
+    return predicates, include_derived
+
+
+def select(entries: List[Dict[str, object]], query: str = '', include_derived: Optional[bool] = None):
+    predicates, wants_derived = parse_query(query)
+    if include_derived is None:
+        include_derived = wants_derived
+    return [e for e in entries
+            if (include_derived or not e['derived']) and all(p(e) for p in predicates)]
+
+
+def run_files(folder: str, pattern: str = '**/*.txt', include_derived: bool = False) -> List[str]:
+    """
+    Files below `folder` matching the recursive glob `pattern`, without the merged
+    copies (all.txt, westn8all.txt, ...) unless include_derived: they repeat the
+    rows of the runs, so every count or percentile over both would see them twice.
+    """
+    files = sorted(glob.glob(os.path.join(folder, pattern), recursive=True))
+    if include_derived:
+        return files
+    return [f for f in files if not parse_path(os.path.relpath(f, folder).replace(os.sep, '/'))['derived']]
+
+
+def query_files(catalog_file: str, query: str) -> List[str]:
+    """Paths of the catalog entries matching `query` (convenience for other tools)."""
+    return [e['path'] for e in select(read_catalog(catalog_file), query)]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Build and query a catalog of the CICV5G dataset.")
+    sub = p.add_subparsers(dest='command', required=True)
+    b = sub.add_parser('build', help='Walk the data folder and write the catalog.')
+    b.add_argument('--data-root', required=True, help='Root of the dataset (the data/ folder).')
+    b.add_argument('--output', default='catalog.csv', help='Catalog CSV path (default catalog.csv).')
+    b.add_argument('--quiet', action='store_true', help='Suppress per-file messages.')
+    profiling.add_arguments(b)
+    q = sub.add_parser('query', help='Print the paths of matching files, one per line.')
+    q.add_argument('--catalog', default='catalog.csv', help='Catalog CSV path (default catalog.csv).')
+    q.add_argument('query', nargs='?', default='', help='Query, e.g. "n78, v>=50, arterial".')
+    q.add_argument('--long', action='store_true', help='Print metadata columns as well.')
+    profiling.add_arguments(q)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, f'dataset_catalog {args.command}')
+    if args.command == 'build':
+        with profiling.stage('scan') as st:
+            entries = build_catalog(args.data_root, quiet=args.quiet)
+            st.add(rows=sum(e['rows'] or 0 for e in entries), bytes=sum(e['size'] for e in entries))
+        with profiling.stage('write'):
+            write_catalog(entries, args.output)
+        runs = [e for e in entries if not e['derived']]
+        print(f"Catalogued {len(entries)} files ({len(runs)} runs, {len(entries) - len(runs)} derived copies), "
+              f"{sum(e['rows'] or 0 for e in runs)} rows in runs. Wrote {args.output}")
+        return
+
+    try:
+        with profiling.stage('select'):
+            matches = select(read_catalog(args.catalog), args.query)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+    for e in matches:
+        if args.long:
+            print('\t'.join('' if e.get(k) is None else str(e[k]) for k in ('relpath', 'scenario', 'network', 'velocity',
+                                                        'period_ms', 'direction', 'run', 'rows')))
+        else:
+            print(e['path'])
+
+
+if __name__ == '__main__':
+    main()
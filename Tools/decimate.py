@@ -0,0 +1,102 @@
+"""
+decimate.py
+
+Shape-preserving downsampling of long time series for plotting.
+
+Two methods, both returning sorted indices into the original arrays so that
+several series can be thinned independently and still be plotted against
+their own x values:
+
+  minmax  split the x range into equal-width buckets (about one per output
+          pixel column) and keep the first, last, minimum and maximum sample of
+          each bucket. Every spike survives exactly; vectorized.
+  lttb    Largest-Triangle-Three-Buckets (Steinarsson 2013): one sample per
+          bucket, chosen to maximise the triangle area with its neighbours.
+          Smoother result for a fixed point budget; loops over buckets only.
+
+The first and last samples are always kept and NaNs are dropped. Series that
+are already within the budget are returned unchanged.
+
+Usage examples:
+  from decimate import decimate
+  idx = decimate(t, delay, max_points=4000)            # minmax
+  ax.plot(t[idx], delay[idx])
+  idx = decimate(t, rsrp, max_points=4000, method='lttb')
+
+Dependencies:
+  numpy
+"""
+import numpy as np
+
+METHODS = ('minmax', 'lttb', 'none')
+
+
+def _finite(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    return np.flatnonzero(~(np.isnan(x) | np.isnan(y)))
+
+
+def minmax_indices(x, y, max_points: int) -> np.ndarray:
+    """Indices of first/last/min/max per x bucket, at most ~max_points of them."""
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    keep = _finite(x, y)
+    if len(keep) <= max_points:
+        return keep
+    xs, ys = x[keep], y[keep]
+    n_buckets = max(1, max_points // 4)
+    lo, hi = xs.min(), xs.max()
+    if hi == lo:
+        bucket = np.zeros(len(xs), dtype='int64')
+    else:
+        bucket = np.minimum(((xs - lo) / (hi - lo) * n_buckets).astype('int64'), n_buckets - 1)
+    # sort by bucket, then by y (stable, so ties keep time order); first/last of each run are min/max
+    order = np.lexsort((ys, bucket))
+    b_sorted = bucket[order]
+    starts = np.flatnonzero(np.r_[True, b_sorted[1:] != b_sorted[:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+    by_time = np.argsort(bucket, kind='stable')
+    bt_sorted = bucket[by_time]
+    t_starts = np.flatnonzero(np.r_[True, bt_sorted[1:] != bt_sorted[:-1]])
+    t_ends = np.r_[t_starts[1:], len(by_time)] - 1
+    chosen = np.concatenate([order[starts], order[ends], by_time[t_starts], by_time[t_ends]])
+    return keep[np.unique(chosen)]
+
+
+def lttb_indices(x, y, max_points: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets selection of max_points samples."""
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    keep = _finite(x, y)
+    n = len(keep)
+    if n <= max_points or max_points < 3:
+        return keep
+    xs, ys = x[keep], y[keep]
+    # interior samples 1..n-2 split into max_points-2 buckets
+    edges = np.linspace(1, n - 1, max_points - 1).astype('int64')
+    out = np.empty(max_points, dtype='int64')
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, stop = edges[i], max(edges[i + 1], edges[i] + 1)
+        # average of the next bucket (the last sample for the final bucket)
+        if i + 2 < len(edges):
+            nxt = slice(edges[i + 1], max(edges[i + 2], edges[i + 1] + 1))
+            cx, cy = xs[nxt].mean(), ys[nxt].mean()
+        else:
+            cx, cy = xs[-1], ys[-1]
+        bx, by = xs[start:stop], ys[start:stop]
+        area = np.abs((xs[a] - cx) * (by - ys[a]) - (xs[a] - bx) * (cy - ys[a]))
+        a = start + int(np.argmax(area))
+        out[i + 1] = a
+    return keep[out]
+
+
+def decimate(x, y, max_points: int = 4000, method: str = 'minmax') -> np.ndarray:
+    """Indices of the samples to plot; see the module docstring for the methods."""
+    if method == 'minmax':
+        return minmax_indices(x, y, max_points)
+    if method == 'lttb':
+        return lttb_indices(x, y, max_points)
+    if method == 'none':
+        return _finite(np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64'))
+    raise ValueError(f"Unknown decimation method {method!r}; expected one of {', '.join(METHODS)}")
@@ -0,0 +1,499 @@
+"""
+delay_emulator.py
+
+Trace-driven UDP delay emulator for closed-loop planning/control tests.
+
+`relay` listens on --listen and forwards every datagram to --target after a
+delay taken from a recorded run; the target's replies go back to the sender
+(each sender gets its own upstream socket, like a NAT), undelayed unless
+--direction reverse/both. Every sender address is one stream with its own
+position in the delay sequence (a random start by default, so streams are
+not in lockstep), and with --fifo (default) a stream's datagrams never
+overtake each other, as on one network path.
+
+Delay sources:
+  --trace FILE ...       the delay(ms) column of recorded runs (streams take
+                         them in turn), e.g. arterial_n78_v80_run01.txt
+  --input-folder/--query the runs to sample from, restricted by --rsrp LO HI
+                         (dBm) and/or --velocity LO HI (km/h): blocks of
+                         --block consecutive rows meeting the condition are
+                         drawn at random and chained, so outage bursts are
+                         kept while the conditions hold
+--timing clock (default) applies the delay recorded at the same time since
+the stream started (pub_time(ms) of the run; the runs log every 30-100 ms,
+the controller may send faster); --timing message takes the next row per
+datagram. --delay-scale multiplies every delay.
+
+Scheduling: one event loop and one heap of pending datagrams for all
+streams. The loop's timers wake up to 1 ms late (epoll has millisecond
+timeouts), so the scheduler asks to be woken 1.2 ms before a datagram is due
+and busy-waits the rest, at most 2 ms per wakeup and 25% of the wall time in
+total. Past that budget it sends everything due within the next half
+millisecond without waiting, i.e. up to 0.5 ms early. Measured with `check
+--rate 100 --seconds 5` on an otherwise idle 1-CPU VM: p99 error 0.5-0.9 ms
+at 1, 10 and 40 streams (40 streams run on the budget: mean -0.3 ms), maximum
+1-7 ms. The maximum, and on a busy host the p99 as well, is set by the host
+descheduling the process: with other load on the same CPU the p99 rose to
+2-14 ms and the maximum to 10-40 ms, and no wait inside the process helps
+against that. `check` runs a sink, the
+relay and N senders at a given rate in one process and reports the error
+distribution and CPU use; datagrams still held back when it stops (trace
+delays run up to tens of seconds) count as not forwarded.
+
+Usage examples:
+  # controller talks to 127.0.0.1:9000, planner listens on 127.0.0.1:9100
+  python delay_emulator.py relay --listen 127.0.0.1:9000 --target 127.0.0.1:9100 \\
+      --trace "data/Arterial road/n8/v80/arterial_n8_v80_run01.txt"
+
+  # delays of weak-signal rows (RSRP <= -95 dBm) at 40-60 km/h
+  python delay_emulator.py relay --listen :9000 --target 127.0.0.1:9100 --input-folder data/ --rsrp -140 -95 --velocity 40 60
+
+  # 40 streams at 100 Hz for 10 s: timing error and CPU
+  python delay_emulator.py check --streams 40 --rate 100 --seconds 10 --input-folder data/
+
+Dependencies:
+  numpy (standard-library asyncio)
+"""
+import argparse
+import asyncio
+import heapq
+import os
+import sys
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import profiling
+
+DEFAULT_BLOCK_ROWS = 200
+DEFAULT_PERIOD_MS = 50.0
+
+# loop timers fire up to ~1 ms late: wake this long before the next datagram is due ...
+_WAKE_EARLY = 0.0012
+# ... and busy-wait the rest, for at most this long per wakeup and this share of the wall time;
+# past that budget, send what is due within half a millisecond without waiting
+_SPIN_MAX = 0.002
+_SPIN_BUDGET = 0.25
+_HALF_MS = 0.0005
+
+_ERRORS_KEPT = 200_000
+
+
+class DelayTrace:
+    """A delay sequence (ms) with the time of each value (ms since the start)."""
+
+    def __init__(self, delays: np.ndarray, times: np.ndarray, name: str = ''):
+        self.delays = np.asarray(delays, dtype='float64')
+        self.times = np.asarray(times, dtype='float64')
+        self.name = name
+        self.duration = float(self.times[-1] + np.median(np.diff(self.times))) if len(self.times) > 1 else DEFAULT_PERIOD_MS
+
+    def __len__(self):
+        return len(self.delays)
+
+
+def load_trace(path: str) -> DelayTrace:
+    """delay(ms) of a run file by pub_time(ms) (rows without either are dropped)."""
+    from trace_cache import load_columns
+
+    cols = load_columns(path, ['pub_time(ms)', 'delay(ms)'])
+    t = np.asarray(cols['pub_time(ms)'], dtype='float64')
+    d = np.asarray(cols['delay(ms)'], dtype='float64')
+    keep = np.isfinite(t) & np.isfinite(d)
+    t, d = t[keep], d[keep]
+    if len(d) == 0:
+        raise ValueError(f"{path}: no delay values")
+    order = np.argsort(t, kind='stable')
+    return DelayTrace(d[order], t[order] - t[order][0], os.path.basename(path))
+
+
+def conditioned_trace(files: Sequence[str], rsrp: Optional[Tuple[float, float]] = None,
+                      velocity: Optional[Tuple[float, float]] = None, block: int = DEFAULT_BLOCK_ROWS,
+                      rows: int = 100_000, rng: Optional[np.random.Generator] = None) -> DelayTrace:
+    """
+    Chain random blocks of consecutive rows whose RSRP (dBm) and velocity (km/h) lie in the
+    given closed ranges, until `rows` delays are collected.
+    """
+    from trace_cache import load_columns
+
+    rng = rng or np.random.default_rng()
+    segments, periods = [], []
+    for f in files:
+        try:
+            cols = load_columns(f, ['pub_time(ms)', 'delay(ms)', 'rsrp(db)', 'velocity(m/s)'])
+        except (OSError, ValueError) as e:
+            print(f"Warning: skipping {f}: {e}", file=sys.stderr)
+            continue
+        d = np.asarray(cols['delay(ms)'], dtype='float64')
+        ok = np.isfinite(d)
+        if rsrp is not None:
+            r = np.asarray(cols['rsrp(db)'], dtype='float64')
+            ok &= (r >= rsrp[0]) & (r <= rsrp[1])
+        if velocity is not None:
+            v = np.asarray(cols['velocity(m/s)'], dtype='float64') * 3.6
+            ok &= (v >= velocity[0]) & (v <= velocity[1])
+        # runs of consecutive qualifying rows
+        edges = np.flatnonzero(np.diff(np.r_[0, ok.astype('int8'), 0]))
+        segments.extend(d[a:b] for a, b in zip(edges[::2], edges[1::2]))
+        t = np.asarray(cols['pub_time(ms)'], dtype='float64')
+        steps = np.diff(t[np.isfinite(t)])
+        if (steps > 0).any():
+            periods.append(np.median(steps[steps > 0]))
+    if not segments:
+        raise ValueError("No rows meet the RSRP/velocity conditions")
+    lengths = np.array([len(s) for s in segments], dtype='float64')
+    out, total = [], 0
+    while total < rows:
+        s = segments[rng.choice(len(segments), p=lengths / lengths.sum())]
+        start = rng.integers(0, max(len(s) - block, 0) + 1)
+        piece = s[start:start + block]
+        out.append(piece)
+        total += len(piece)
+    delays = np.concatenate(out)[:rows]
+    period = float(np.median(periods)) if periods else DEFAULT_PERIOD_MS
+    return DelayTrace(delays, np.arange(len(delays)) * period, 'conditioned')
+
+
+class Stream:
+    """Position of one sender in its delay trace."""
+
+    def __init__(self, trace: DelayTrace, start_ms: float, timing: str, scale: float, fifo: bool):
+        self.trace = trace
+        self.start_ms = start_ms
+        self.timing = timing
+        self.scale = scale
+        self.fifo = fifo
+        self.t0 = None
+        self.row = int(np.searchsorted(trace.times, start_ms, side='right')) - 1
+        self.last_due = 0.0
+        self.sent = 0
+
+    def delay_s(self, now: float) -> float:
+        tr = self.trace
+        if self.timing == 'message':
+            self.row = (self.row + 1) % len(tr)
+        else:
+            if self.t0 is None:
+                self.t0 = now
+            at = (self.start_ms + (now - self.t0) * 1000.0) % tr.duration
+            self.row = max(int(np.searchsorted(tr.times, at, side='right')) - 1, 0)
+        return tr.delays[self.row] * self.scale / 1000.0
+
+    def due(self, now: float) -> float:
+        due = now + self.delay_s(now)
+        if self.fifo:
+            due = max(due, self.last_due)
+        self.last_due = due
+        self.sent += 1
+        return due
+
+
+class DelayScheduler:
+    """Sends datagrams at their due times (loop.time() seconds) from one heap."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.heap = []
+        self.seq = 0
+        self.timer = None
+        self.timer_at = None
+        self.errors = deque(maxlen=_ERRORS_KEPT)
+        self.sent = 0
+        self.started = loop.time()
+        self.spun = 0.0
+
+    def schedule(self, due: float, transport, data: bytes, addr):
+        heapq.heappush(self.heap, (due, self.seq, transport, data, addr))
+        self.seq += 1
+        if self.timer_at is None or due - _WAKE_EARLY < self.timer_at:
+            self._arm()
+
+    def _arm(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer_at = self.heap[0][0] - _WAKE_EARLY
+        self.timer = self.loop.call_at(self.timer_at, self._wake)
+
+    def _wake(self):
+        self.timer = self.timer_at = None
+        now = self.loop.time()
+        spin = self.spun < _SPIN_BUDGET * (now - self.started)
+        horizon = now + (_SPIN_MAX if spin else _HALF_MS)
+        while self.heap and self.heap[0][0] <= horizon:
+            due = self.heap[0][0]
+            if spin and now < due:
+                t0 = now
+                while now < due:
+                    now = self.loop.time()
+                self.spun += now - t0
+            _, _, transport, data, addr = heapq.heappop(self.heap)
+            if not transport.is_closing():
+                transport.sendto(data, addr)
+            now = self.loop.time()
+            self.errors.append(now - due)
+            self.sent += 1
+        if self.heap:
+            self._arm()
+
+    def error_stats(self) -> dict:
+        e = np.array(self.errors) * 1000.0
+        if len(e) == 0:
+            return {'count': 0}
+        return {'count': len(e), 'mean_ms': float(e.mean()), 'p50_ms': float(np.percentile(e, 50)),
+                'p99_abs_ms': float(np.percentile(np.abs(e), 99)), 'max_abs_ms': float(np.abs(e).max())}
+
+
+class _Upstream(asyncio.DatagramProtocol):
+    """Per-sender socket towards the target; replies go back to that sender."""
+
+    def __init__(self, relay: 'Relay', client):
+        self.relay = relay
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.relay.reply(self.client, data)
+
+
+class Relay(asyncio.DatagramProtocol):
+    def __init__(self, traces: Sequence[DelayTrace], target: Tuple[str, int], timing: str = 'clock',
+                 direction: str = 'forward', scale: float = 1.0, fifo: bool = True, random_start: bool = True,
+                 seed: Optional[int] = None):
+        self.traces = list(traces)
+        self.target = target
+        self.timing = timing
+        self.direction = direction
+        self.scale = scale
+        self.fifo = fifo
+        self.random_start = random_start
+        self.rng = np.random.default_rng(seed)
+        self.loop = asyncio.get_running_loop()
+        self.scheduler = DelayScheduler(self.loop)
+        self.transport = None
+        self.streams: Dict[tuple, Stream] = {}
+        self.back: Dict[tuple, Stream] = {}
+        self.upstream: Dict[tuple, asyncio.DatagramTransport] = {}
+        self.pending: Dict[tuple, list] = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def _new_stream(self) -> Stream:
+        trace = self.traces[len(self.streams) % len(self.traces)]
+        start = self.rng.uniform(0, trace.duration) if self.random_start else 0.0
+        return Stream(trace, start, self.timing, self.scale, self.fifo)
+
+    def datagram_received(self, data, addr):
+        now = self.loop.time()
+        if addr not in self.streams:
+            self.streams[addr] = self._new_stream()
+            self.pending[addr] = []
+            self.loop.create_task(self._open_upstream(addr))
+        stream = self.streams[addr]
+        due = stream.due(now) if self.direction in ('forward', 'both') else now
+        up = self.upstream.get(addr)
+        if up is None:
+            # upstream socket still being created
+            self.pending[addr].append((due, data))
+        else:
+            self.scheduler.schedule(due, up, data, None)
+
+    async def _open_upstream(self, addr):
+        transport, _ = await self.loop.create_datagram_endpoint(lambda: _Upstream(self, addr), remote_addr=self.target)
+        self.upstream[addr] = transport
+        for due, data in self.pending.pop(addr, []):
+            self.scheduler.schedule(due, transport, data, None)
+
+    def reply(self, client, data: bytes):
+        now = self.loop.time()
+        if self.direction in ('reverse', 'both'):
+            if client not in self.back:
+                self.back[client] = self._new_stream()
+            self.scheduler.schedule(self.back[client].due(now), self.transport, data, client)
+        else:
+            self.transport.sendto(data, client)
+
+    def close(self):
+        for t in self.upstream.values():
+            t.close()
+        if self.transport is not None:
+            self.transport.close()
+
+
+def _host_port(spec: str) -> Tuple[str, int]:
+    host, _, port = spec.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def _pair(values, name):
+    if values is None:
+        return None
+    lo, hi = values
+    if lo > hi:
+        raise ValueError(f"--{name}: {lo:g} > {hi:g}")
+    return float(lo), float(hi)
+
+
+def build_traces(args) -> List[DelayTrace]:
+    if args.trace:
+        return [load_trace(f) for f in args.trace]
+    if args.query is not None:
+        from dataset_catalog import query_files
+        files = query_files(args.catalog, args.query)
+    else:
+        from dataset_catalog import run_files
+        files = run_files(args.input_folder)
+    if not files:
+        raise ValueError("No run files selected")
+    rsrp, velocity = _pair(args.rsrp, 'rsrp'), _pair(args.velocity, 'velocity')
+    if rsrp is None and velocity is None and args.query is not None:
+        return [load_trace(f) for f in files]
+    return [conditioned_trace(files, rsrp, velocity, args.block, rng=np.random.default_rng(args.seed))]
+
+
+def _describe(traces: Sequence[DelayTrace]) -> str:
+    d = np.concatenate([t.delays for t in traces])
+    return (f"{len(traces)} delay trace(s), {len(d)} values: median {np.median(d):g} ms, "
+            f"p95 {np.percentile(d, 95):g} ms, max {d.max():g} ms")
+
+
+async def _report(relay: Relay, every: float):
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    while True:
+        await asyncio.sleep(every)
+        s = relay.scheduler.error_stats()
+        cpu = (time.process_time() - cpu0) / (time.perf_counter() - t0) * 100
+        if s['count']:
+            print(f"{len(relay.streams)} streams, {relay.scheduler.sent} sent; timing error p50 {s['p50_ms']:+.3f} ms, "
+                  f"p99 |{s['p99_abs_ms']:.3f}| ms, max |{s['max_abs_ms']:.3f}| ms; CPU {cpu:.0f}%")
+
+
+async def relay_main(args, traces):
+    loop = asyncio.get_running_loop()
+    relay = Relay(traces, _host_port(args.target), args.timing, args.direction, args.delay_scale,
+                  not args.allow_reorder, args.start == 'random', args.seed)
+    await loop.create_datagram_endpoint(lambda: relay, local_addr=_host_port(args.listen))
+    print(f"Relaying {args.listen} -> {args.target} with {_describe(traces)}")
+    try:
+        await _report(relay, args.report)
+    finally:
+        relay.close()
+
+
+class _Sink(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.received = 0
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        self.transport.sendto(data, addr)
+
+
+async def _sender(listen, rate: float, seconds: float, replies: list):
+    loop = asyncio.get_running_loop()
+
+    class _Echo(asyncio.DatagramProtocol):
+        def datagram_received(self, data, addr):
+            replies[0] += 1
+
+    transport, _ = await loop.create_datagram_endpoint(_Echo, remote_addr=listen)
+    t0 = loop.time() + np.random.uniform(0, 1.0 / rate)
+    n = int(seconds * rate)
+    for i in range(n):
+        wait = t0 + i / rate - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        transport.sendto(b'%d' % i)
+    await asyncio.sleep(1.0)
+    transport.close()
+
+
+async def check_main(args, traces):
+    loop = asyncio.get_running_loop()
+    sink_transport, sink = await loop.create_datagram_endpoint(_Sink, local_addr=('127.0.0.1', 0))
+    target = sink_transport.get_extra_info('sockname')[:2]
+    relay = Relay(traces, target, args.timing, args.direction, args.delay_scale, not args.allow_reorder,
+                  args.start == 'random', args.seed)
+    relay_transport, _ = await loop.create_datagram_endpoint(lambda: relay, local_addr=('127.0.0.1', 0))
+    listen = relay_transport.get_extra_info('sockname')[:2]
+    print(f"check: {args.streams} streams x {args.rate:g} Hz for {args.seconds:g} s with {_describe(traces)}")
+    replies = [0]
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(_sender(listen, args.rate, args.seconds, replies) for _ in range(args.streams)))
+    cpu = (time.process_time() - cpu0) / (time.perf_counter() - t0) * 100
+    s = relay.scheduler.error_stats()
+    relay.close()
+    sink_transport.close()
+    expected = args.streams * int(args.seconds * args.rate)
+    print(f"forwarded {sink.received}/{expected}, replies {replies[0]}; CPU {cpu:.0f}% (senders and sink included)")
+    if s['count']:
+        print(f"timing error: mean {s['mean_ms']:+.3f} ms, p50 {s['p50_ms']:+.3f} ms, "
+              f"p99 |{s['p99_abs_ms']:.3f}| ms, max |{s['max_abs_ms']:.3f}| ms")
+    return s
+
+
+def add_source_args(p):
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument('--trace', nargs='+', help='Run file(s) whose delay(ms) sequence is replayed')
+    src.add_argument('--input-folder', help='Sample delays from the runs under this folder (see --rsrp/--velocity)')
+    src.add_argument('--query', help='Sample delays from the catalog runs matching this query, e.g. "arterial, n78"')
+    p.add_argument('--catalog', default='catalog.csv', help='Catalog built by dataset_catalog.py (used with --query)')
+    p.add_argument('--rsrp', nargs=2, type=float, metavar=('LO', 'HI'), help='Only rows with RSRP in [LO, HI] dBm')
+    p.add_argument('--velocity', nargs=2, type=float, metavar=('LO', 'HI'), help='Only rows with velocity in [LO, HI] km/h')
+    p.add_argument('--block', type=int, default=DEFAULT_BLOCK_ROWS, help='Rows per sampled block (default 200)')
+    p.add_argument('--timing', choices=['clock', 'message'], default='clock',
+                   help='Delay by elapsed time (clock, default) or next row per datagram (message)')
+    p.add_argument('--direction', choices=['forward', 'reverse', 'both'], default='forward',
+                   help='Which direction is delayed (default forward: sender -> target)')
+    p.add_argument('--delay-scale', type=float, default=1.0, help='Multiply every delay (default 1)')
+    p.add_argument('--start', choices=['random', 'zero'], default='random', help='Where each stream starts in its trace')
+    p.add_argument('--allow-reorder', action='store_true', help='Let a shorter delay overtake an earlier datagram')
+    p.add_argument('--seed', type=int, help='Random seed for sampling and stream starts')
+    profiling.add_arguments(p)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="UDP relay that delays datagrams by recorded CICV5G delays.")
+    sub = p.add_subparsers(dest='command', required=True)
+    r = sub.add_parser('relay', help='Delay and forward datagrams from --listen to --target.')
+    r.add_argument('--listen', required=True, help='HOST:PORT the senders send to')
+    r.add_argument('--target', required=True, help='HOST:PORT datagrams are forwarded to')
+    r.add_argument('--report', type=float, default=10.0, help='Seconds between timing reports (default 10)')
+    add_source_args(r)
+    c = sub.add_parser('check', help='Measure timing error with local senders and sink.')
+    c.add_argument('--streams', type=int, default=40, help='Concurrent streams (default 40)')
+    c.add_argument('--rate', type=float, default=100.0, help='Datagrams per second per stream (default 100)')
+    c.add_argument('--seconds', type=float, default=10.0, help='Duration (default 10)')
+    add_source_args(c)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, f'delay_emulator {args.command}')
+    try:
+        with profiling.stage('load'):
+            traces = build_traces(args)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+    try:
+        with profiling.stage(args.command):
+            if args.command == 'relay':
+                asyncio.run(relay_main(args, traces))
+            else:
+                asyncio.run(check_main(args, traces))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
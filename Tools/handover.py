@@ -0,0 +1,274 @@
+"""
+handover.py
+
+Serving-cell changes (handovers) and the delay / RSRP / SINR around them.
+
+cellid(db) is dictionary-encoded (the trace cache already stores it as
+category codes), so a handover is a change between consecutive codes: one
+comparison over the run after rows without a cellid have been filled with
+the last known cell (a missing cellid is not a handover). Runs are ordered by
+pub_time(ms).
+
+For every handover at time t, rows with pub_time in [t - before, t) and
+[t, t + after) are summarised from prefix sums (count, mean delay, max delay,
+>threshold share, mean RSRP and SINR). A timeline of delay against time
+relative to the handover, in bins of --bin ms, is accumulated over all
+handovers: count, mean, p95 (inverted CDF) and >threshold share per bin.
+
+Files are analysed in worker processes with --jobs; the handover table and
+timeline are merged in file order.
+
+Usage examples:
+  # every run, 2 s before / 2 s after, handover table and timeline
+  python handover.py --input-folder data/ --output outputs/handovers.csv --timeline outputs/handover_timeline.csv --jobs 0
+
+  # arterial n78 runs from the catalog, 1 s windows
+  python handover.py --catalog catalog.csv --query "arterial, n78" --before 1000 --after 1000
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+import profiling
+from binning import format_value, group_quantile
+
+DEFAULT_BEFORE_MS = 2000
+DEFAULT_AFTER_MS = 2000
+DEFAULT_BIN_MS = 100
+DEFAULT_THRESHOLD_MS = 100
+
+COLUMNS = ['pub_time(ms)', 'delay(ms)', 'utmX(m)', 'utmY(m)', 'cellid(db)', 'rsrp(db)', 'sinr(db)']
+WINDOW_FIELDS = ['rows', 'mean_delay', 'max_delay', 'over_rate', 'mean_rsrp', 'mean_sinr']
+HANDOVER_FIELDS = (['file', 'time_ms', 'from_cell', 'to_cell', 'x', 'y'] +
+                   [f'before_{f}' for f in WINDOW_FIELDS] + [f'after_{f}' for f in WINDOW_FIELDS])
+
+
+def fill_codes(codes: np.ndarray) -> np.ndarray:
+    """Replace missing codes (-1) with the last known code; leading missing codes stay -1."""
+    known = codes >= 0
+    last = np.maximum.accumulate(np.where(known, np.arange(len(codes)), -1))
+    return np.where(last >= 0, codes[np.maximum(last, 0)], -1)
+
+
+def find_handovers(codes: np.ndarray) -> np.ndarray:
+    """Row indices where the (filled) serving cell differs from the previous row's."""
+    filled = fill_codes(np.asarray(codes))
+    change = (filled[1:] != filled[:-1]) & (filled[:-1] >= 0)
+    return np.flatnonzero(change) + 1
+
+
+def window_stats(values: Dict[str, np.ndarray], lo: np.ndarray, hi: np.ndarray,
+                 threshold: float) -> Dict[str, np.ndarray]:
+    """WINDOW_FIELDS for the rows lo[i]:hi[i] of each window, from prefix sums (NaNs ignored)."""
+    def prefix_diff(x):
+        c = np.r_[0, np.cumsum(x)]
+        return c[hi] - c[lo]
+
+    out = {}
+    delay = values['delay(ms)']
+    ok = ~np.isnan(delay)
+    n = prefix_diff(ok)
+    out['rows'] = n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out['mean_delay'] = prefix_diff(np.where(ok, delay, 0.0)) / n
+        out['over_rate'] = prefix_diff(ok & (delay > threshold)) / n
+        for field, col in (('mean_rsrp', 'rsrp(db)'), ('mean_sinr', 'sinr(db)')):
+            v = values[col]
+            ok_v = ~np.isnan(v)
+            out[field] = prefix_diff(np.where(ok_v, v, 0.0)) / prefix_diff(ok_v)
+    # windows overlap little and are short, so the max is taken per window
+    out['max_delay'] = np.array([np.nanmax(delay[a:b]) if c else np.nan for a, b, c in zip(lo, hi, n)])
+    return out
+
+
+def analyse_file(path: str, before: float = DEFAULT_BEFORE_MS, after: float = DEFAULT_AFTER_MS,
+                 bin_ms: float = DEFAULT_BIN_MS, threshold: float = DEFAULT_THRESHOLD_MS) -> dict:
+    """
+    Handovers of one run: {'handovers': {field: array}, 'offsets': bin of each timeline row,
+    'delays': its delay, 'rows': rows analysed}.
+    """
+    import pandas as pd
+    from trace_cache import load_columns
+
+    cols = load_columns(path, COLUMNS)
+    if 'cellid(db)' not in cols:
+        raise ValueError('no cellid(db) column')
+    cellid = pd.Categorical(cols['cellid(db)'])
+    t = np.asarray(cols['pub_time(ms)'], dtype='float64')
+    keep = np.flatnonzero(~np.isnan(t))
+    order = keep[np.argsort(t[keep], kind='stable')]
+    t = t[order]
+    codes = np.asarray(cellid.codes)[order]
+    values = {c: np.asarray(cols[c], dtype='float64')[order] if c in cols else np.full(len(order), np.nan)
+              for c in COLUMNS if c not in ('pub_time(ms)', 'cellid(db)')}
+
+    at = find_handovers(codes)
+    filled = fill_codes(codes)
+    th = t[at]
+    lo = np.searchsorted(t, th - before, side='left')
+    hi = np.searchsorted(t, th + after, side='left')
+    names = np.asarray(cellid.categories, dtype=object)
+    table = {'time_ms': th, 'from_cell': names[filled[at - 1]], 'to_cell': names[filled[at]],
+             'x': values['utmX(m)'][at], 'y': values['utmY(m)'][at]}
+    for prefix, (a, b) in (('before', (lo, at)), ('after', (at, hi))):
+        for field, v in window_stats(values, a, b, threshold).items():
+            table[f'{prefix}_{field}'] = v
+
+    # timeline: every row of every window with its time relative to the handover
+    lengths = hi - lo
+    rows = np.repeat(lo - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(lengths.sum())
+    rel = t[rows] - np.repeat(th, lengths)
+    delays = values['delay(ms)'][rows]
+    ok = ~np.isnan(delays)
+    return {'handovers': table, 'offsets': np.floor(rel[ok] / bin_ms).astype('int64'), 'delays': delays[ok],
+            'rows': len(t)}
+
+
+def _analyse_file_safe(task):
+    path, before, after, bin_ms, threshold = task
+    try:
+        return analyse_file(path, before, after, bin_ms, threshold), None
+    except Exception as e:
+        return None, str(e)
+
+
+def process_files(files: Sequence[str], before: float, after: float, bin_ms: float, threshold: float,
+                  jobs: int = 1, quiet: bool = True):
+    """Run analyse_file over `files` (in worker processes when jobs > 1) and merge the results in file order."""
+    tasks = [(f, before, after, bin_ms, threshold) for f in files]
+    if jobs > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_analyse_file_safe, tasks, chunksize=max(1, len(tasks) // (jobs * 4))))
+    else:
+        results = map(_analyse_file_safe, tasks)
+
+    tables, offsets, delays = [], [], []
+    n_rows = n_files = 0
+    for f, (result, error) in zip(files, results):
+        if error is not None:
+            print(f"Warning: skipping {f}: {error}", file=sys.stderr)
+            continue
+        table = result['handovers']
+        table['file'] = np.full(len(table['time_ms']), f, dtype=object)
+        tables.append(table)
+        offsets.append(result['offsets'])
+        delays.append(result['delays'])
+        n_rows += result['rows']
+        n_files += 1
+        if not quiet:
+            print(f"{len(table['time_ms']):4d} handovers  {f}")
+    handovers = {k: np.concatenate([tb[k] for tb in tables]) if tables else np.empty(0) for k in HANDOVER_FIELDS}
+    return handovers, np.concatenate(offsets or [np.empty(0, 'int64')]), np.concatenate(delays or [np.empty(0)]), n_rows, n_files
+
+
+def timeline(offsets: np.ndarray, delays: np.ndarray, bin_ms: float, threshold: float,
+             quantile: float = 0.95) -> Dict[str, np.ndarray]:
+    """Per relative-time bin: count, mean, quantile and >threshold share of the delays."""
+    bins, groups = np.unique(offsets, return_inverse=True)
+    count = np.bincount(groups, minlength=len(bins))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(groups, weights=delays, minlength=len(bins)) / count
+        over = np.bincount(groups, weights=delays > threshold, minlength=len(bins)) / count
+    return {'start_ms': bins * bin_ms, 'count': count, 'mean': mean,
+            'p95': group_quantile(groups, delays, len(bins), quantile), 'over_rate': over}
+
+
+def write_handovers(outfile: str, handovers: Dict[str, np.ndarray]):
+    os.makedirs(os.path.dirname(os.path.abspath(outfile)), exist_ok=True)
+    with open(outfile, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(HANDOVER_FIELDS)
+        for row in zip(*(handovers[f] for f in HANDOVER_FIELDS)):
+            writer.writerow([format_value(v) for v in row])
+
+
+def write_timeline(outfile: str, tl: Dict[str, np.ndarray]):
+    fields = ['start_ms', 'count', 'mean', 'p95', 'over_rate']
+    os.makedirs(os.path.dirname(os.path.abspath(outfile)), exist_ok=True)
+    with open(outfile, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(fields)
+        for row in zip(*(tl[f] for f in fields)):
+            writer.writerow([format_value(v) for v in row])
+
+
+def collect_files(args) -> List[str]:
+    if args.inputs:
+        return args.inputs
+    if args.query is not None:
+        from dataset_catalog import query_files
+        return query_files(args.catalog, args.query)
+    from dataset_catalog import run_files
+    return run_files(args.input_folder, args.pattern, args.include_derived)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Handovers from cellid changes and the delay/RSRP/SINR around them.")
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument('--inputs', nargs='+', help='Trace files (one run each)')
+    group.add_argument('--input-folder', help='Folder containing trace files (use with --pattern)')
+    group.add_argument('--query', help='Select run files from the dataset catalog, e.g. "arterial, n78"')
+    p.add_argument('--catalog', default='catalog.csv', help='Catalog built by dataset_catalog.py (used with --query)')
+    p.add_argument('--pattern', default='**/*.txt', help="Glob pattern, recursive (default '**/*.txt')")
+    p.add_argument('--include-derived', action='store_true', help='With --input-folder, keep merged copies such as all.txt')
+    p.add_argument('--before', type=float, default=DEFAULT_BEFORE_MS, help='Window before each handover in ms (default 2000)')
+    p.add_argument('--after', type=float, default=DEFAULT_AFTER_MS, help='Window after each handover in ms (default 2000)')
+    p.add_argument('--bin', type=float, default=DEFAULT_BIN_MS, help='Timeline bin width in ms (default 100)')
+    p.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD_MS, help='Delay threshold in ms (default 100)')
+    p.add_argument('--output', help='Write one row per handover (CSV)')
+    p.add_argument('--timeline', help='Write delay against time relative to the handover (CSV)')
+    p.add_argument('--jobs', type=int, default=1, help='Worker processes; 0 = one per CPU (default 1, serial)')
+    p.add_argument('--quiet', action='store_true', help='Suppress per-file messages')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, 'handover')
+    with profiling.stage('discover'):
+        files = collect_files(args)
+    if not files:
+        print("No input files found. Exiting.", file=sys.stderr)
+        sys.exit(2)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+
+    t0 = time.perf_counter()
+    with profiling.stage('analyse') as st:
+        handovers, offsets, delays, n_rows, n_files = process_files(files, args.before, args.after, args.bin,
+                                                                     args.threshold, jobs, args.quiet)
+        st.add(rows=n_rows)
+    with profiling.stage('timeline', rows=len(offsets)):
+        tl = timeline(offsets, delays, args.bin, args.threshold)
+    n = len(handovers['time_ms'])
+    print(f"{n} handovers in {n_files} runs ({n_rows} rows) in {time.perf_counter() - t0:.2f} s")
+    if n:
+        for prefix in ('before', 'after'):
+            with np.errstate(invalid='ignore'):
+                rows = handovers[f'{prefix}_rows']
+                mean = np.nansum(handovers[f'{prefix}_mean_delay'] * rows) / rows.sum()
+                over = np.nansum(handovers[f'{prefix}_over_rate'] * rows) / rows.sum()
+            print(f"  {prefix:6s} ({args.before if prefix == 'before' else args.after:g} ms): "
+                  f"mean delay {mean:.2f} ms, >{args.threshold:g} ms {over:.4f}")
+
+    if args.output:
+        with profiling.stage('write'):
+            write_handovers(args.output, handovers)
+        print(f"Wrote {args.output}")
+    if args.timeline:
+        with profiling.stage('write'):
+            write_timeline(args.timeline, tl)
+        print(f"Wrote {args.timeline}")
+
+
+if __name__ == '__main__':
+    main()
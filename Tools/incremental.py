@@ -0,0 +1,117 @@
+"""
+incremental.py
+
+Append-aware reading of growing log files.
+
+The loggers append to their v2v_info-0N.txt files during a test day. A tool
+that keeps an IncrementalState remembers, per file, how many bytes it has
+already consumed and the partial aggregate computed from them; the next run
+reads only the bytes appended since, and only up to the last complete line
+(a line still being written is picked up next time).
+
+A file is re-read from byte 0 when it was truncated (smaller than the stored
+offset) or rewritten: the first 64 KiB and the 4 KiB just before the stored
+offset are hashed and compared with the stored digests, which costs two small
+reads however long the file is.
+
+Usage example (see Statisticians_Number_Of_Different_Delay_Based_On_RSRP.py --incremental):
+  from incremental import IncrementalState, read_new_bytes
+  state = IncrementalState.load('stats.state.json', params={'delay_col': 2})
+  entry = state.get(path)                       # None on first sight
+  data, entry, reset = read_new_bytes(path, entry)
+  partial = ... if reset else entry['partial']  # combine with an aggregate of `data`
+  entry['partial'] = partial
+  state.put(path, entry)
+  state.save()
+
+Dependencies:
+  none (standard library)
+"""
+import hashlib
+import json
+import os
+from typing import Optional, Tuple
+
+STATE_VERSION = 1
+
+_HEAD_BYTES = 1 << 16
+_TAIL_BYTES = 1 << 12
+
+
+def _digest(fh, start: int, length: int) -> str:
+    fh.seek(start)
+    return hashlib.sha1(fh.read(length)).hexdigest()
+
+
+def _fingerprint(fh, offset: int) -> dict:
+    tail_start = max(0, offset - _TAIL_BYTES)
+    return {'head_sha1': _digest(fh, 0, min(offset, _HEAD_BYTES)),
+            'tail_sha1': _digest(fh, tail_start, offset - tail_start)}
+
+
+def read_new_bytes(path: str, entry: Optional[dict]) -> Tuple[bytes, dict, bool]:
+    """
+    Return (data, new_entry, reset).
+
+    `data` holds the complete lines appended since `entry` was recorded (all of the
+    file when `reset` is True: first sight, truncation or rewrite). `new_entry`
+    carries over entry['partial'] unless reset; the caller stores its updated
+    aggregate there.
+    """
+    st = os.stat(path)
+    with open(path, 'rb') as fh:
+        reset = True
+        if entry is not None and entry.get('offset', 0) <= st.st_size:
+            offset = entry['offset']
+            if _fingerprint(fh, offset) == {k: entry.get(k) for k in ('head_sha1', 'tail_sha1')}:
+                reset = False
+        start = 0 if reset else entry['offset']
+        fh.seek(start)
+        data = fh.read(st.st_size - start)
+        # stop after the last complete line
+        end = data.rfind(b'\n') + 1
+        data = data[:end]
+        offset = start + end
+        new_entry = {'offset': offset, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        new_entry.update(_fingerprint(fh, offset))
+    new_entry['partial'] = None if reset else entry.get('partial')
+    return data, new_entry, reset
+
+
+class IncrementalState:
+    """Per-file offsets and partial aggregates, persisted as JSON."""
+
+    def __init__(self, path: str, params: Optional[dict] = None):
+        self.path = path
+        self.params = params or {}
+        self.files = {}
+
+    @classmethod
+    def load(cls, path: str, params: Optional[dict] = None) -> 'IncrementalState':
+        """
+        Load the state at `path`. A missing file, another state version or different
+        `params` (the tool options the partial aggregates depend on) gives an empty state.
+        """
+        state = cls(path, params)
+        try:
+            with open(path, 'r', encoding='utf-8') as fh:
+                saved = json.load(fh)
+        except (OSError, ValueError):
+            return state
+        if saved.get('version') == STATE_VERSION and saved.get('params') == state.params:
+            state.files = saved.get('files', {})
+        return state
+
+    def get(self, path: str) -> Optional[dict]:
+        return self.files.get(os.path.abspath(path))
+
+    def put(self, path: str, entry: dict):
+        self.files[os.path.abspath(path)] = entry
+
+    def save(self):
+        outdir = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(outdir, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump({'version': STATE_VERSION, 'params': self.params, 'files': self.files}, fh)
+        os.replace(tmp, self.path)
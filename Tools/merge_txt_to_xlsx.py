@@ -16,8 +16,13 @@ Usage examples:
   # If files include a header row and you want to skip that header in subsequent files (default)
   python merge_txt_to_xlsx.py --input-folder data --output-txt combined.txt --output-xlsx combined.xlsx
 
+  # Constant-memory merge of the whole dataset (sheets roll over at Excel's row limit)
+  python merge_txt_to_xlsx.py --input-folder data --pattern "**/*.txt" --stream --output-txt all.txt --output-xlsx all.xlsx
+
 Arguments:
-  --input-folder   Folder to search for input files (required)
+  --input-folder   Folder to search for input files
+  --query          Instead of --input-folder: select runs from the dataset catalog (e.g. "n8, v>=30, urban")
+  --catalog        Catalog CSV written by dataset_catalog.py (default catalog.csv)
   --pattern        Glob pattern for input files (default "*.txt")
   --output-txt     Output combined text file (default: all.txt)
   --output-xlsx    Output Excel file (default: all.xlsx)
@@ -26,6 +31,14 @@ Arguments:
   --sep            Column separator for reading txt files. Use 'ws' for whitespace (default).
   --encoding       File encoding (default 'utf-8')
   --engine-xlsx    Excel writer engine (default 'xlsxwriter')
+  --stream         Read files in chunks and append them straight to the outputs; the workbook is
+                   written with xlsxwriter's constant_memory mode and continues on a new sheet
+                   (Sheet2, Sheet3, ...) whenever a sheet reaches 1,048,576 rows. Requires files
+                   with a known CICV5G header.
+  --chunksize      Rows per chunk in --stream mode (default 100000)
+
+Files with a known CICV5G header are served from the parsed-file cache
+(trace_cache.py); set CICV5G_NO_CACHE=1 to always parse the text.
 """
 
 import argparse
@@ -39,9 +52,21 @@ except Exception as e:
     print("Error: pandas is required. Install with `pip install pandas`.", file=sys.stderr)
     raise
 
+import profiling
+from dataset_catalog import query_files
+from trace_cache import load_trace
+from trace_loader import LAYOUTS, detect_layout, iter_trace_chunks, layout_columns
+from trace_schema import TIMESTAMP_COLUMNS, exact_integers
+
+# rows per worksheet, including the header row
+EXCEL_MAX_ROWS = 1048576
+
 def parse_args():
     p = argparse.ArgumentParser(description="Merge txt files in folder and export to TXT/Excel")
-    p.add_argument("--input-folder", required=True, help="Folder containing input text files")
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument("--input-folder", help="Folder containing input text files")
+    group.add_argument("--query", help="Select run files from the dataset catalog, e.g. \"n8, urban\"")
+    p.add_argument("--catalog", default="catalog.csv", help="Catalog built by dataset_catalog.py (used with --query)")
     p.add_argument("--pattern", default="*.txt", help="Glob pattern for input files (default '*.txt')")
     p.add_argument("--output-txt", default="all.txt", help="Combined output text file path")
     p.add_argument("--output-xlsx", default="all.xlsx", help="Output Excel (.xlsx) file path")
@@ -50,40 +75,163 @@ def parse_args():
     p.add_argument("--sep", default="ws", choices=["ws", ",", "\\t", " "], help="Separator: 'ws' = whitespace (default), ',', '\\t', or ' '")
     p.add_argument("--encoding", default="utf-8", help="File encoding (default utf-8)")
     p.add_argument("--engine-xlsx", default="xlsxwriter", help="Excel writer engine for pandas (default xlsxwriter)")
+    p.add_argument("--stream", action="store_true", help="Constant-memory chunked merge with sheet rollover (known CICV5G headers only)")
+    p.add_argument("--chunksize", type=int, default=100000, help="Rows per chunk in --stream mode (default 100000)")
+    profiling.add_arguments(p)
     return p.parse_args()
 
 def find_files(folder, pattern):
     pattern_path = os.path.join(folder, pattern)
-    files = sorted(glob.glob(pattern_path))
+    files = sorted(glob.glob(pattern_path, recursive=True))
     return files
 
 def read_first_file(filepath, sep, encoding, header_present):
-    if sep == "ws":
-        df = pd.read_csv(filepath, delim_whitespace=True, header=0 if header_present else None, encoding=encoding, engine='python')
-    else:
-        sep_actual = {"\\t":"\t"}.get(sep, sep)
-        df = pd.read_csv(filepath, sep=sep_actual, header=0 if header_present else None, encoding=encoding)
+    with profiling.file_stage("read", filepath) as st:
+        if sep == "ws":
+            df = pd.read_csv(filepath, sep=r"\s+", header=0 if header_present else None, encoding=encoding, engine='c')
+        else:
+            sep_actual = {"\\t":"\t"}.get(sep, sep)
+            df = pd.read_csv(filepath, sep=sep_actual, header=0 if header_present else None, encoding=encoding)
+        st.add(rows=len(df))
     return df
 
 def read_file_as_df(filepath, sep, encoding, names=None, skiprows=0):
-    if sep == "ws":
-        df = pd.read_csv(filepath, delim_whitespace=True, header=None if names is not None else 0, names=names, skiprows=skiprows, encoding=encoding, engine='python')
-    else:
-        sep_actual = {"\\t":"\t"}.get(sep, sep)
-        df = pd.read_csv(filepath, sep=sep_actual, header=None if names is not None else 0, names=names, skiprows=skiprows, encoding=encoding)
+    with profiling.file_stage("read", filepath) as st:
+        if sep == "ws":
+            df = pd.read_csv(filepath, sep=r"\s+", header=None if names is not None else 0, names=names, skiprows=skiprows, encoding=encoding, engine='c')
+        else:
+            sep_actual = {"\\t":"\t"}.get(sep, sep)
+            df = pd.read_csv(filepath, sep=sep_actual, header=None if names is not None else 0, names=names, skiprows=skiprows, encoding=encoding)
+        st.add(rows=len(df))
     return df
 
+def read_known_traces(files, encoding):
+    """
+    Read files with the shared trace loader when every file has a known CICV5G
+    header. Returns None if any file does not, so the generic path can be used.
+    """
+    df_list = []
+    for f in files:
+        try:
+            df_list.append(load_trace(f, encoding=encoding))
+        except ValueError:
+            # unknown header or layout mismatch
+            return None
+    return df_list
+
+def set_timestamp_format(workbook, sheet, columns):
+    # show millisecond timestamps in full; with Excel's General format a sheet
+    # saved back to text holds 1.7212E+12
+    fmt = workbook.add_format({'num_format': '0'})
+    for i, col in enumerate(columns):
+        if col in TIMESTAMP_COLUMNS:
+            sheet.set_column(i, i, 15, fmt)
+
+class RollingSheetWriter:
+    """
+    Append rows to a constant-memory xlsxwriter workbook, starting a new sheet
+    (with the header repeated) whenever the current one is full.
+    """
+
+    def __init__(self, path, columns, max_rows=EXCEL_MAX_ROWS):
+        import xlsxwriter
+        self.workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        self.columns = list(columns)
+        self.max_rows = max_rows
+        self.sheets = 0
+        self.rows_written = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        self.sheets += 1
+        self.sheet = self.workbook.add_worksheet(f"Sheet{self.sheets}")
+        set_timestamp_format(self.workbook, self.sheet, self.columns)
+        self.sheet.write_row(0, 0, self.columns)
+        self.row = 1
+
+    def write_frame(self, df):
+        # python scalars per column; missing values become blank cells
+        cols = [[None if pd.isna(v) else v for v in df[c].tolist()] for c in self.columns]
+        for values in zip(*cols):
+            if self.row >= self.max_rows:
+                self._new_sheet()
+            self.sheet.write_row(self.row, 0, values)
+            self.row += 1
+        self.rows_written += len(df)
+
+    def close(self):
+        self.workbook.close()
+
+def stream_merge(files, args):
+    """Chunked merge whose memory use does not grow with the number or size of the inputs."""
+    if args.no_header or args.sep != "ws" or args.skip_rows != 1:
+        print("Error: --stream supports whitespace-separated files with one header row only.", file=sys.stderr)
+        sys.exit(1)
+    try:
+        layouts = [detect_layout(f, args.encoding) for f in files]
+    except ValueError as e:
+        print(f"Error: --stream requires files with a known CICV5G header: {e}", file=sys.stderr)
+        sys.exit(2)
+    present = {c for layout in layouts for c in LAYOUTS[layout][1]}
+    columns = layout_columns(present)
+
+    for out in (args.output_txt, args.output_xlsx):
+        os.makedirs(os.path.dirname(os.path.abspath(out)) or ".", exist_ok=True)
+    total = 0
+    xlsx = RollingSheetWriter(args.output_xlsx, columns)
+    try:
+        with open(args.output_txt, "w", newline="", encoding="utf-8") as fh:
+            for f, layout in zip(files, layouts):
+                chunks = iter_trace_chunks(f, args.chunksize, columns=columns, layout=layout, encoding=args.encoding)
+                with profiling.file_stage("merge", f) as st:
+                    for chunk in profiling.timed_iter("parse", chunks):
+                        chunk = exact_integers(chunk)
+                        with profiling.stage("write_txt", rows=len(chunk)):
+                            chunk.to_csv(fh, sep='\t', index=False, header=(total == 0), na_rep='')
+                        with profiling.stage("write_xlsx", rows=len(chunk)):
+                            xlsx.write_frame(chunk)
+                        total += len(chunk)
+                        st.add(rows=len(chunk))
+    finally:
+        xlsx.close()
+    print(f"Wrote combined text to {args.output_txt} (tab-separated).")
+    print(f"Wrote Excel file to {args.output_xlsx} ({xlsx.sheets} sheet(s)).")
+    print(f"Combined rows: {total}, columns: {len(columns)}")
+
 def main():
     args = parse_args()
-    files = find_files(args.input_folder, args.pattern)
-    if not files:
-        print(f"No files found in {args.input_folder} matching {args.pattern}", file=sys.stderr)
-        sys.exit(1)
+    profiling.enable(args, "merge_txt_to_xlsx")
+    if args.query is not None:
+        with profiling.stage("discover"):
+            files = query_files(args.catalog, args.query)
+        if not files:
+            print(f"No catalog entries matched query: {args.query}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        with profiling.stage("discover"):
+            files = find_files(args.input_folder, args.pattern)
+        if not files:
+            print(f"No files found in {args.input_folder} matching {args.pattern}", file=sys.stderr)
+            sys.exit(1)
 
     print(f"Found {len(files)} files. First file: {files[0]}")
 
-    # read first file to get header (if present) and initial dataframe
     header_present = not args.no_header
+    if args.stream:
+        stream_merge(files, args)
+        return
+
+    if header_present and args.sep == "ws" and args.skip_rows == 1:
+        # fast path: known trace layouts (10/12/13 columns) parsed with explicit dtypes
+        with profiling.stage("load"):
+            df_list = read_known_traces(files, args.encoding)
+        if df_list is not None:
+            with profiling.stage("concat"):
+                combined = pd.concat(df_list, ignore_index=True)
+            write_outputs(combined, args)
+            return
+
+    # read first file to get header (if present) and initial dataframe
     try:
         df0 = read_first_file(files[0], args.sep, args.encoding, header_present)
     except Exception as e:
@@ -137,6 +285,9 @@ def main():
         print(f"Failed to concatenate dataframes: {e}", file=sys.stderr)
         sys.exit(3)
 
+    write_outputs(combined, args)
+
+def write_outputs(combined, args):
     # write combined text file (tab-separated) and Excel
     out_txt = args.output_txt
     out_xlsx = args.output_xlsx
@@ -145,8 +296,11 @@ def main():
     out_dir = os.path.dirname(os.path.abspath(out_txt)) or "."
     os.makedirs(out_dir, exist_ok=True)
 
+    # integer columns that became float64 (a missing value in one file) are written as integers
+    combined = exact_integers(combined)
     try:
-        combined.to_csv(out_txt, sep='\t', index=False, na_rep='')
+        with profiling.stage("write_txt", rows=len(combined)):
+            combined.to_csv(out_txt, sep='\t', index=False, na_rep='')
         print(f"Wrote combined text to {out_txt} (tab-separated).")
     except Exception as e:
         print(f"Warning: failed to write combined text file {out_txt}: {e}", file=sys.stderr)
@@ -156,7 +310,10 @@ def main():
         engine = args.engine_xlsx
         # ensure directory exists for xlsx
         os.makedirs(os.path.dirname(os.path.abspath(out_xlsx)) or ".", exist_ok=True)
-        combined.to_excel(out_xlsx, index=False, engine=engine)
+        with profiling.stage("write_xlsx", rows=len(combined)), pd.ExcelWriter(out_xlsx, engine=engine) as writer:
+            combined.to_excel(writer, index=False)
+            if engine == "xlsxwriter":
+                set_timestamp_format(writer.book, writer.sheets["Sheet1"], [str(c) for c in combined.columns])
         print(f"Wrote Excel file to {out_xlsx}.")
     except Exception as e:
         print(f"Failed to write Excel file {out_xlsx}: {e}", file=sys.stderr)
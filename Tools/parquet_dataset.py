@@ -0,0 +1,273 @@
+"""
+parquet_dataset.py
+
+Consolidated columnar copy of the dataset: every run exactly once, as
+compressed Parquet files partitioned by scenario, network, velocity and run,
+plus a reader the tools can use.
+
+data/ keeps most campaigns several times (per-run .txt, merged all.txt /
+westn8all.txt / v40n78.txt, .csv and .xlsx exports). The export takes the run
+files of the catalog only - the merged copies hold the same rows (westn8all.txt
+with timestamps rounded to '1.7212E+12') - and writes
+
+  DATASET/scenario=urban/network=n78/velocity=30/run=3/urban_n78_v30_run03_50ms.parquet
+  DATASET/catalog.csv
+
+The period is part of the file name because the transmission-frequency runs
+share scenario, network, velocity and run. Columns keep the loader's dtypes
+(exact int64 timestamps, nothing clipped or rounded). Timestamps are
+delta-encoded, cellid is dictionary-encoded, and everything is zstd-compressed.
+Files are cut into row groups of --row-group-rows rows, each with min/max
+statistics. The source path, layout, period and direction are stored in the
+file's key-value metadata.
+
+catalog.csv has the fields of dataset_catalog.py, with paths relative to the
+dataset (so the folder can be moved or downloaded as is) and the Parquet file's
+size. relpath is still the run's path under data/. The catalog's per-file
+min/max statistics and the row-group statistics let trace_query.py skip files
+and row groups:
+
+  python trace_query.py --catalog DATASET/catalog.csv "n78, rsrp<-90, 8<=speed<=15"
+
+The spreadsheet-only recordings (the 7-column 2023 exports
+Urban road/2-n78/v20/0717circle_*.xlsx and v40/west_n78_v40_0[1-5].xlsx,
+which have no cellid/SINR/RSRP) have no run file and are not exported.
+
+Usage examples:
+  # export the runs of data/ (uses catalog.csv from dataset_catalog.py when given)
+  python parquet_dataset.py export --data-root data/ --output dataset/
+  python parquet_dataset.py export --catalog catalog.csv --output dataset/
+
+  # full scan of the export
+  python parquet_dataset.py scan dataset/ --columns delay rsrp
+
+  # from another tool
+  from parquet_dataset import read_dataset
+  df = read_dataset("dataset/", "n78, v>=50", columns=["delay(ms)", "rsrp(db)"])
+
+Dependencies:
+  numpy, pandas, pyarrow
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence
+
+import profiling
+from dataset_catalog import column_stats, read_catalog, select, write_catalog
+
+MANIFEST = 'catalog.csv'
+ROW_GROUP_ROWS = 65536
+COMPRESSION = 'zstd'
+COMPRESSION_LEVEL = 9
+
+# per-column encodings; columns not listed use PLAIN (zstd then does the rest)
+DELTA_COLUMNS = ['pub_time(ms)', 'sub_time(ms)']
+DICTIONARY_COLUMNS = ['cellid(db)']
+
+METADATA_KEY = b'cicv5g'
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print("Error: pyarrow is required for Parquet datasets. Install with `pip install pyarrow`.", file=sys.stderr)
+        sys.exit(1)
+
+
+def partition_path(entry: Dict[str, object]) -> str:
+    """Path of a run's file relative to the dataset root."""
+    parts = [f"{key}={'NA' if entry.get(key) is None else entry[key]}"
+             for key in ('scenario', 'network', 'velocity', 'run')]
+    stem = os.path.splitext(os.path.basename(entry['relpath']))[0]
+    return '/'.join(parts + [f"{stem}_{entry['period_ms']}ms.parquet"])
+
+
+def write_run(df, path: str, meta: Dict[str, object], row_group_rows: int = ROW_GROUP_ROWS,
+              compression: str = COMPRESSION, level: Optional[int] = COMPRESSION_LEVEL):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), METADATA_KEY: json.dumps(meta).encode()})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path, row_group_size=row_group_rows, compression=compression, compression_level=level,
+                   use_dictionary=[c for c in DICTIONARY_COLUMNS if c in df.columns],
+                   column_encoding={c: 'DELTA_BINARY_PACKED' for c in DELTA_COLUMNS if c in df.columns},
+                   write_statistics=True)
+
+
+def export_dataset(entries: List[Dict[str, object]], output: str, row_group_rows: int = ROW_GROUP_ROWS,
+                   compression: str = COMPRESSION, level: Optional[int] = COMPRESSION_LEVEL, quiet: bool = True):
+    """
+    Write the run entries (dataset_catalog entries; derived copies are skipped) as a
+    partitioned Parquet dataset under `output`, replacing a previous export there.
+    Returns the manifest entries.
+    """
+    from trace_cache import load_trace
+
+    if os.path.exists(output) and os.listdir(output) and not os.path.exists(os.path.join(output, MANIFEST)):
+        raise ValueError(f"{output} exists and is not a dataset export; refusing to replace it")
+    parent = os.path.dirname(os.path.abspath(output))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.export-', dir=parent)
+    manifest = []
+    try:
+        for e in select(entries, ''):
+            with profiling.file_stage('export', e['path']) as st:
+                try:
+                    df = load_trace(e['path'])
+                except (OSError, ValueError) as err:
+                    print(f"Warning: skipping {e['path']}: {err}", file=sys.stderr)
+                    continue
+                rel = partition_path(e)
+                meta = {'source': e['relpath'], 'layout': e.get('layout'), 'period_ms': e.get('period_ms'),
+                        'direction': e.get('direction')}
+                write_run(df, os.path.join(tmp, rel), meta, row_group_rows, compression, level)
+                st.add(rows=len(df))
+            out = {k: e.get(k) for k in ('relpath', 'scenario', 'network', 'velocity', 'period_ms', 'direction', 'run')}
+            fst = os.stat(os.path.join(tmp, rel))
+            out.update(path=rel, derived=False, format='parquet', layout=e.get('layout'), rows=len(df),
+                       size=fst.st_size, mtime_ns=fst.st_mtime_ns, source_size=e.get('size'))
+            out.update(column_stats(df))
+            manifest.append(out)
+            if not quiet:
+                print(f"{len(df):8d} rows  {rel}")
+        write_catalog(manifest, os.path.join(tmp, MANIFEST))
+        if os.path.isdir(output):
+            shutil.rmtree(output)
+        os.replace(tmp, output)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return manifest
+
+
+def read_manifest(root: str) -> List[Dict[str, object]]:
+    """Catalog entries of an export (absolute paths), for dataset_catalog.select / trace_query.run_query."""
+    return read_catalog(os.path.join(root, MANIFEST))
+
+
+def _row_group_may_match(row_group, index: Dict[str, int], predicates) -> bool:
+    from trace_query import may_match_range
+
+    for col, op, value in predicates:
+        if col not in index:
+            return False
+        stats = row_group.column(index[col]).statistics
+        if stats is None or not stats.has_min_max:
+            continue
+        if not may_match_range(op, stats.min, stats.max, value):
+            return False
+    return True
+
+
+def read_columns(path: str, columns: Optional[Sequence[str]] = None, predicates: Sequence = ()):
+    """
+    Read `columns` (default all) of one exported run, skipping row groups whose statistics
+    rule out `predicates` (trace_query (column, op, value) tuples).
+
+    Returns ({column: array}, rows read, compressed bytes read); cellid comes
+    back as a pandas Categorical, integer columns with missing values as float64.
+    """
+    import pyarrow.parquet as pq
+
+    with profiling.file_stage('read', path) as st:
+        pf = pq.ParquetFile(path)
+        md = pf.metadata
+        names = pf.schema_arrow.names
+        index = {md.row_group(0).column(j).path_in_schema: j for j in range(md.num_columns)} if md.num_row_groups else {}
+        groups = [i for i in range(md.num_row_groups) if _row_group_may_match(md.row_group(i), index, predicates)]
+        present = [c for c in dict.fromkeys(columns) if c in names] if columns is not None else names
+        out = {}
+        rows = nbytes = 0
+        if groups and present:
+            table = pf.read_row_groups(groups, columns=present)
+            rows = table.num_rows
+            nbytes = sum(md.row_group(i).column(index[c]).total_compressed_size for i in groups for c in present)
+            for c in present:
+                series = table.column(c).to_pandas()
+                out[c] = series.array if hasattr(series, 'cat') else series.to_numpy()
+        st.add(rows=rows, bytes=nbytes)
+    return out, rows, nbytes
+
+
+def read_dataset(root: str, query: str = '', columns: Optional[Sequence[str]] = None):
+    """Rows of an export matching `query` (trace_query.py syntax) as one DataFrame with a 'source' column."""
+    from trace_query import run_query
+    return run_query(read_manifest(root), query, columns)[0]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Export the dataset as partitioned Parquet, or scan an export.")
+    sub = p.add_subparsers(dest='command', required=True)
+    e = sub.add_parser('export', help='Write every run once as partitioned, compressed Parquet.')
+    src = e.add_mutually_exclusive_group(required=True)
+    src.add_argument('--data-root', help='Root of the dataset (the data/ folder)')
+    src.add_argument('--catalog', help='Catalog built by dataset_catalog.py (its run entries are exported)')
+    e.add_argument('--output', required=True, help='Dataset folder (replaced if it holds a previous export)')
+    e.add_argument('--row-group-rows', type=int, default=ROW_GROUP_ROWS,
+                   help=f'Rows per row group (default {ROW_GROUP_ROWS})')
+    e.add_argument('--compression', default=COMPRESSION, help=f'Parquet codec (default {COMPRESSION})')
+    e.add_argument('--level', type=int, default=COMPRESSION_LEVEL,
+                   help=f'Codec level (default {COMPRESSION_LEVEL}, zstd/gzip/brotli only)')
+    e.add_argument('--quiet', action='store_true', help='Suppress per-file messages')
+    s = sub.add_parser('scan', help='Read every file of an export and report rows, bytes and time.')
+    s.add_argument('root', help='Dataset folder')
+    s.add_argument('--columns', nargs='+', help="Columns to read (short or full names; default all)")
+    for a in sub.choices.values():
+        profiling.add_arguments(a)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, f'parquet_dataset {args.command}')
+    _require_pyarrow()
+    t0 = time.perf_counter()
+    if args.command == 'export':
+        with profiling.stage('discover'):
+            if args.catalog:
+                entries = read_catalog(args.catalog)
+            else:
+                from dataset_catalog import build_catalog
+                entries = build_catalog(args.data_root)
+        level = args.level if args.compression in ('zstd', 'gzip', 'brotli') else None
+        try:
+            manifest = export_dataset(entries, args.output, args.row_group_rows, args.compression, level, args.quiet)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(2)
+        if not manifest:
+            print("No runs exported.", file=sys.stderr)
+            sys.exit(1)
+        text = sum(m['source_size'] or 0 for m in manifest)
+        size = sum(m['size'] for m in manifest)
+        skipped = [e for e in entries if e['derived']]
+        print(f"Exported {len(manifest)} runs, {sum(m['rows'] for m in manifest)} rows: {text / 2**20:.1f} MB of text "
+              f"-> {size / 2**20:.2f} MB ({text / size:.1f}x) in {time.perf_counter() - t0:.1f} s. Wrote {args.output}")
+        if skipped:
+            print(f"Not exported: {len(skipped)} derived copies ({sum(e['size'] or 0 for e in skipped) / 2**20:.1f} MB)")
+        return
+
+    from trace_query import resolve_columns
+    manifest = read_manifest(args.root)
+    columns = resolve_columns(args.columns)
+    rows = nbytes = 0
+    with profiling.stage('scan') as st:
+        for m in manifest:
+            _, n, b = read_columns(m['path'], columns)
+            rows += n
+            nbytes += b
+        st.add(rows=rows, bytes=nbytes)
+    print(f"Files: {len(manifest)}, rows: {rows}, compressed bytes read: {nbytes / 2**20:.2f} MB, "
+          f"elapsed: {time.perf_counter() - t0:.3f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -24,11 +24,24 @@ Usage examples:
   # 2) Read all txt in a folder, auto-detect velocity column inside files
   python plot_delay_by_velocity.py --input-folder data/ --pattern "*.txt" \
     --delay-name delay --vel-col-name Velocity --out results/delay_by_vel.png
+  #    ... or group rows of the velocity(m/s) column into 5 km/h bins
+  python plot_delay_by_velocity.py --input-folder data/ --pattern "**/*.txt" \
+    --vel-col-name "velocity(m/s)" --vel-unit kmh --vel-bin 5 --out results/delay_by_vel_bins.png
 
-  # 3) Provide velocities but ask to split low/high by threshold 50
+  # 3) Select runs from the dataset catalog; velocities are taken from the catalog
+  python plot_delay_by_velocity.py --catalog catalog.csv --query "n8, arterial" --out fig.png
+
+  # 4) Bounded memory: stream every group into a quantile sketch and draw from it;
+  #    also write p50/p95/p99/p99.9, count and mean per group
+  python plot_delay_by_velocity.py --catalog catalog.csv --query "n8" --sketch --summary-csv delay_pct.csv --out fig.png
+
+  # 5) Provide velocities but ask to split low/high by threshold 50
   python plot_delay_by_velocity.py --inputs f1.txt f2.txt ... --velocities 0 20 30 40 50 60 70 80 \
     --split-threshold 50 --out fig.png
 
+Files with a known CICV5G header are served from the parsed-file cache
+(trace_cache.py); set CICV5G_NO_CACHE=1 to always parse the text.
+
 Dependencies:
   pandas, numpy, matplotlib
 
@@ -42,20 +55,28 @@ from typing import List, Optional
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+
+import profiling
+from dataset_catalog import read_catalog, select
+from quantile_sketch import DDSketch, DEFAULT_ALPHA
+from trace_cache import load_trace
 
 # Common candidate names for delay/velocity columns to try when user didn't specify
 DEFAULT_DELAY_NAMES = ['delay', 'delay(ms)', 'delay_ms', 'rtt', 'RTT', 'Delay']
 DEFAULT_VEL_NAMES = ['Velocity', 'velocity', 'speed', 'Speed', 'VEL']
 
-def parse_args():
+def parse_args(argv=None):
     p = argparse.ArgumentParser(description="Plot delay boxplots grouped by vehicle velocity.")
     group = p.add_mutually_exclusive_group(required=True)
     group.add_argument('--inputs', nargs='+', help='List of input text files (in order).')
     group.add_argument('--input-folder', help='Folder containing input files to process (use with --pattern).')
+    group.add_argument('--query', help='Select run files from the dataset catalog, e.g. "n78, arterial"; velocities come from the catalog.')
+    p.add_argument('--catalog', default='catalog.csv', help='Catalog built by dataset_catalog.py (used with --query).')
     p.add_argument('--pattern', default='*.txt', help='Glob pattern for input-folder (default: *.txt)')
     p.add_argument('--velocities', nargs='+', type=float, help='List of velocities (one per input file).')
     p.add_argument('--vel-col-name', help="If provided, script will extract a velocity column from files (useful when files contain mixed velocities).")
+    p.add_argument('--vel-unit', default='raw', choices=['raw', 'kmh'], help="With --vel-col-name: 'kmh' converts the column from m/s to km/h (default raw).")
+    p.add_argument('--vel-bin', type=float, help='With --vel-col-name: group velocities into bins of this width (in the --vel-unit unit), labelled by their lower edge.')
     p.add_argument('--delay-name', help="Column name for delay (if missing, script will try common candidates).")
     p.add_argument('--delay-col', type=int, help='Zero-based column index for delay (fallback if name not found).')
     p.add_argument('--skip-rows', type=int, default=1, help='Header rows to skip when reading (default 1). If files have no header, set 0.')
@@ -65,28 +86,39 @@ def parse_args():
     p.add_argument('--figsize', nargs=2, type=float, default=(9.0,6.0), help='Figure size in inches, two floats: width height (default 9 6).')
     p.add_argument('--split-threshold', type=float, default=None, help='If provided, split velocities into two groups: <threshold and >=threshold.')
     p.add_argument('--median-line', action='store_true', help='Plot median line instead of mean-line (default shows mean markers and connecting mean line).')
+    p.add_argument('--sketch', action='store_true', help='Keep a quantile sketch per group instead of every delay value (bounded memory).')
+    p.add_argument('--alpha', type=float, default=DEFAULT_ALPHA, help='Relative accuracy of --sketch percentiles (default 0.01).')
+    p.add_argument('--summary-csv', help='Write count, mean and p50/p95/p99/p99.9 per group to this CSV.')
+    p.add_argument('--show', action='store_true', help='Also open an interactive window after saving.')
     p.add_argument('--quiet', action='store_true', help='Suppress console messages.')
-    return p.parse_args()
+    profiling.add_arguments(p)
+    return p.parse_args(argv)
 
 def find_files_from_folder(folder: str, pattern: str) -> List[str]:
     pattern_path = os.path.join(folder, pattern)
-    files = sorted(glob.glob(pattern_path))
+    files = sorted(glob.glob(pattern_path, recursive=True))
     return files
 
-def read_delay_from_file(path: str, delay_name: Optional[str], delay_col: Optional[int], sep: str, skip_rows: int):
-    # Read with pandas trying robustness
+def read_table(path: str, sep: str, skip_rows: int) -> pd.DataFrame:
+    # Known CICV5G layouts go through the shared loader and its parsed-file cache
+    if sep == 'ws' and skip_rows > 0:
+        try:
+            return load_trace(path)
+        except ValueError:
+            pass
     if sep == 'ws':
-        read_kwargs = dict(delim_whitespace=True, engine='python')
+        read_kwargs = dict(sep=r'\s+', engine='c')
     else:
         sep_actual = {'\\t':'\t'}.get(sep, sep)
         read_kwargs = dict(sep=sep_actual)
 
     try:
-        df = pd.read_csv(path, header=0 if skip_rows>0 else None, skiprows=0 if skip_rows==0 else 0, encoding='utf-8', **read_kwargs)
+        return pd.read_csv(path, header=0 if skip_rows>0 else None, encoding='utf-8', **read_kwargs)
     except Exception:
         # fallback: read whole file as whitespace-separated
-        df = pd.read_csv(path, delim_whitespace=True, engine='python', header=0 if skip_rows>0 else None, encoding='utf-8')
+        return pd.read_csv(path, sep=r'\s+', engine='c', header=0 if skip_rows>0 else None, encoding='utf-8')
 
+def find_delay_column(df: pd.DataFrame, delay_name: Optional[str], delay_col: Optional[int], path: str) -> pd.Series:
     # If header rows to skip > 0, we consider that header is present; else header absent.
     # Determine delay column
     col_name = None
@@ -100,77 +132,113 @@ def read_delay_from_file(path: str, delay_name: Optional[str], delay_col: Option
                 break
 
     if col_name is not None:
-        series = pd.to_numeric(df[col_name], errors='coerce')
+        return pd.to_numeric(df[col_name], errors='coerce')
     elif delay_col is not None:
         # use positional index
         try:
-            series = pd.to_numeric(df.iloc[:, delay_col], errors='coerce')
+            return pd.to_numeric(df.iloc[:, delay_col], errors='coerce')
         except Exception:
             raise ValueError(f"Cannot read delay from column index {delay_col} in file {path}")
     else:
         # as last resort, try first numeric column
         numeric_cols = [c for c in df.columns if pd.to_numeric(df[c], errors='coerce').notna().any()]
         if numeric_cols:
-            series = pd.to_numeric(df[numeric_cols[0]], errors='coerce')
-        else:
-            raise ValueError(f"Could not detect a delay column in {path}; please pass --delay-name or --delay-col")
+            return pd.to_numeric(df[numeric_cols[0]], errors='coerce')
+        raise ValueError(f"Could not detect a delay column in {path}; please pass --delay-name or --delay-col")
 
+def read_delay_from_file(path: str, delay_name: Optional[str], delay_col: Optional[int], sep: str, skip_rows: int):
+    df = read_table(path, sep, skip_rows)
+    series = find_delay_column(df, delay_name, delay_col, path)
     # drop NaN
     series = series.dropna().astype(float)
     return series
 
-def read_velocity_from_file(path: str, vel_col_name: Optional[str], sep: str, skip_rows: int):
-    if not vel_col_name:
+def read_velocity_delay_from_file(path: str, args):
+    """
+    One read of `path`; returns row-aligned (velocity, delay) float arrays, keeping only
+    rows where both are present, or None when the file has no --vel-col-name column.
+    """
+    df = read_table(path, args.sep, args.skip_rows)
+    if args.vel_col_name not in df.columns:
         return None
-    if sep == 'ws':
-        read_kwargs = dict(delim_whitespace=True, engine='python')
+    vels = pd.to_numeric(df[args.vel_col_name], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    delays = find_delay_column(df, args.delay_name, args.delay_col, path).to_numpy(dtype=float, na_value=np.nan)
+    valid = ~(np.isnan(vels) | np.isnan(delays))
+    return vels[valid], delays[valid]
+
+def velocity_keys(vels: np.ndarray, args) -> np.ndarray:
+    """Numeric group key per row: velocity in the output unit, floored to --vel-bin if given."""
+    if args.vel_unit == 'kmh':
+        vels = vels * 3.6
+    if args.vel_bin:
+        return np.floor(vels / args.vel_bin) * args.vel_bin
+    return np.round(vels, 2)
+
+def velocity_label(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else str(round(float(v),2))
+
+def group_by_key(keys: np.ndarray, values: np.ndarray):
+    """Yield (key, values) per distinct key with one sort instead of a mask per group."""
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(uniq)))[:-1]
+    for key, part in zip(uniq, np.split(values[order], bounds)):
+        yield key, part
+
+def add_to_group(per_vel_data: dict, key: str, values, args):
+    # groups collect lists of arrays (concatenated once by finish_groups),
+    # or DDSketch objects with --sketch (values are then discarded)
+    values = np.asarray(values, dtype=float)
+    if getattr(args, 'sketch', False):
+        per_vel_data.setdefault(key, DDSketch(args.alpha)).add(values)
     else:
-        sep_actual = {'\\t':'\t'}.get(sep, sep)
-        read_kwargs = dict(sep=sep_actual)
-    df = pd.read_csv(path, header=0 if skip_rows>0 else None, encoding='utf-8', **read_kwargs)
-    if vel_col_name in df.columns:
-        return pd.to_numeric(df[vel_col_name], errors='coerce').dropna().astype(float)
-    else:
-        return None
+        # several runs may share a velocity (e.g. catalog queries): pool them
+        per_vel_data.setdefault(key, []).append(values)
+
+def finish_groups(per_vel_data: dict) -> dict:
+    return {k: (np.concatenate(v) if isinstance(v, list) else v) for k, v in per_vel_data.items()}
 
 def prepare_data(input_files: List[str], args):
-    # returns dict: {velocity_label: numpy array of delays}
+    # returns dict: {velocity_label: numpy array of delays (or DDSketch with --sketch)}
     per_vel_data = {}
     if args.velocities:
         if len(args.velocities) != len(input_files):
             raise ValueError("Length of --velocities must equal number of input files")
         for fpath, vel in zip(input_files, args.velocities):
             delays = read_delay_from_file(fpath, args.delay_name, args.delay_col, args.sep, args.skip_rows)
-            per_vel_data[str(int(vel))] = delays.values
+            add_to_group(per_vel_data, str(int(vel)), delays.values, args)
     else:
         # try to auto-detect velocity column inside files if vel_col_name provided
         if args.vel_col_name:
             # aggregate rows grouped by velocity (could be multiple velocities per file)
-            agg = {}
+            key_parts, delay_parts = [], []
             for f in input_files:
                 try:
-                    vel_series = read_velocity_from_file(f, args.vel_col_name, args.sep, args.skip_rows)
-                    delay_series = read_delay_from_file(f, args.delay_name, args.delay_col, args.sep, args.skip_rows)
+                    pair = read_velocity_delay_from_file(f, args)
                 except Exception as e:
                     print(f"Warning reading {f}: {e}", file=sys.stderr)
                     continue
-                if vel_series is None:
+                if pair is None:
                     continue
-                # align lengths if necessary
-                minlen = min(len(vel_series), len(delay_series))
-                vel_series = vel_series.iloc[:minlen]
-                delay_series = delay_series.iloc[:minlen]
-                for v, d in zip(vel_series.values, delay_series.values):
-                    key = str(int(v)) if (pd.notna(v) and float(v).is_integer()) else str(round(float(v),2))
-                    agg.setdefault(key, []).append(float(d))
-            per_vel_data = {k: np.array(v) for k,v in agg.items()}
+                keys = velocity_keys(pair[0], args)
+                if args.sketch:
+                    # bounded memory: fold each file into the sketches right away
+                    for key, delays in group_by_key(keys, pair[1]):
+                        add_to_group(per_vel_data, velocity_label(key), delays, args)
+                else:
+                    key_parts.append(keys)
+                    delay_parts.append(pair[1])
+            if key_parts:
+                # one columnar group-by over all files
+                for key, delays in group_by_key(np.concatenate(key_parts), np.concatenate(delay_parts)):
+                    add_to_group(per_vel_data, velocity_label(key), delays, args)
         else:
             # fallback: treat each file as one velocity group and label by filename
             for f in input_files:
                 delays = read_delay_from_file(f, args.delay_name, args.delay_col, args.sep, args.skip_rows)
                 label = os.path.splitext(os.path.basename(f))[0]
-                per_vel_data[label] = delays.values
-    return per_vel_data
+                add_to_group(per_vel_data, label, delays.values, args)
+    return finish_groups(per_vel_data)
 
 def split_groups(per_vel_data: dict, threshold: Optional[float]):
     """
@@ -193,13 +261,43 @@ def split_groups(per_vel_data: dict, threshold: Optional[float]):
             other[k] = v
     return low, high, other
 
+def key_sort(k):
+    try:
+        return float(k)
+    except Exception:
+        return k
+
+def group_stats(values) -> dict:
+    if isinstance(values, DDSketch):
+        return values.box_stats()
+    from matplotlib import cbook
+    return cbook.boxplot_stats(values)[0]
+
+def write_summary_csv(outfile: str, per_vel_data: dict, keys: List[str]):
+    import csv
+    rows = []
+    for k in keys:
+        v = per_vel_data[k]
+        if isinstance(v, DDSketch):
+            summary = v.summary()
+        else:
+            summary = {'count': len(v), 'mean': float(np.mean(v)) if len(v) else np.nan,
+                       'min': float(np.min(v)) if len(v) else np.nan, 'max': float(np.max(v)) if len(v) else np.nan}
+            summary.update({name: float(np.quantile(v, q)) if len(v) else np.nan
+                            for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('p99.9', 0.999))})
+        rows.append(dict(group=k, **summary))
+    outdir = os.path.dirname(outfile)
+    if outdir and not os.path.exists(outdir):
+        os.makedirs(outdir, exist_ok=True)
+    with open(outfile, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.DictWriter(fh, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
 def make_boxplot(per_vel_data: dict, args):
+    import matplotlib.pyplot as plt
+
     # sort keys numerically if possible
-    def key_sort(k):
-        try:
-            return float(k)
-        except Exception:
-            return k
     keys_sorted = sorted(list(per_vel_data.keys()), key=key_sort)
     data_list = [per_vel_data[k] for k in keys_sorted]
 
@@ -220,9 +318,10 @@ def make_boxplot(per_vel_data: dict, args):
     positions = np.arange(1, len(ordered_keys)+1)
     fig, ax = plt.subplots(figsize=tuple(args.figsize))
 
-    # create boxplot with patch_artist True to control colors
-    bplots = ax.boxplot(data_list, positions=positions, patch_artist=True,
-                        showmeans=False, meanline=False, sym='w.', widths=0.6)
+    # box statistics from raw arrays or from sketch summaries; both are drawn by bxp
+    stats = [group_stats(v) for v in data_list]
+    bplots = ax.bxp(stats, positions=positions, patch_artist=True, showmeans=False, meanline=False, widths=0.6,
+                    flierprops=dict(marker='.', markerfacecolor='w', markeredgecolor='w'))
 
     # apply colors and styles
     for patch, color in zip(bplots['boxes'], colors):
@@ -236,12 +335,9 @@ def make_boxplot(per_vel_data: dict, args):
 
     # compute mean or median and plot line
     mean_vals = []
-    for arr in data_list:
-        if args.median_line:
-            val = float(np.median(arr)) if len(arr)>0 else np.nan
-        else:
-            val = float(np.mean(arr)) if len(arr)>0 else np.nan
-        mean_vals.append(val)
+    for st, arr in zip(stats, data_list):
+        val = st['med'] if args.median_line else st['mean']
+        mean_vals.append(float(val) if len(arr)>0 else np.nan)
     ax.plot(positions, mean_vals, marker='o', linestyle='-', color='r', linewidth=2.0, markersize=6)
 
     # xticks and labels
@@ -258,19 +354,32 @@ def make_boxplot(per_vel_data: dict, args):
     outdir = os.path.dirname(outpath)
     if outdir and not os.path.exists(outdir):
         os.makedirs(outdir, exist_ok=True)
-    plt.savefig(outpath, dpi=args.dpi)
+    with profiling.stage('savefig'):
+        fig.savefig(outpath, dpi=args.dpi)
     if not args.quiet:
         print(f"Saved figure to {outpath} (dpi={args.dpi})")
-    plt.show()
+    if args.show:
+        plt.show()
+    plt.close(fig)
 
-def main():
-    args = parse_args()
+def main(argv=None):
+    args = parse_args(argv)
+    profiling.enable(args, 'plot_delay_by_velocity')
 
     # collect input files
     if args.inputs:
         input_files = args.inputs
+    elif args.query is not None:
+        entries = select(read_catalog(args.catalog), args.query)
+        input_files = [e['path'] for e in entries]
+        if not input_files:
+            print(f"No catalog entries matched query: {args.query}", file=sys.stderr)
+            sys.exit(1)
+        if not args.velocities and not args.vel_col_name and all(e['velocity'] is not None for e in entries):
+            args.velocities = [float(e['velocity']) for e in entries]
     else:
-        input_files = find_files_from_folder(args.input_folder, args.pattern)
+        with profiling.stage('discover'):
+            input_files = find_files_from_folder(args.input_folder, args.pattern)
         if not input_files:
             print("No input files found. Exiting.", file=sys.stderr)
             sys.exit(1)
@@ -278,7 +387,9 @@ def main():
     if not args.quiet:
         print("Input files:", input_files)
 
-    per_vel_data = prepare_data(input_files, args)
+    with profiling.stage('prepare') as st:
+        per_vel_data = prepare_data(input_files, args)
+        st.add(rows=sum(v.count if isinstance(v, DDSketch) else len(v) for v in per_vel_data.values()))
     if not per_vel_data:
         print("No delay data extracted. Check column names and inputs.", file=sys.stderr)
         sys.exit(2)
@@ -286,7 +397,14 @@ def main():
     if not args.quiet:
         print("Prepared velocity groups:", list(per_vel_data.keys()))
 
-    make_boxplot(per_vel_data, args)
+    if args.summary_csv:
+        with profiling.stage('write'):
+            write_summary_csv(args.summary_csv, per_vel_data, sorted(per_vel_data.keys(), key=key_sort))
+        if not args.quiet:
+            print(f"Wrote percentile summary to {args.summary_csv}")
+
+    with profiling.stage('draw'):
+        make_boxplot(per_vel_data, args)
 
 if __name__ == '__main__':
     main()
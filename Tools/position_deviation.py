@@ -0,0 +1,243 @@
+"""
+position_deviation.py
+
+Position deviation caused by delay, for every run that logs the vehicle's
+own pose (currentX(m) currentY [currentHeading(rad)] after the ten base
+columns; the ws12/ws13 layouts of trace_loader).
+
+Per row, the deviation vector runs from the position carried by the message
+(utmX/utmY) to where the vehicle actually was when it arrived (currentX/
+currentY). It is split in the message's heading frame (heading(rad) is
+measured counter-clockwise from UTM east):
+  longitudinal  component along the heading (positive: the vehicle is ahead)
+  lateral       component across it (positive: to the left)
+  heading_error currentHeading - heading, wrapped to (-pi, pi]
+                (files without currentHeading leave it empty)
+
+Each run gives one row of the run table (mean/p95/max of |deviation|,
+|lateral|, |longitudinal|, |heading error|, mean delay and RSRP and the
+delay-deviation correlation), and all rows together give the delay ->
+deviation summary: the same statistics per delay bin (--delay-bins, right
+closed as in binning.py). Runs are processed in worker processes with --jobs.
+
+Usage examples:
+  # every run with pose columns, per-run table and delay summary
+  python position_deviation.py --input-folder data/ --runs outputs/deviation_runs.csv --summary outputs/deviation_by_delay.csv --jobs 0
+
+  # W2S n8 runs only, custom delay bins
+  python position_deviation.py --input-folder data/W2S/n8 --delay-bins 20,30,50,100
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+import profiling
+from binning import Axis, format_value, group_quantile
+
+DEFAULT_DELAY_BINS = [20, 30, 50, 100]
+POSE_LAYOUTS = ('ws12', 'ws13', 'tab13')
+
+COLUMNS = ['delay(ms)', 'utmX(m)', 'utmY(m)', 'heading(rad)', 'velocity(m/s)', 'rsrp(db)',
+           'currentX(m)', 'currentY', 'currentHeading(rad)']
+DEVIATIONS = ['deviation', 'lateral', 'longitudinal', 'heading_error']
+STAT_FIELDS = [f'{s}_{d}' for d in DEVIATIONS for s in ('mean', 'p95', 'max')]
+RUN_FIELDS = ['file', 'layout', 'rows', 'mean_delay', 'p95_delay', 'mean_rsrp', 'mean_velocity',
+              'corr_delay_deviation'] + STAT_FIELDS
+SUMMARY_FIELDS = ['delay', 'rows', 'mean_velocity'] + STAT_FIELDS
+
+
+def wrap_angle(a: np.ndarray) -> np.ndarray:
+    """Wrap angles to (-pi, pi]."""
+    return np.pi - np.mod(np.pi - a, 2 * np.pi)
+
+
+def deviation_components(cols: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Per-row deviation, lateral, longitudinal and heading_error (see the module docstring)."""
+    ex = np.asarray(cols['currentX(m)'], dtype='float64') - np.asarray(cols['utmX(m)'], dtype='float64')
+    ey = np.asarray(cols['currentY'], dtype='float64') - np.asarray(cols['utmY(m)'], dtype='float64')
+    h = np.asarray(cols['heading(rad)'], dtype='float64')
+    c, s = np.cos(h), np.sin(h)
+    out = {'deviation': np.hypot(ex, ey), 'longitudinal': ex * c + ey * s, 'lateral': ey * c - ex * s}
+    if 'currentHeading(rad)' in cols:
+        out['heading_error'] = wrap_angle(np.asarray(cols['currentHeading(rad)'], dtype='float64') - h)
+    else:
+        out['heading_error'] = np.full(len(h), np.nan)
+    return out
+
+
+def abs_stats(groups: np.ndarray, n_groups: int, dev: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """mean/p95/max of the absolute value of each deviation component per group (NaNs ignored)."""
+    out = {}
+    for name in DEVIATIONS:
+        v = np.abs(dev[name])
+        ok = ~np.isnan(v)
+        g, v = groups[ok], v[ok]
+        n = np.bincount(g, minlength=n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[f'mean_{name}'] = np.bincount(g, weights=v, minlength=n_groups) / n
+        out[f'p95_{name}'] = group_quantile(g, v, n_groups, 0.95)
+        mx = np.full(n_groups, -np.inf)
+        np.maximum.at(mx, g, v)
+        out[f'max_{name}'] = np.where(n > 0, mx, np.nan)
+    return out
+
+
+def analyse_file(path: str, delay_axis: Axis) -> dict:
+    """
+    One run: {'run': its RUN_FIELDS row, 'delay_bin', 'velocity', 'dev': per-row values}; the per-row
+    arrays are pooled across runs for the delay -> deviation summary.
+    """
+    from trace_cache import load_columns
+    from trace_loader import detect_layout
+
+    layout = detect_layout(path)
+    if layout not in POSE_LAYOUTS:
+        raise ValueError(f"layout {layout} has no currentX/currentY columns")
+    cols = load_columns(path, COLUMNS)
+    dev = deviation_components(cols)
+    delay = np.asarray(cols['delay(ms)'], dtype='float64')
+    keep = ~(np.isnan(delay) | np.isnan(dev['deviation']))
+    delay = delay[keep]
+    dev = {k: v[keep] for k, v in dev.items()}
+    rsrp = np.asarray(cols['rsrp(db)'], dtype='float64')[keep]
+    velocity = np.asarray(cols['velocity(m/s)'], dtype='float64')[keep]
+
+    run = {'file': path, 'layout': layout, 'rows': int(keep.sum())}
+    if run['rows']:
+        run.update(mean_delay=delay.mean(), p95_delay=np.sort(delay)[max(int(np.ceil(0.95 * len(delay))), 1) - 1],
+                   mean_rsrp=np.nanmean(rsrp) if (~np.isnan(rsrp)).any() else np.nan,
+                   mean_velocity=np.nanmean(velocity) if (~np.isnan(velocity)).any() else np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            run['corr_delay_deviation'] = np.corrcoef(delay, dev['deviation'])[0, 1] if len(delay) > 1 else np.nan
+        run.update({k: v[0] for k, v in abs_stats(np.zeros(len(delay), dtype='int64'), 1, dev).items()})
+    return {'run': run, 'delay_bin': delay_axis.index(delay), 'velocity': velocity, 'dev': dev}
+
+
+def _analyse_file_safe(task):
+    path, delay_axis = task
+    try:
+        return analyse_file(path, delay_axis), None
+    except Exception as e:
+        return None, str(e)
+
+
+def process_files(files: Sequence[str], delay_axis: Axis, jobs: int = 1, quiet: bool = True):
+    """Returns (run rows, delay -> deviation summary) over `files`, merged in file order."""
+    tasks = [(f, delay_axis) for f in files]
+    if jobs > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_analyse_file_safe, tasks, chunksize=max(1, len(tasks) // (jobs * 4))))
+    else:
+        results = map(_analyse_file_safe, tasks)
+
+    runs, bins, velocity, devs = [], [], [], []
+    for f, (result, error) in zip(files, results):
+        if error is not None:
+            print(f"Warning: skipping {f}: {error}", file=sys.stderr)
+            continue
+        runs.append(result['run'])
+        bins.append(result['delay_bin'])
+        velocity.append(result['velocity'])
+        devs.append(result['dev'])
+        if not quiet:
+            print(f"{result['run']['rows']:7d} rows  {f}")
+    n_bins = delay_axis.n_bins
+    bins = np.concatenate(bins) if bins else np.empty(0, dtype='int64')
+    dev = {k: np.concatenate([d[k] for d in devs]) if devs else np.empty(0) for k in DEVIATIONS}
+    velocity = np.concatenate(velocity) if velocity else np.empty(0)
+    summary = {'delay': np.array(delay_axis.labels, dtype=object), 'rows': np.bincount(bins, minlength=n_bins)}
+    ok = ~np.isnan(velocity)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary['mean_velocity'] = (np.bincount(bins[ok], weights=velocity[ok], minlength=n_bins) /
+                                    np.bincount(bins[ok], minlength=n_bins))
+    summary.update(abs_stats(bins, n_bins, dev))
+    return runs, summary
+
+
+def write_csv(outfile: str, fields: List[str], rows: Sequence[dict]):
+    os.makedirs(os.path.dirname(os.path.abspath(outfile)), exist_ok=True)
+    with open(outfile, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow([format_value(row.get(f, np.nan)) for f in fields])
+
+
+def collect_files(args) -> List[str]:
+    from dataset_catalog import run_files
+    from trace_loader import detect_layout
+
+    if args.inputs:
+        return args.inputs
+    files = run_files(args.input_folder, args.pattern, args.include_derived)
+    return [f for f in files if detect_layout(f) in POSE_LAYOUTS]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Lateral/longitudinal position deviation vs delay for every run with pose columns.")
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument('--inputs', nargs='+', help='Trace files with currentX(m)/currentY columns')
+    group.add_argument('--input-folder', help='Folder searched for files with pose columns (use with --pattern)')
+    p.add_argument('--pattern', default='**/*.txt', help="Glob pattern, recursive (default '**/*.txt')")
+    p.add_argument('--include-derived', action='store_true', help='With --input-folder, keep merged copies such as all.txt')
+    p.add_argument('--delay-bins', default=','.join(map(str, DEFAULT_DELAY_BINS)),
+                   help='Delay bin edges in ms, right closed (default 20,30,50,100)')
+    p.add_argument('--runs', help='Write the per-run table (CSV)')
+    p.add_argument('--summary', help='Write the delay -> deviation summary (CSV)')
+    p.add_argument('--jobs', type=int, default=1, help='Worker processes; 0 = one per CPU (default 1, serial)')
+    p.add_argument('--quiet', action='store_true', help='Suppress per-file messages')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, 'position_deviation')
+    try:
+        edges = [float(x) for x in args.delay_bins.split(',') if x.strip()]
+    except ValueError:
+        print(f"Bad --delay-bins {args.delay_bins!r}", file=sys.stderr)
+        sys.exit(2)
+    try:
+        delay_axis = Axis('delay(ms)', edges)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+    with profiling.stage('discover'):
+        files = collect_files(args)
+    if not files:
+        print("No input files with pose columns found. Exiting.", file=sys.stderr)
+        sys.exit(2)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+
+    t0 = time.perf_counter()
+    with profiling.stage('analyse') as st:
+        runs, summary = process_files(files, delay_axis, jobs, args.quiet)
+        st.add(rows=sum(r['rows'] for r in runs))
+    print(f"{len(runs)} runs, {sum(r['rows'] for r in runs)} rows in {time.perf_counter() - t0:.2f} s")
+    rows = [dict(zip(summary, values)) for values in zip(*summary.values())]
+    print(f"{'delay':>8s} {'rows':>7s} {'mean|dev|':>9s} {'p95|dev|':>9s} {'mean|lat|':>9s} {'mean|lon|':>9s}")
+    for r in rows:
+        print(f"{r['delay']:>8s} {r['rows']:7d} {r['mean_deviation']:9.3f} {r['p95_deviation']:9.3f} "
+              f"{r['mean_lateral']:9.3f} {r['mean_longitudinal']:9.3f}")
+    if args.runs:
+        with profiling.stage('write'):
+            write_csv(args.runs, RUN_FIELDS, runs)
+        print(f"Wrote {args.runs}")
+    if args.summary:
+        with profiling.stage('write'):
+            write_csv(args.summary, SUMMARY_FIELDS, rows)
+        print(f"Wrote {args.summary}")
+
+
+if __name__ == '__main__':
+    main()
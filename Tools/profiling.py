@@ -0,0 +1,283 @@
+"""
+profiling.py
+
+Per-stage instrumentation shared by the tools (--profile on every tool).
+
+A tool's main() calls profiling.enable(args, tool) after parsing its
+arguments, and wraps its phases in stages:
+
+  with profiling.stage('discover'):
+      files = collect_files(args)
+  with profiling.stage('aggregate') as s:
+      ...
+      s.add(rows=n)
+  for chunk in profiling.timed_iter('parse', iter_trace_chunks(path)):
+      ...
+
+and the loaders record one entry per file they parse (trace_loader:
+'read', trace_cache: 'cache'), with the file's rows and bytes. For every
+stage the report keeps the number of calls, wall and CPU time (CPU includes
+reaped worker processes, e.g. a --jobs pool), rows, bytes and their rates,
+the process peak RSS at its end and how much the stage raised that peak.
+Stages may nest; a stage's time includes the stages run inside it. Files
+parsed inside --jobs worker processes are not listed per file (their time is
+in the enclosing stage).
+
+Without --profile every hook is a no-op. With --profile REPORT the report is
+written when the tool exits (also on sys.exit): REPORT.json is overwritten, a
+REPORT.jsonl gets one line appended per run, so a scheduled job keeps its
+history in one file. --profile-cprofile STAGE also runs every call of STAGE
+under cProfile: the stats are dumped to REPORT.STAGE.prof (for pstats or
+snakeviz) and the 25 costliest functions are listed in the report. Stage
+names depend on the tool (see its report); if STAGE never ran, a warning with
+the stages that did run is printed at exit and recorded under "cprofile".
+
+Usage examples:
+  python handover.py --input-folder data/ --profile outputs/handover.profile.json
+  python merge_txt_to_xlsx.py --input-folder data/ --pattern "**/*.txt" --stream --profile runs.jsonl --profile-cprofile write
+
+  # from another tool
+  import profiling
+  profiling.add_arguments(parser)
+  profiling.enable(args, 'my_tool')
+
+Dependencies:
+  none (standard library)
+"""
+import atexit
+import json
+import os
+import resource
+import sys
+import time
+from typing import Dict, List, Optional
+
+TOP_FUNCTIONS = 25
+
+_active = None  # the Profiler of this process, if --profile was given
+
+
+def _maxrss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _cpu() -> float:
+    """CPU seconds of this process and its reaped children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    kids = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + kids.ru_utime + kids.ru_stime
+
+
+def git_revision(cwd: Optional[str] = None) -> Optional[str]:
+    """Short HEAD revision of the repository the tools live in ('-dirty' with local changes), or None."""
+    import subprocess
+
+    cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=cwd)
+    except OSError:
+        return None
+    if out.returncode != 0:
+        return None
+    dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True,
+                           cwd=cwd).stdout.strip()
+    return out.stdout.strip() + ('-dirty' if dirty else '')
+
+
+class _NullStage:
+    """What stage() returns when profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, rows: int = 0, bytes: int = 0):
+        pass
+
+
+_NULL = _NullStage()
+
+
+class Stage:
+    def __init__(self, profiler: 'Profiler', name: str, file: Optional[str] = None, rows: int = 0, bytes: int = 0):
+        self.profiler = profiler
+        self.name = name
+        self.file = file
+        self.rows = rows
+        self.bytes = bytes
+
+    def add(self, rows: int = 0, bytes: int = 0):
+        self.rows += int(rows)
+        self.bytes += int(bytes)
+
+    def __enter__(self):
+        self.rss0 = _maxrss_mb()
+        self.profiler._start_cprofile(self.name)
+        self.cpu0 = _cpu()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.t0
+        cpu = _cpu() - self.cpu0
+        self.profiler._stop_cprofile(self.name)
+        rss = _maxrss_mb()
+        self.profiler._record(self, wall, cpu, rss, rss - self.rss0)
+        return False
+
+
+class Profiler:
+    def __init__(self, tool: str, report: str, cprofile_stage: Optional[str] = None):
+        self.tool = tool
+        self.report = report
+        self.cprofile_stage = cprofile_stage
+        self.stages: Dict[str, dict] = {}
+        self.files: List[dict] = []
+        self.t0 = time.perf_counter()
+        self.cpu0 = _cpu()
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self._cprof = None
+        self._cprof_depth = 0
+
+    def _start_cprofile(self, name: str):
+        if name != self.cprofile_stage:
+            return
+        if self._cprof is None:
+            import cProfile
+            self._cprof = cProfile.Profile()
+        if self._cprof_depth == 0:
+            self._cprof.enable()
+        self._cprof_depth += 1
+
+    def _stop_cprofile(self, name: str):
+        if name != self.cprofile_stage:
+            return
+        self._cprof_depth -= 1
+        if self._cprof_depth == 0:
+            self._cprof.disable()
+
+    def _record(self, st: Stage, wall: float, cpu: float, rss: float, growth: float):
+        s = self.stages.setdefault(st.name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows': 0, 'bytes': 0,
+                                             'peak_rss_mb': 0.0, 'rss_growth_mb': 0.0})
+        s['calls'] += 1
+        s['wall_s'] += wall
+        s['cpu_s'] += cpu
+        s['rows'] += st.rows
+        s['bytes'] += st.bytes
+        s['peak_rss_mb'] = max(s['peak_rss_mb'], rss)
+        s['rss_growth_mb'] += growth
+        if st.file is not None:
+            self.files.append({'file': st.file, 'stage': st.name, 'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6),
+                               'rows': st.rows, 'bytes': st.bytes, 'rss_growth_mb': round(growth, 1)})
+
+    def _cprofile_report(self) -> Optional[dict]:
+        if self.cprofile_stage is None:
+            return None
+        if self._cprof is None:
+            ran = sorted(self.stages)
+            print(f"Warning: --profile-cprofile stage {self.cprofile_stage!r} never ran; no cProfile data. "
+                  f"Stages of this run: {', '.join(ran) or 'none'}", file=sys.stderr)
+            return {'stage': self.cprofile_stage, 'error': 'stage never ran', 'stages': ran}
+        import pstats
+        path = f"{os.path.splitext(self.report)[0]}.{self.cprofile_stage}.prof"
+        self._cprof.dump_stats(path)
+        stats = pstats.Stats(self._cprof).stats
+        top = sorted(stats.items(), key=lambda kv: kv[1][3], reverse=True)[:TOP_FUNCTIONS]
+        return {'stage': self.cprofile_stage, 'stats_file': path,
+                'top': [{'function': f"{os.path.basename(fn)}:{line}({name})", 'calls': nc, 'tottime_s': round(tt, 6),
+                         'cumtime_s': round(ct, 6)} for (fn, line, name), (_, nc, tt, ct, _) in top]}
+
+    def result(self) -> dict:
+        import platform
+
+        wall = time.perf_counter() - self.t0
+        stages = {}
+        for name, s in self.stages.items():
+            s = dict(s, wall_s=round(s['wall_s'], 6), cpu_s=round(s['cpu_s'], 6),
+                     peak_rss_mb=round(s['peak_rss_mb'], 1), rss_growth_mb=round(s['rss_growth_mb'], 1))
+            if s['wall_s'] > 0 and s['rows']:
+                s['rows_per_s'] = round(s['rows'] / s['wall_s'], 1)
+            if s['wall_s'] > 0 and s['bytes']:
+                s['mb_per_s'] = round(s['bytes'] / 2**20 / s['wall_s'], 3)
+            stages[name] = s
+        return {'tool': self.tool, 'argv': sys.argv[1:], 'started': self.started, 'host': platform.node(),
+                'cpus': os.cpu_count(), 'python': platform.python_version(), 'revision': git_revision(),
+                'wall_s': round(wall, 6), 'cpu_s': round(_cpu() - self.cpu0, 6), 'peak_rss_mb': round(_maxrss_mb(), 1),
+                'stages': stages, 'files': self.files, 'cprofile': self._cprofile_report()}
+
+    def write(self):
+        try:
+            record = self.result()
+            os.makedirs(os.path.dirname(os.path.abspath(self.report)), exist_ok=True)
+            if self.report.endswith('.jsonl'):
+                with open(self.report, 'a', encoding='utf-8') as fh:
+                    fh.write(json.dumps(record) + '\n')
+            else:
+                with open(self.report, 'w', encoding='utf-8') as fh:
+                    json.dump(record, fh, indent=1)
+        except OSError as e:
+            print(f"Warning: cannot write profile {self.report}: {e}", file=sys.stderr)
+            return
+        print(f"Profile written to {self.report}", file=sys.stderr)
+
+
+def add_arguments(p):
+    """Add --profile and --profile-cprofile to an argparse parser (or subparser)."""
+    p.add_argument('--profile', metavar='REPORT',
+                   help='Write per-stage/per-file time, CPU, peak RSS, rows and bytes as JSON (.jsonl: append a line)')
+    p.add_argument('--profile-cprofile', metavar='STAGE', help='Also run STAGE under cProfile (stats: REPORT.STAGE.prof)')
+
+
+def enable(args, tool: str) -> Optional[Profiler]:
+    """Start profiling this process if args.profile is set; the report is written at exit."""
+    global _active
+    report = getattr(args, 'profile', None)
+    if not report or _active is not None:
+        return _active
+    _active = Profiler(tool, report, getattr(args, 'profile_cprofile', None))
+    atexit.register(_active.write)
+    return _active
+
+
+def active() -> bool:
+    return _active is not None
+
+
+def stage(name: str, rows: int = 0, bytes: int = 0):
+    """Context manager timing one stage; `with stage(...) as s: s.add(rows=n)` adds counts."""
+    if _active is None:
+        return _NULL
+    return Stage(_active, name, rows=rows, bytes=bytes)
+
+
+def timed_iter(name: str, iterable):
+    """Iterate `iterable`, timing each step (e.g. parsing the next chunk) as stage `name` with the item's rows."""
+    if _active is None:
+        return iterable
+    return _timed_iter(name, iter(iterable))
+
+
+def _timed_iter(name, it):
+    while True:
+        with stage(name) as st:
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            st.add(rows=len(item) if hasattr(item, '__len__') else 0)
+        yield item
+
+
+def file_stage(name: str, path: str, rows: int = 0, bytes: Optional[int] = None):
+    """Like stage(), also listed per file; bytes defaults to the file's size."""
+    if _active is None:
+        return _NULL
+    if bytes is None:
+        try:
+            bytes = os.path.getsize(path)
+        except OSError:
+            bytes = 0
+    return Stage(_active, name, file=path, rows=rows, bytes=bytes)
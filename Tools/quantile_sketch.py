@@ -0,0 +1,261 @@
+"""
+quantile_sketch.py
+
+Mergeable streaming quantile sketch (DDSketch) for delay percentiles.
+
+A value x > 0 is counted in bucket k = ceil(log_gamma(x)), with
+gamma = (1 + alpha) / (1 - alpha); every quantile read back from the sketch is
+within a relative error alpha of the true sample quantile (1 % by default).
+Negative values (clock offsets between the two loggers) go to a mirrored
+store, zeros are counted separately. Count, sum, min and max are kept exactly,
+so means and the extreme whiskers are exact.
+
+Memory depends on the value range, not on the number of samples: delays from
+1 ms to 10 s need ~460 buckets at alpha=0.01. When a store exceeds
+`max_buckets` its lowest buckets are collapsed, which only affects the
+accuracy of the smallest quantiles. Two sketches with the same alpha merge by
+adding bucket counts, so per-file or per-day sketches can be combined and
+persisted with to_dict()/from_dict().
+
+Usage examples:
+  # percentiles of the delay column of every run, one streaming pass (merged
+  # copies such as all.txt are skipped unless --include-derived)
+  python quantile_sketch.py --input-folder data/ --pattern "**/*.txt" --column "delay(ms)"
+
+  # from another tool
+  from quantile_sketch import DDSketch
+  sk = DDSketch()
+  sk.add(delays)                  # any iterable / array, call repeatedly
+  sk.merge(other_sketch)
+  sk.quantile(0.99), sk.box_stats(label='50')   # box_stats feeds Axes.bxp
+
+Dependencies:
+  numpy (pandas only for the command-line summary)
+"""
+import argparse
+import json
+import math
+import sys
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+import profiling
+
+DEFAULT_ALPHA = 0.01
+DEFAULT_MAX_BUCKETS = 2048
+
+# percentiles reported by summary()
+SUMMARY_QUANTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('p99.9', 0.999))
+
+
+class DDSketch:
+    def __init__(self, alpha: float = DEFAULT_ALPHA, max_buckets: int = DEFAULT_MAX_BUCKETS):
+        if not 0 < alpha < 1:
+            raise ValueError(f"alpha must be in (0, 1), got {alpha}")
+        self.alpha = alpha
+        self.max_buckets = max_buckets
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _keys(self, values: np.ndarray) -> np.ndarray:
+        return np.ceil(np.log(values) / self._log_gamma).astype('int64')
+
+    def _value(self, key: int) -> float:
+        # midpoint (in relative terms) of bucket (gamma^(k-1), gamma^k]
+        return 2.0 * self.gamma ** key / (self.gamma + 1)
+
+    @staticmethod
+    def _add_to_store(store: Dict[int, int], keys: np.ndarray):
+        uniq, counts = np.unique(keys, return_counts=True)
+        for k, c in zip(uniq.tolist(), counts.tolist()):
+            store[k] = store.get(k, 0) + c
+
+    def _collapse(self, store: Dict[int, int]):
+        if len(store) <= self.max_buckets:
+            return
+        keys = sorted(store)
+        excess = keys[:len(keys) - self.max_buckets + 1]
+        total = sum(store.pop(k) for k in excess)
+        store[excess[-1]] = total
+
+    def add(self, values: Iterable[float]):
+        """Add a batch of values; NaNs are ignored."""
+        arr = np.asarray(values, dtype='float64').ravel()
+        arr = arr[~np.isnan(arr)]
+        if arr.size == 0:
+            return
+        self.count += int(arr.size)
+        self.sum += float(arr.sum())
+        self.min = min(self.min, float(arr.min()))
+        self.max = max(self.max, float(arr.max()))
+        pos = arr[arr > 0]
+        neg = arr[arr < 0]
+        self.zero_count += int(arr.size - pos.size - neg.size)
+        if pos.size:
+            self._add_to_store(self.positive, self._keys(pos))
+            self._collapse(self.positive)
+        if neg.size:
+            self._add_to_store(self.negative, self._keys(-neg))
+            self._collapse(self.negative)
+
+    def merge(self, other: 'DDSketch'):
+        if not math.isclose(self.alpha, other.alpha):
+            raise ValueError(f"Cannot merge sketches with alpha {self.alpha} and {other.alpha}")
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for k, c in other_store.items():
+                store[k] = store.get(k, 0) + c
+            self._collapse(store)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else math.nan
+
+    def quantile(self, q: float) -> float:
+        """Approximate q-quantile (0 <= q <= 1); NaN for an empty sketch."""
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs: Sequence[float]) -> list:
+        if self.count == 0:
+            return [math.nan] * len(qs)
+        # buckets in ascending value order: negatives (largest magnitude first), zeros, positives
+        values = [-self._value(k) for k in sorted(self.negative, reverse=True)]
+        counts = [self.negative[k] for k in sorted(self.negative, reverse=True)]
+        if self.zero_count:
+            values.append(0.0)
+            counts.append(self.zero_count)
+        values += [self._value(k) for k in sorted(self.positive)]
+        counts += [self.positive[k] for k in sorted(self.positive)]
+        cum = np.cumsum(counts)
+        out = []
+        for q in qs:
+            if not 0 <= q <= 1:
+                raise ValueError(f"quantile must be in [0, 1], got {q}")
+            if q == 0:
+                out.append(self.min)
+            elif q == 1:
+                out.append(self.max)
+            else:
+                i = int(np.searchsorted(cum, q * (self.count - 1), side='right'))
+                out.append(min(max(values[i], self.min), self.max))
+        return out
+
+    def box_stats(self, label: Optional[str] = None, whis: float = 1.5) -> dict:
+        """
+        Statistics in the format of matplotlib.cbook.boxplot_stats, for Axes.bxp.
+
+        Whiskers reach the most extreme bucket inside [q1 - whis*iqr, q3 + whis*iqr]
+        (exact min/max when nothing lies outside); fliers are not kept.
+        """
+        q1, med, q3 = self.quantiles([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        lo, hi = q1 - whis * iqr, q3 + whis * iqr
+        if self.min >= lo:
+            whislo = self.min
+        else:
+            inside = [v for v in self._bucket_values() if v >= lo]
+            whislo = min(inside) if inside else q1
+        if self.max <= hi:
+            whishi = self.max
+        else:
+            inside = [v for v in self._bucket_values() if v <= hi]
+            whishi = max(inside) if inside else q3
+        stats = {'med': med, 'q1': q1, 'q3': q3, 'iqr': iqr, 'whislo': whislo, 'whishi': whishi,
+                 'mean': self.mean, 'fliers': np.empty(0)}
+        if label is not None:
+            stats['label'] = label
+        return stats
+
+    def _bucket_values(self):
+        values = [-self._value(k) for k in self.negative] + [self._value(k) for k in self.positive]
+        if self.zero_count:
+            values.append(0.0)
+        return values
+
+    def summary(self) -> dict:
+        """Count, mean, min, max and the SUMMARY_QUANTILES percentiles."""
+        out = {'count': self.count, 'mean': self.mean,
+               'min': self.min if self.count else math.nan, 'max': self.max if self.count else math.nan}
+        out.update(zip((name for name, _ in SUMMARY_QUANTILES), self.quantiles([q for _, q in SUMMARY_QUANTILES])))
+        return out
+
+    def to_dict(self) -> dict:
+        return {'alpha': self.alpha, 'max_buckets': self.max_buckets, 'count': self.count, 'sum': self.sum,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None,
+                'zero_count': self.zero_count,
+                'positive': {str(k): c for k, c in self.positive.items()},
+                'negative': {str(k): c for k, c in self.negative.items()}}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'DDSketch':
+        sk = cls(d['alpha'], d.get('max_buckets', DEFAULT_MAX_BUCKETS))
+        sk.count = d['count']
+        sk.sum = d['sum']
+        sk.min = d['min'] if d['min'] is not None else math.inf
+        sk.max = d['max'] if d['max'] is not None else -math.inf
+        sk.zero_count = d['zero_count']
+        sk.positive = {int(k): c for k, c in d['positive'].items()}
+        sk.negative = {int(k): c for k, c in d['negative'].items()}
+        return sk
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"DDSketch(alpha={self.alpha}, count={self.count}, buckets={len(self.positive) + len(self.negative)})"
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Streaming delay percentiles over trace files.")
+    p.add_argument('--input-folder', required=True, help='Folder containing trace files')
+    p.add_argument('--pattern', default='**/*.txt', help="Glob pattern, recursive (default '**/*.txt')")
+    p.add_argument('--column', default='delay(ms)', help="Column to summarise (default 'delay(ms)')")
+    p.add_argument('--include-derived', action='store_true', help='Keep merged copies such as all.txt')
+    p.add_argument('--alpha', type=float, default=DEFAULT_ALPHA, help='Relative accuracy (default 0.01)')
+    p.add_argument('--save', help='Write the merged sketch as JSON')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    from dataset_catalog import run_files
+    from trace_cache import load_trace
+
+    profiling.enable(args, 'quantile_sketch')
+    with profiling.stage('discover'):
+        files = run_files(args.input_folder, args.pattern, args.include_derived)
+    if not files:
+        print(f"No files found in {args.input_folder} matching {args.pattern}", file=sys.stderr)
+        sys.exit(1)
+    sketch = DDSketch(args.alpha)
+    with profiling.stage('sketch') as st:
+        for f in files:
+            try:
+                sketch.add(load_trace(f, columns=[args.column])[args.column].to_numpy(dtype='float64', na_value=np.nan))
+            except (OSError, ValueError) as e:
+                print(f"Warning: skipping {f}: {e}", file=sys.stderr)
+        st.add(rows=sketch.count)
+    for name, value in sketch.summary().items():
+        print(f"{name:>6s}  {value:g}")
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as fh:
+            json.dump(sketch.to_dict(), fh)
+        print(f"Wrote {args.save}")
+
+
+if __name__ == '__main__':
+    main()
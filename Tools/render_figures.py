@@ -0,0 +1,188 @@
+"""
+render_figures.py
+
+Headless batch renderer for the figure scripts in this folder.
+
+A JSON spec lists the figures; each entry names a script (module in Tools/)
+and the command-line arguments it would be run with. Every figure is rendered
+on the non-interactive Agg backend by calling the script's main(argv) in a
+worker process, so a full 900-dpi figure set regenerates unattended on a
+machine without a display, several figures at a time.
+
+Spec format:
+  {
+    "defaults": {"dpi": 900},
+    "figures": [
+      {"name": "rsrp_delay",
+       "script": "Draw_With_Impact_Of_Signal_Strength_On_delay",
+       "args": ["--out", "figures/RSRP_Delay.png"]},
+      {"name": "violin_frequency",
+       "script": "Draw_Violin_Plot_With_Impact_Of_Data_Transmission_On_Delay",
+       "args": ["--group", "10", {"glob": "data/Urban road/3-Data transmission frequency/100ms/n8/v30/v2v_info-*.txt"},
+                "--out", "figures/violin_frequency.png"]}
+    ]
+  }
+An argument given as {"glob": pattern} expands to the sorted matching paths.
+"defaults.dpi" is passed as --dpi to every figure whose args do not set it.
+Relative paths are resolved against --root (default: the current directory).
+
+Usage examples:
+  # render every figure of the spec with one worker per CPU
+  python render_figures.py --spec paper_figures.json --root .. --jobs 0
+
+  # only two figures, serially
+  python render_figures.py --spec paper_figures.json --only rsrp_delay violin_frequency
+
+Dependencies:
+  matplotlib (plus whatever the listed scripts need)
+"""
+import argparse
+import glob
+import importlib
+import json
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import profiling
+
+_TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _use_agg(root: Optional[str] = None):
+    # runs once per worker (and in the parent for --jobs 1) before any figure script is imported
+    os.environ['MPLBACKEND'] = 'Agg'
+    import matplotlib
+    matplotlib.use('Agg')
+    if _TOOLS_DIR not in sys.path:
+        sys.path.insert(0, _TOOLS_DIR)
+    if root:
+        os.chdir(root)
+
+
+def _expand_args(args: list, root: str) -> List[str]:
+    out = []
+    for a in args:
+        if isinstance(a, dict) and 'glob' in a:
+            matches = sorted(glob.glob(os.path.join(root, a['glob']), recursive=True))
+            if not matches:
+                raise ValueError(f"glob {a['glob']!r} matched no files")
+            out.extend(os.path.relpath(m, root) for m in matches)
+        else:
+            out.append(str(a))
+    return out
+
+
+def load_spec(spec_file: str, root: str) -> List[Tuple[str, str, List[str], str]]:
+    """Return [(name, script, argv, out), ...] for the figures of a spec file."""
+    with open(spec_file, 'r', encoding='utf-8') as fh:
+        spec = json.load(fh)
+    defaults = spec.get('defaults', {})
+    tasks = []
+    for i, fig in enumerate(spec.get('figures', [])):
+        if 'script' not in fig:
+            raise ValueError(f"figure #{i} has no 'script'")
+        script = os.path.splitext(os.path.basename(fig['script']))[0]
+        name = fig.get('name', f"{script}-{i}")
+        argv = _expand_args(fig.get('args', []), root)
+        if 'dpi' in defaults and '--dpi' not in argv:
+            argv += ['--dpi', str(defaults['dpi'])]
+        out = argv[argv.index('--out') + 1] if '--out' in argv[:-1] else ''
+        tasks.append((name, script, argv, out))
+    return tasks
+
+
+def render_one(task) -> Tuple[str, bool, str, float]:
+    """Render one figure in the current process; returns (name, ok, message, seconds)."""
+    name, script, argv, out = task
+    t0 = time.perf_counter()
+    try:
+        if out and os.path.dirname(out):
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+        module = importlib.import_module(script)
+        # figures rendered in this process are listed per figure (not those of --jobs workers)
+        with profiling.file_stage('figure', name, bytes=0):
+            module.main(argv)
+        ok, msg = True, out
+    except SystemExit as e:
+        ok = e.code in (None, 0)
+        msg = out if ok else f"exited with status {e.code}"
+    except Exception as e:
+        ok, msg = False, f"{type(e).__name__}: {e}"
+    finally:
+        import matplotlib.pyplot as plt
+        plt.close('all')
+    return name, ok, msg, time.perf_counter() - t0
+
+
+def render_all(tasks, root: str, jobs: int = 1, quiet: bool = False) -> int:
+    """Render all tasks, `jobs` at a time; returns the number of failures."""
+    failures = 0
+    if jobs > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_use_agg, initargs=(root,)) as pool:
+            futures = [pool.submit(render_one, t) for t in tasks]
+            results = (f.result() for f in as_completed(futures))
+            failures = _report(results, quiet)
+    else:
+        _use_agg(root)
+        failures = _report((render_one(t) for t in tasks), quiet)
+    return failures
+
+
+def _report(results, quiet: bool) -> int:
+    failures = 0
+    for name, ok, msg, secs in results:
+        if ok:
+            if not quiet:
+                print(f"ok      {secs:7.2f} s  {name}: {msg}")
+        else:
+            failures += 1
+            print(f"FAILED  {secs:7.2f} s  {name}: {msg}", file=sys.stderr)
+    return failures
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Render the figures listed in a spec file, headless and in parallel.")
+    p.add_argument('--spec', required=True, help='JSON spec listing the figures (see module docstring)')
+    p.add_argument('--root', default='.', help='Directory relative paths in the spec refer to (default .)')
+    p.add_argument('--jobs', type=int, default=0, help='Worker processes; 0 = one per CPU (default 0)')
+    p.add_argument('--only', nargs='+', help='Render only the figures with these names')
+    p.add_argument('--list', action='store_true', help='Print the expanded commands and exit')
+    p.add_argument('--quiet', action='store_true', help='Only report failures')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, 'render_figures')
+    root = os.path.abspath(args.root)
+    try:
+        tasks = load_spec(args.spec, root)
+    except (OSError, ValueError) as e:
+        print(f"Error reading spec {args.spec}: {e}", file=sys.stderr)
+        sys.exit(2)
+    if args.only:
+        unknown = set(args.only) - {t[0] for t in tasks}
+        if unknown:
+            print(f"Unknown figure names: {', '.join(sorted(unknown))}", file=sys.stderr)
+            sys.exit(2)
+        tasks = [t for t in tasks if t[0] in args.only]
+    if args.list:
+        for name, script, argv, _ in tasks:
+            print(f"{name}: python {script}.py " + ' '.join(f'"{a}"' if ' ' in a else a for a in argv))
+        return
+
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    t0 = time.perf_counter()
+    with profiling.stage('render_all'):
+        failures = render_all(tasks, root, jobs=jobs, quiet=args.quiet)
+    print(f"\nRendered {len(tasks) - failures}/{len(tasks)} figures in {time.perf_counter() - t0:.1f} s ({jobs} jobs)")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
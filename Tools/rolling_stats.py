@@ -0,0 +1,292 @@
+"""
+rolling_stats.py
+
+Time-windowed rolling delay statistics and outage episodes, per run.
+
+Rolling windows are trailing windows on pub_time(ms): the window of row i
+holds the rows of the same run with t_i - window < t <= t_i. Window bounds
+come from one np.searchsorted over all runs at once (runs are laid out on a
+single sorted time axis, far apart, so windows never cross a run boundary),
+and count, mean and the share of delays above the threshold are differences
+of prefix sums - O(1) per window, nothing is recomputed per window.
+
+The rolling quantile (p95 by default) is exact, with the 'inverted_cdf'
+definition (the smallest delay d with at least ceil(q*n) window values <= d).
+It is kept incrementally: delays are coded by their rank among the distinct
+values, the window is a histogram over the codes (each row added once and
+removed once), and a pointer to the quantile's code moves up or down as the
+window slides - O(1) amortized per row, since the quantile of neighbouring
+windows is a few distinct values apart.
+
+Episodes are maximal runs of consecutive rows with delay above the
+threshold: start/end pub_time, duration, number of rows, max and mean delay,
+and the utmX/utmY position where the episode started and ended.
+
+Usage examples:
+  # episode table for every run under data/, plus per-run summary
+  python rolling_stats.py --input-folder data/ --episodes episodes.csv
+
+  # per-row 1 s rolling p95 for runs selected from the catalog
+  python rolling_stats.py --catalog catalog.csv --query "n78, v>=50" --window 1000 --rolling rolling.csv
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+import profiling
+from binning import format_value
+
+DEFAULT_WINDOW_MS = 1000
+DEFAULT_THRESHOLD_MS = 100
+DEFAULT_QUANTILE = 0.95
+
+# runs are placed this far apart on the combined time axis (pub_time is ~1.7e12 ms)
+_RUN_SPACING_MS = 10 ** 13
+
+EPISODE_FIELDS = ['run', 'start_ms', 'end_ms', 'duration_ms', 'rows', 'max_delay', 'mean_delay',
+                  'start_x', 'start_y', 'end_x', 'end_y']
+
+
+class RunSet:
+    """Columns of several runs concatenated, each run sorted by pub_time (rows without one dropped)."""
+    def __init__(self, names: List[str], columns: List[Dict[str, np.ndarray]]):
+        self.names = names
+        parts = {'t': [], 'delay': [], 'x': [], 'y': []}
+        lengths = []
+        for cols in columns:
+            t = np.asarray(cols['pub_time(ms)'], dtype='float64')
+            keep = np.flatnonzero(~np.isnan(t))
+            order = keep[np.argsort(t[keep], kind='stable')]
+            for attr, name in (('t', 'pub_time(ms)'), ('delay', 'delay(ms)'), ('x', 'utmX(m)'), ('y', 'utmY(m)')):
+                arr = np.asarray(cols[name], dtype='float64')[order] if name in cols else np.full(len(order), np.nan)
+                parts[attr].append(arr)
+            lengths.append(len(order))
+        for attr, arrs in parts.items():
+            setattr(self, attr, np.concatenate(arrs) if arrs else np.empty(0))
+        lengths = np.array(lengths, dtype='int64')
+        self.offsets = np.r_[0, np.cumsum(lengths)]
+        self.run = np.repeat(np.arange(len(names)), lengths)
+        # one sorted time axis for all runs: run r starts at r * _RUN_SPACING_MS
+        first = self.t[self.offsets[:-1][lengths > 0]]
+        first_per_run = np.zeros(len(names))
+        first_per_run[lengths > 0] = first
+        self.key = self.run * float(_RUN_SPACING_MS) + (self.t - first_per_run[self.run])
+
+    def __len__(self):
+        return len(self.t)
+
+
+def window_starts(key: np.ndarray, window_ms: float) -> np.ndarray:
+    """Index of the first row of each row's trailing window (key sorted ascending)."""
+    return np.searchsorted(key, key - window_ms, side='right')
+
+
+def rolling_stats(rs: RunSet, window_ms: float = DEFAULT_WINDOW_MS, threshold: float = DEFAULT_THRESHOLD_MS,
+                  quantile: float = DEFAULT_QUANTILE) -> Dict[str, np.ndarray]:
+    """Per-row trailing-window count, mean delay, share above threshold and quantile."""
+    delay = rs.delay
+    valid = ~np.isnan(delay)
+    d = np.where(valid, delay, 0.0)
+    start = window_starts(rs.key, window_ms)
+    end = np.arange(1, len(delay) + 1)
+
+    def prefix(values):
+        return np.r_[0, np.cumsum(values)]
+
+    c_valid = prefix(valid)
+    count = c_valid[end] - c_valid[start]
+    total = prefix(d)[end] - prefix(d)[start]
+    over = prefix(valid & (d > threshold))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        over_rate = (over[end] - over[start]) / count
+    return {'count': count, 'mean': mean, 'over_rate': over_rate,
+            'quantile': rolling_quantile(delay, start, end, quantile)}
+
+
+def rolling_quantile(delay: np.ndarray, start: np.ndarray, end: np.ndarray, q: float) -> np.ndarray:
+    """Exact inverted-CDF q-quantile of delay[start[i]:end[i]] for every i (NaNs ignored).
+
+    The windows must slide forward (start and end non-decreasing, end[i] == i + 1).
+    """
+    valid = ~np.isnan(delay)
+    values, codes = np.unique(np.where(valid, delay, np.inf), return_inverse=True)
+    codes = np.where(valid, codes, -1).tolist()
+    c_valid = np.r_[0, np.cumsum(valid)]
+    n = c_valid[end] - c_valid[start]
+    rank = np.ceil(q * n).astype('int64')
+    rank[(rank == 0) & (n > 0)] = 1
+    rank = rank.tolist()
+    counts = [0] * len(values)
+    # quantile pointer: code p and the number of window values with code <= p
+    p, le = -1, 0
+    out = np.full(len(delay), np.nan)
+    pos = np.full(len(delay), -1, dtype='int64')
+    s = 0
+    for i, lo in enumerate(start.tolist()):
+        c = codes[i]
+        if c >= 0:
+            counts[c] += 1
+            if c <= p:
+                le += 1
+        while s < lo:
+            c = codes[s]
+            if c >= 0:
+                counts[c] -= 1
+                if c <= p:
+                    le -= 1
+            s += 1
+        k = rank[i]
+        if k == 0:
+            continue
+        while le < k:
+            p += 1
+            le += counts[p]
+        while le - counts[p] >= k:
+            le -= counts[p]
+            p -= 1
+        pos[i] = p
+    found = pos >= 0
+    out[found] = values[pos[found]]
+    return out
+
+
+def find_episodes(rs: RunSet, threshold: float = DEFAULT_THRESHOLD_MS) -> Dict[str, np.ndarray]:
+    """Maximal runs of consecutive rows (within a run) with delay > threshold."""
+    above = rs.delay > threshold
+    if len(above) == 0:
+        return {f: np.empty(0) for f in EPISODE_FIELDS}
+    run = rs.run
+    new_run = np.r_[True, run[1:] != run[:-1]]
+    prev_above = np.r_[False, above[:-1]] & ~new_run
+    next_new = np.r_[new_run[1:], True]
+    next_above = np.r_[above[1:], False] & ~next_new
+    starts = np.flatnonzero(above & ~prev_above)
+    ends = np.flatnonzero(above & ~next_above)
+    rows = ends - starts + 1
+    c = np.r_[0, np.cumsum(np.where(above, rs.delay, 0.0))]
+    max_delay = np.maximum.reduceat(np.where(above, rs.delay, -np.inf), starts) if len(starts) else np.empty(0)
+    return {'run': run[starts], 'start_ms': rs.t[starts], 'end_ms': rs.t[ends],
+            'duration_ms': rs.t[ends] - rs.t[starts], 'rows': rows, 'max_delay': max_delay,
+            'mean_delay': (c[ends + 1] - c[starts]) / rows,
+            'start_x': rs.x[starts], 'start_y': rs.y[starts], 'end_x': rs.x[ends], 'end_y': rs.y[ends]}
+
+
+def load_runs(files: Sequence[str], quiet: bool = True) -> RunSet:
+    from trace_cache import load_columns
+
+    names, columns = [], []
+    for f in files:
+        try:
+            cols = load_columns(f, ['pub_time(ms)', 'delay(ms)', 'utmX(m)', 'utmY(m)'])
+        except (OSError, ValueError) as e:
+            print(f"Warning: skipping {f}: {e}", file=sys.stderr)
+            continue
+        names.append(f)
+        columns.append(cols)
+        if not quiet:
+            print(f"Loaded {f}")
+    return RunSet(names, columns)
+
+
+def collect_files(args) -> List[str]:
+    if args.inputs:
+        return args.inputs
+    if args.query is not None:
+        from dataset_catalog import query_files
+        return query_files(args.catalog, args.query)
+    from dataset_catalog import run_files
+    return run_files(args.input_folder, args.pattern, args.include_derived)
+
+
+def write_episodes(outfile: str, rs: RunSet, episodes: Dict[str, np.ndarray]):
+    os.makedirs(os.path.dirname(os.path.abspath(outfile)), exist_ok=True)
+    with open(outfile, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(['file'] + EPISODE_FIELDS[1:])
+        for i in range(len(episodes['run'])):
+            writer.writerow([rs.names[episodes['run'][i]]] +
+                            [format_value(episodes[f][i]) for f in EPISODE_FIELDS[1:]])
+
+
+def write_rolling(outfile: str, rs: RunSet, stats: Dict[str, np.ndarray], q: float):
+    os.makedirs(os.path.dirname(os.path.abspath(outfile)), exist_ok=True)
+    with open(outfile, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(['file', 'pub_time(ms)', 'delay(ms)', 'count', 'mean', 'over_rate', f'p{q * 100:g}'])
+        for i in range(len(rs)):
+            writer.writerow([rs.names[rs.run[i]], format_value(rs.t[i]), format_value(rs.delay[i]),
+                             int(stats['count'][i]), format_value(stats['mean'][i]),
+                             format_value(stats['over_rate'][i]), format_value(stats['quantile'][i])])
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Rolling delay statistics and outage episodes per run.")
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument('--inputs', nargs='+', help='Trace files (one run each)')
+    group.add_argument('--input-folder', help='Folder containing trace files (use with --pattern)')
+    group.add_argument('--query', help='Select run files from the dataset catalog, e.g. "n78, v>=50, arterial"')
+    p.add_argument('--catalog', default='catalog.csv', help='Catalog built by dataset_catalog.py (used with --query)')
+    p.add_argument('--pattern', default='**/*.txt', help="Glob pattern, recursive (default '**/*.txt')")
+    p.add_argument('--include-derived', action='store_true', help='With --input-folder, keep merged copies such as all.txt')
+    p.add_argument('--window', type=float, default=DEFAULT_WINDOW_MS, help='Trailing window length in ms (default 1000)')
+    p.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD_MS, help='Outage delay threshold in ms (default 100)')
+    p.add_argument('--quantile', type=float, default=DEFAULT_QUANTILE, help='Rolling quantile (default 0.95)')
+    p.add_argument('--episodes', help='Write the episode table (CSV)')
+    p.add_argument('--rolling', help='Write per-row rolling statistics (CSV)')
+    p.add_argument('--quiet', action='store_true', help='Suppress the per-run summary')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, 'rolling_stats')
+    with profiling.stage('discover'):
+        files = collect_files(args)
+    if not files:
+        print("No input files found. Exiting.", file=sys.stderr)
+        sys.exit(2)
+
+    t0 = time.perf_counter()
+    with profiling.stage('load') as st:
+        rs = load_runs(files)
+        st.add(rows=len(rs))
+    t1 = time.perf_counter()
+    with profiling.stage('rolling', rows=len(rs)):
+        stats = rolling_stats(rs, args.window, args.threshold, args.quantile)
+    with profiling.stage('episodes', rows=len(rs)):
+        episodes = find_episodes(rs, args.threshold)
+    t2 = time.perf_counter()
+    print(f"{len(rs.names)} runs, {len(rs)} rows, {len(episodes['run'])} episodes above {args.threshold:g} ms; "
+          f"load {t1 - t0:.3f} s, compute {t2 - t1:.3f} s")
+
+    if args.episodes:
+        with profiling.stage('write'):
+            write_episodes(args.episodes, rs, episodes)
+        print(f"Wrote {args.episodes}")
+    if args.rolling:
+        with profiling.stage('write', rows=len(rs)):
+            write_rolling(args.rolling, rs, stats, args.quantile)
+        print(f"Wrote {args.rolling}")
+    if not args.quiet:
+        qname = f"p{args.quantile * 100:g}"
+        print(f"\n{'episodes':>8s} {'longest(ms)':>11s} {'max ' + qname:>9s}  file")
+        for r, name in enumerate(rs.names):
+            sel = episodes['run'] == r
+            lo, hi = rs.offsets[r], rs.offsets[r + 1]
+            peak = np.nanmax(stats['quantile'][lo:hi]) if hi > lo and not np.all(np.isnan(stats['quantile'][lo:hi])) else np.nan
+            longest = episodes['duration_ms'][sel].max() if sel.any() else 0
+            print(f"{int(sel.sum()):8d} {longest:11.0f} {peak:9.0f}  {name}")
+
+
+if __name__ == '__main__':
+    main()
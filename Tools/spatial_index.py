@@ -0,0 +1,374 @@
+"""
+spatial_index.py
+
+Grid index over the utmX(m)/utmY(m) positions of every record, for delay
+lookups by location and per-cell delay heatmaps.
+
+The index keeps one row per record (position, delay, run) sorted by grid
+cell, plus the offset of each cell in that order. Cells of one grid row are
+contiguous, so the records near a point are a few slices - one per grid row
+the search circle touches - followed by an exact distance test; a polyline
+query does the same per segment with the point-to-segment distance.
+Nothing rescans the trace files after `build`.
+
+Heatmaps bin all records (or those of the selected runs) into square cells
+in one pass: count, mean and >threshold rate from np.bincount, and the p95
+from one lexsort by (cell, delay) - inverted-CDF, like the other tools.
+
+Usage examples:
+  # index every run (merged copies such as all.txt are skipped)
+  python spatial_index.py build --input-folder data/ --index outputs/spatial.npz
+
+  # delay distribution within 20 m of a point, and along a route
+  python spatial_index.py near --index outputs/spatial.npz --point 329400 3463450 --radius 20
+  python spatial_index.py along --index outputs/spatial.npz --polyline "329240,3463470 329640,3463410" --radius 20
+
+  # 10 m heatmap of n78 arterial runs, as CSV and as a figure
+  python spatial_index.py heatmap --index outputs/spatial.npz --runs "arterial_n78" --cell 10 --output heat.csv --png heat.png
+
+Dependencies:
+  numpy, pandas (matplotlib for --png)
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import profiling
+from binning import group_quantile
+
+INDEX_VERSION = 1
+DEFAULT_CELL_M = 10.0
+DEFAULT_RADIUS_M = 20.0
+DEFAULT_THRESHOLD_MS = 100
+DEFAULT_QUANTILE = 0.95
+
+COLUMNS = ['utmX(m)', 'utmY(m)', 'delay(ms)']
+HEATMAP_FIELDS = ['x', 'y', 'count', 'mean', 'p95', 'over_rate']
+
+
+def delay_summary(delay: np.ndarray, threshold: float = DEFAULT_THRESHOLD_MS) -> Dict[str, float]:
+    """count, mean, p50, p95, p99, max and the share above `threshold` of a set of delays."""
+    d = np.sort(delay[~np.isnan(delay)])
+    n = len(d)
+    if n == 0:
+        return {'count': 0, 'mean': np.nan, 'p50': np.nan, 'p95': np.nan, 'p99': np.nan, 'max': np.nan,
+                'over_rate': np.nan}
+    out = {'count': n, 'mean': float(d.mean())}
+    for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        out[name] = float(d[max(int(np.ceil(q * n)), 1) - 1])
+    out['max'] = float(d[-1])
+    out['over_rate'] = float((d > threshold).mean())
+    return out
+
+
+def segment_distance(x: np.ndarray, y: np.ndarray, a: Tuple[float, float], b: Tuple[float, float]) -> np.ndarray:
+    """Distance from each point (x, y) to the segment a-b."""
+    ax, ay = a
+    dx, dy = b[0] - ax, b[1] - ay
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return np.hypot(x - ax, y - ay)
+    t = np.clip(((x - ax) * dx + (y - ay) * dy) / length2, 0.0, 1.0)
+    return np.hypot(x - (ax + t * dx), y - (ay + t * dy))
+
+
+class SpatialIndex:
+    """Records of many runs bucketed into a square grid (cells of `cell` metres)."""
+    def __init__(self, x: np.ndarray, y: np.ndarray, delay: np.ndarray, run: np.ndarray, runs: List[str],
+                 cell: float = DEFAULT_CELL_M):
+        keep = ~(np.isnan(x) | np.isnan(y))
+        x, y, delay, run = x[keep], y[keep], delay[keep], run[keep]
+        self.cell = float(cell)
+        self.runs = list(runs)
+        if len(x):
+            self.x0 = np.floor(x.min() / cell) * cell
+            self.y0 = np.floor(y.min() / cell) * cell
+            self.nx = int((x.max() - self.x0) // cell) + 1
+            self.ny = int((y.max() - self.y0) // cell) + 1
+        else:
+            self.x0 = self.y0 = 0.0
+            self.nx = self.ny = 0
+        cells = self._cell_ids(x, y)
+        order = np.argsort(cells, kind='stable')
+        self.x, self.y, self.delay, self.run = x[order], y[order], delay[order], run[order]
+        self.offsets = np.searchsorted(cells[order], np.arange(self.nx * self.ny + 1))
+
+    def __len__(self):
+        return len(self.x)
+
+    def _cell_ids(self, x, y):
+        ix = ((x - self.x0) // self.cell).astype('int64')
+        iy = ((y - self.y0) // self.cell).astype('int64')
+        return iy * self.nx + ix
+
+    @classmethod
+    def from_files(cls, files: Sequence[str], cell: float = DEFAULT_CELL_M, quiet: bool = True) -> 'SpatialIndex':
+        from trace_cache import load_columns
+
+        parts, runs = [], []
+        for f in files:
+            try:
+                cols = load_columns(f, COLUMNS)
+            except (OSError, ValueError) as e:
+                print(f"Warning: skipping {f}: {e}", file=sys.stderr)
+                continue
+            if not all(c in cols for c in COLUMNS):
+                print(f"Warning: skipping {f}: no {', '.join(c for c in COLUMNS if c not in cols)}", file=sys.stderr)
+                continue
+            parts.append([np.asarray(cols[c], dtype='float64') for c in COLUMNS] +
+                         [np.full(len(cols[COLUMNS[0]]), len(runs), dtype='int32')])
+            runs.append(f)
+            if not quiet:
+                print(f"Loaded {f}")
+        arrays = [np.concatenate(a) for a in zip(*parts)] if parts else [np.empty(0)] * 3 + [np.empty(0, 'int32')]
+        return cls(*arrays, runs=runs, cell=cell)
+
+    @classmethod
+    def load(cls, path: str) -> 'SpatialIndex':
+        with np.load(path, allow_pickle=False) as npz:
+            meta = json.loads(str(npz['meta']))
+            if meta.get('version') != INDEX_VERSION:
+                raise ValueError(f"{path}: index version {meta.get('version')}, expected {INDEX_VERSION}")
+            idx = cls.__new__(cls)
+            idx.x, idx.y, idx.delay, idx.run, idx.offsets = (npz[k] for k in ('x', 'y', 'delay', 'run', 'offsets'))
+        idx.cell, idx.x0, idx.y0, idx.nx, idx.ny, idx.runs = (meta[k] for k in ('cell', 'x0', 'y0', 'nx', 'ny', 'runs'))
+        return idx
+
+    def save(self, path: str):
+        meta = {'version': INDEX_VERSION, 'cell': self.cell, 'x0': self.x0, 'y0': self.y0,
+                'nx': self.nx, 'ny': self.ny, 'runs': self.runs}
+        outdir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(outdir, exist_ok=True)
+        tmp = os.path.join(outdir, f'.{os.path.basename(path)}.tmp.npz')
+        np.savez_compressed(tmp, x=self.x, y=self.y, delay=self.delay, run=self.run, offsets=self.offsets,
+                            meta=np.array(json.dumps(meta)))
+        os.replace(tmp, path)
+
+    def run_mask(self, patterns: Optional[Sequence[str]]) -> Optional[np.ndarray]:
+        """Boolean mask over runs whose path contains any of `patterns` (None: all runs)."""
+        if not patterns:
+            return None
+        return np.array([any(p in r for p in patterns) for r in self.runs], dtype=bool)
+
+    def candidates(self, xmin: float, xmax: float, ymin: float, ymax: float) -> np.ndarray:
+        """Indices of the records in the grid cells overlapping a bounding box."""
+        if self.nx == 0:
+            return np.empty(0, dtype='int64')
+        ix0 = max(int((xmin - self.x0) // self.cell), 0)
+        ix1 = min(int((xmax - self.x0) // self.cell), self.nx - 1)
+        iy0 = max(int((ymin - self.y0) // self.cell), 0)
+        iy1 = min(int((ymax - self.y0) // self.cell), self.ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            return np.empty(0, dtype='int64')
+        rows = np.arange(iy0, iy1 + 1) * self.nx
+        lo, hi = self.offsets[rows + ix0], self.offsets[rows + ix1 + 1]
+        return np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)])
+
+    def _select(self, idx: np.ndarray, runs: Optional[np.ndarray]) -> np.ndarray:
+        return idx if runs is None else idx[runs[self.run[idx]]]
+
+    def near(self, x: float, y: float, radius: float = DEFAULT_RADIUS_M, runs: Optional[np.ndarray] = None) -> np.ndarray:
+        """Indices of the records within `radius` metres of (x, y)."""
+        idx = self._select(self.candidates(x - radius, x + radius, y - radius, y + radius), runs)
+        return idx[np.hypot(self.x[idx] - x, self.y[idx] - y) <= radius]
+
+    def along(self, points: Sequence[Tuple[float, float]], radius: float = DEFAULT_RADIUS_M,
+              runs: Optional[np.ndarray] = None) -> np.ndarray:
+        """Indices of the records within `radius` metres of the polyline through `points`."""
+        if len(points) == 1:
+            return self.near(points[0][0], points[0][1], radius, runs)
+        found = []
+        for a, b in zip(points[:-1], points[1:]):
+            idx = self._select(self.candidates(min(a[0], b[0]) - radius, max(a[0], b[0]) + radius,
+                                               min(a[1], b[1]) - radius, max(a[1], b[1]) + radius), runs)
+            found.append(idx[segment_distance(self.x[idx], self.y[idx], a, b) <= radius])
+        return np.unique(np.concatenate(found)) if found else np.empty(0, dtype='int64')
+
+    def heatmap(self, cell: Optional[float] = None, threshold: float = DEFAULT_THRESHOLD_MS,
+                quantile: float = DEFAULT_QUANTILE, runs: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        Per-cell delay statistics on a grid of `cell` metres (default: the index cell),
+        aligned with the index origin. Only cells with records are returned.
+        """
+        cell = float(cell or self.cell)
+        keep = ~np.isnan(self.delay)
+        if runs is not None:
+            keep &= runs[self.run]
+        x, y, d = self.x[keep], self.y[keep], self.delay[keep]
+        ix = ((x - self.x0) // cell).astype('int64')
+        iy = ((y - self.y0) // cell).astype('int64')
+        nx = int(ix.max()) + 1 if len(ix) else 0
+        ids, cells = np.unique(iy * nx + ix, return_inverse=True)
+        count = np.bincount(cells, minlength=len(ids))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.bincount(cells, weights=d, minlength=len(ids)) / count
+            over_rate = np.bincount(cells, weights=d > threshold, minlength=len(ids)) / count
+        return {'x': self.x0 + (ids % nx + 0.5) * cell if nx else np.empty(0),
+                'y': self.y0 + (ids // nx + 0.5) * cell if nx else np.empty(0),
+                'count': count, 'mean': mean,
+                'p95': group_quantile(cells, d, len(ids), quantile), 'over_rate': over_rate}
+
+
+def parse_polyline(text: str) -> List[Tuple[float, float]]:
+    """'x1,y1 x2,y2 ...' (or ';'-separated) -> [(x1, y1), (x2, y2), ...]"""
+    points = []
+    for part in text.replace(';', ' ').split():
+        try:
+            x, y = (float(v) for v in part.split(','))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Bad polyline point {part!r}, expected x,y")
+        points.append((x, y))
+    if not points:
+        raise argparse.ArgumentTypeError("Empty polyline")
+    return points
+
+
+def write_heatmap_csv(outfile: str, heat: Dict[str, np.ndarray], quantile: float):
+    header = [f'p{quantile * 100:g}' if f == 'p95' else f for f in HEATMAP_FIELDS]
+    os.makedirs(os.path.dirname(os.path.abspath(outfile)), exist_ok=True)
+    with open(outfile, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(header)
+        for row in zip(*(heat[f] for f in HEATMAP_FIELDS)):
+            writer.writerow([f'{v:.1f}' for v in row[:2]] + [int(row[2])] + [f'{v:.6g}' for v in row[3:]])
+
+
+def draw_heatmap(outfile: str, heat: Dict[str, np.ndarray], cell: float, field: str, dpi: int = 300):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    sc = ax.scatter(heat['x'], heat['y'], c=heat[field], marker='s', s=4, cmap='viridis', linewidths=0)
+    ax.set_aspect('equal')
+    ax.set_xlabel('utmX (m)')
+    ax.set_ylabel('utmY (m)')
+    fig.colorbar(sc, ax=ax, label=field if field != 'over_rate' else 'share of delays > threshold')
+    ax.set_title(f'{field} per {cell:g} m cell')
+    fig.tight_layout()
+    os.makedirs(os.path.dirname(os.path.abspath(outfile)), exist_ok=True)
+    fig.savefig(outfile, dpi=dpi)
+    plt.close(fig)
+
+
+def collect_files(args) -> List[str]:
+    if args.inputs:
+        return args.inputs
+    if args.query is not None:
+        from dataset_catalog import query_files
+        return query_files(args.catalog, args.query)
+    from dataset_catalog import run_files
+    return run_files(args.input_folder, args.pattern, args.include_derived)
+
+
+def print_summary(summary: Dict[str, float], n_runs: int):
+    print(f"{summary['count']} records from {n_runs} runs")
+    if summary['count']:
+        print(f"mean {summary['mean']:.2f} ms, p50 {summary['p50']:g}, p95 {summary['p95']:g}, "
+              f"p99 {summary['p99']:g}, max {summary['max']:g} ms, >threshold {summary['over_rate']:.4f}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Grid index over UTM positions: delay near a point or route, and heatmaps.")
+    sub = p.add_subparsers(dest='command', required=True)
+    b = sub.add_parser('build', help='Index the positions and delays of a set of runs.')
+    group = b.add_mutually_exclusive_group(required=True)
+    group.add_argument('--inputs', nargs='+', help='Trace files (one run each)')
+    group.add_argument('--input-folder', help='Folder containing trace files (use with --pattern)')
+    group.add_argument('--query', help='Select run files from the dataset catalog, e.g. "n78, arterial"')
+    b.add_argument('--catalog', default='catalog.csv', help='Catalog built by dataset_catalog.py (used with --query)')
+    b.add_argument('--pattern', default='**/*.txt', help="Glob pattern, recursive (default '**/*.txt')")
+    b.add_argument('--include-derived', action='store_true', help='With --input-folder, keep merged copies such as all.txt')
+    b.add_argument('--index', default='spatial.npz', help='Index file to write (default spatial.npz)')
+    b.add_argument('--cell', type=float, default=DEFAULT_CELL_M, help='Grid cell size in metres (default 10)')
+    b.add_argument('--quiet', action='store_true', help='Suppress per-file messages')
+    for name, help_text in (('near', 'Delay distribution within a radius of a point.'),
+                            ('along', 'Delay distribution within a radius of a polyline.'),
+                            ('heatmap', 'Per-cell mean, p95 and >threshold rate.')):
+        s = sub.add_parser(name, help=help_text)
+        s.add_argument('--index', default='spatial.npz', help='Index built with `build` (default spatial.npz)')
+        s.add_argument('--runs', nargs='+', help='Only runs whose path contains one of these strings')
+        s.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD_MS, help='Delay threshold in ms (default 100)')
+        if name == 'near':
+            s.add_argument('--point', nargs=2, type=float, required=True, metavar=('X', 'Y'), help='utmX utmY in metres')
+        elif name == 'along':
+            s.add_argument('--polyline', type=parse_polyline, required=True, help='"x1,y1 x2,y2 ..." in UTM metres')
+        if name in ('near', 'along'):
+            s.add_argument('--radius', type=float, default=DEFAULT_RADIUS_M, help='Search radius in metres (default 20)')
+        else:
+            s.add_argument('--cell', type=float, help='Heatmap cell size in metres (default: the index cell)')
+            s.add_argument('--quantile', type=float, default=DEFAULT_QUANTILE, help='Per-cell quantile (default 0.95)')
+            s.add_argument('--output', help='Write the cells as CSV (default: print them)')
+            s.add_argument('--png', help='Also draw the heatmap to this image')
+            s.add_argument('--field', default='p95', choices=['mean', 'p95', 'over_rate', 'count'], help='Field drawn by --png')
+    for s in sub.choices.values():
+        profiling.add_arguments(s)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, f'spatial_index {args.command}')
+    if args.command == 'build':
+        with profiling.stage('discover'):
+            files = collect_files(args)
+        if not files:
+            print("No input files found. Exiting.", file=sys.stderr)
+            sys.exit(2)
+        t0 = time.perf_counter()
+        with profiling.stage('build') as st:
+            idx = SpatialIndex.from_files(files, cell=args.cell, quiet=args.quiet)
+            st.add(rows=len(idx))
+        with profiling.stage('save'):
+            idx.save(args.index)
+        print(f"Index {args.index}: {len(idx.runs)} runs, {len(idx)} records, {idx.nx}x{idx.ny} cells "
+              f"of {idx.cell:g} m in {time.perf_counter() - t0:.2f} s")
+        return
+
+    try:
+        with profiling.stage('load'):
+            idx = SpatialIndex.load(args.index)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+    runs = idx.run_mask(args.runs)
+    if runs is not None and not runs.any():
+        print(f"No runs in the index match {args.runs}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.command in ('near', 'along'):
+        t0 = time.perf_counter()
+        with profiling.stage('query') as st:
+            found = idx.near(*args.point, args.radius, runs) if args.command == 'near' else idx.along(args.polyline, args.radius, runs)
+            summary = delay_summary(idx.delay[found], args.threshold)
+            st.add(rows=len(found))
+        print_summary(summary, len(np.unique(idx.run[found])))
+        print(f"({(time.perf_counter() - t0) * 1000:.1f} ms)")
+        return
+
+    with profiling.stage('heatmap', rows=len(idx)):
+        heat = idx.heatmap(args.cell, args.threshold, args.quantile, runs)
+    cell = args.cell or idx.cell
+    if args.output:
+        with profiling.stage('write'):
+            write_heatmap_csv(args.output, heat, args.quantile)
+        print(f"Wrote {len(heat['count'])} cells to {args.output}")
+    elif not args.png:
+        writer = csv.writer(sys.stdout, delimiter='\t')
+        writer.writerow(HEATMAP_FIELDS)
+        for row in zip(*(heat[f] for f in HEATMAP_FIELDS)):
+            writer.writerow([f'{v:.6g}' for v in row])
+    if args.png:
+        with profiling.stage('draw'):
+            draw_heatmap(args.png, heat, cell, args.field)
+        print(f"Wrote {args.png}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+synth_traces.py
+
+Synthetic trace generator for benchmarks: writes a copy of a data/ tree
+(same relative paths, header lines and layouts - tab10, ws10, ws12, ws13 -
+with the same number formatting) whose files hold --scale times as many rows
+as the originals.
+
+Every synthetic file follows its template file:
+  - the trajectory (utm position, heading, velocity) and the cellid / RSRP /
+    SINR sequences are replayed back and forth along the template, with
+    +-1 dB noise on RSRP and SINR;
+  - pub_time advances by the template's median period with +-10 % jitter;
+  - delay is drawn from the template's empirical quantiles (1001 points, so
+    the tail up to p99.9 is kept) through an AR(1) Gaussian copula: delays are
+    correlated in time (rho 0.95, outages come in bursts) and with weak RSRP;
+  - sub_time = pub_time + delay, and for ws12/ws13 currentX/currentY is the
+    position advanced by velocity * delay along the heading.
+So at --scale 1 the delay, RSRP and SINR distributions of every file match its
+template; at 10x / 100x the same distributions fill longer runs.
+
+Usage examples:
+  # 10x copy of the dataset (~5.9M rows) for benchmark.py
+  python synth_traces.py --like data/ --output /tmp/cicv5g_x10 --scale 10 --jobs 0
+
+  # only the W2S runs, 1x
+  python synth_traces.py --like data/ --pattern "W2S/**/*.txt" --output /tmp/w2s --scale 1
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+# delay latent: AR(1) coefficient per row, and weight of the (negated) RSRP score
+DELAY_RHO = 0.95
+DELAY_RSRP_WEIGHT = 0.3
+
+_QUANTILES = np.linspace(0.0, 1.0, 1001)
+
+# number formats of the real files, per layout (float columns; integers are written as such)
+FLOAT_FORMATS = {'ws10': '%.6f', 'ws12': '%.15f', 'ws13': '%.15f', 'tab10': None, 'tab13': None}
+
+
+def ar1(n: int, rho: float, rng: np.random.Generator, block: int = 256) -> np.ndarray:
+    """Stationary standard-normal AR(1) series of length n, computed block-wise without a per-row loop."""
+    if n == 0:
+        return np.empty(0)
+    nb = -(-n // block)
+    e = rng.standard_normal(nb * block).reshape(nb, block) * np.sqrt(1 - rho * rho)
+    k = np.arange(block)
+    # each block from a zero state, then the state carried in from the previous block
+    local = rho ** k * np.cumsum(e * rho ** -k, axis=1)
+    carry = np.empty(nb)
+    state = rng.standard_normal()
+    for b in range(nb):
+        carry[b] = state
+        state = local[b, -1] + rho ** block * state
+    return (local + rho ** (k + 1) * carry[:, None]).ravel()[:n]
+
+
+def normal_cdf(z: np.ndarray) -> np.ndarray:
+    # logistic approximation (|error| < 0.01), enough to map the latent to (0, 1)
+    return 1.0 / (1.0 + np.exp(-1.702 * z))
+
+
+def bounce(n: int, m: int) -> np.ndarray:
+    """Indices 0..m-1..0..m-1... of length n (a back-and-forth replay of m rows)."""
+    if m == 1:
+        return np.zeros(n, dtype='int64')
+    i = np.arange(n) % (2 * m - 2)
+    return np.where(i < m, i, 2 * m - 2 - i)
+
+
+def synthesize(template: pd.DataFrame, rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """A synthetic run of `rows` rows with the columns and distributions of `template`."""
+    n = len(template)
+    idx = bounce(rows, n)
+    out = {}
+    t0 = template['pub_time(ms)'].to_numpy(dtype='float64')
+    diffs = np.diff(t0[np.isfinite(t0)])
+    period = float(np.median(diffs[diffs > 0])) if (diffs > 0).any() else 50.0
+    start = t0[np.isfinite(t0)][0] if np.isfinite(t0).any() else 1.72e12
+    pub = np.round(start + np.cumsum(period * rng.uniform(0.9, 1.1, rows))).astype('int64')
+
+    def noisy(col, lo, hi):
+        v = template[col].to_numpy(dtype='float64')[idx] + rng.integers(-1, 2, rows)
+        return np.clip(v, lo, hi)
+
+    rsrp = noisy('rsrp(db)', -140, 0) if 'rsrp(db)' in template else np.full(rows, -80.0)
+    z_rsrp = -(rsrp - np.nanmean(rsrp)) / (np.nanstd(rsrp) or 1.0)
+    z = DELAY_RSRP_WEIGHT * np.nan_to_num(z_rsrp) + np.sqrt(1 - DELAY_RSRP_WEIGHT ** 2) * ar1(rows, DELAY_RHO, rng)
+    # the copula score is not exactly standard normal once mixed; its own ranks give uniform margins
+    u = (np.argsort(np.argsort(z)) + 0.5) / rows if rows > 1 else normal_cdf(z)
+    d = template['delay(ms)'].to_numpy(dtype='float64')
+    d = d[np.isfinite(d)]
+    delay = np.round(np.interp(u, _QUANTILES, np.quantile(d, _QUANTILES))).astype('int64') if len(d) else np.full(rows, 20)
+
+    out['pub_time(ms)'] = pub
+    out['sub_time(ms)'] = pub + delay
+    out['delay(ms)'] = delay
+    for col in ('utmX(m)', 'utmY(m)', 'heading(rad)', 'velocity(m/s)'):
+        out[col] = template[col].to_numpy(dtype='float64')[idx]
+    out['cellid(db)'] = template['cellid(db)'].to_numpy()[idx]
+    out['sinr(db)'] = noisy('sinr(db)', -20, 60).astype('int64')
+    out['rsrp(db)'] = rsrp.astype('int64')
+    if 'currentX(m)' in template:
+        step = out['velocity(m/s)'] * delay / 1000.0
+        out['currentX(m)'] = out['utmX(m)'] + step * np.cos(out['heading(rad)'])
+        out['currentY'] = out['utmY(m)'] + step * np.sin(out['heading(rad)'])
+    if 'currentHeading(rad)' in template:
+        out['currentHeading(rad)'] = out['heading(rad)'] + rng.normal(0, 1e-4, rows)
+    return pd.DataFrame(out, columns=list(template.columns))
+
+
+def write_like(df: pd.DataFrame, template_path: str, out_path: str, layout: str):
+    """Write df with the template's header line, separator and number format."""
+    with open(template_path, 'r', encoding='utf-8', errors='ignore') as fh:
+        header = fh.readline()
+    sep = '\t' if layout.startswith('tab') else ' '
+    if layout == 'ws10':
+        # the ws10 loggers end every row with a separator
+        df = df.assign(_end='')
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    with open(out_path, 'w', encoding='utf-8', newline='') as fh:
+        fh.write(header if header.endswith('\n') else header + '\n')
+        df.to_csv(fh, sep=sep, header=False, index=False, float_format=FLOAT_FORMATS[layout], lineterminator='\n')
+
+
+def generate_file(task) -> Optional[str]:
+    """Worker: (template path, relpath, output root, scale, seed) -> error message or None."""
+    from trace_loader import detect_layout, read_trace
+
+    path, relpath, output, scale, seed = task
+    try:
+        layout = detect_layout(path)
+        template = read_trace(path, layout=layout)
+        if len(template) == 0:
+            raise ValueError('empty file')
+        rng = np.random.default_rng(seed)
+        with profiling.stage('synthesize') as st:
+            df = synthesize(template, int(round(len(template) * scale)), rng)
+            st.add(rows=len(df))
+        with profiling.stage('write', rows=len(df)):
+            write_like(df, path, os.path.join(output, relpath), layout)
+    except Exception as e:
+        return f"{path}: {e}"
+    return None
+
+
+def generate(like: str, output: str, scale: float = 1.0, pattern: str = '**/*.txt', seed: int = 0,
+             jobs: int = 1, quiet: bool = True) -> List[str]:
+    """Generate the synthetic tree; returns the relative paths written."""
+    files = sorted(glob.glob(os.path.join(like, pattern), recursive=True))
+    tasks = [(f, os.path.relpath(f, like), output, scale, seed * 100003 + i) for i, f in enumerate(files)]
+    if jobs > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            errors = list(pool.map(generate_file, tasks))
+    else:
+        errors = map(generate_file, tasks)
+    written = []
+    for task, error in zip(tasks, errors):
+        if error is not None:
+            print(f"Warning: skipping {error}", file=sys.stderr)
+            continue
+        written.append(task[1])
+        if not quiet:
+            print(f"Wrote {os.path.join(output, task[1])}")
+    return written
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Generate a scaled synthetic copy of the dataset tree.")
+    p.add_argument('--like', required=True, help='Dataset root used as the template (the data/ folder)')
+    p.add_argument('--output', required=True, help='Root of the synthetic tree')
+    p.add_argument('--scale', type=float, default=1.0, help='Rows per file relative to the template (default 1)')
+    p.add_argument('--pattern', default='**/*.txt', help="Template files, relative to --like (default '**/*.txt')")
+    p.add_argument('--seed', type=int, default=0, help='Random seed (default 0)')
+    p.add_argument('--jobs', type=int, default=1, help='Worker processes; 0 = one per CPU (default 1, serial)')
+    p.add_argument('--quiet', action='store_true', help='Suppress per-file messages')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, 'synth_traces')
+    if os.path.abspath(args.output) == os.path.abspath(args.like):
+        print("--output must differ from --like", file=sys.stderr)
+        sys.exit(2)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    t0 = time.perf_counter()
+    with profiling.stage('generate'):
+        written = generate(args.like, args.output, args.scale, args.pattern, args.seed, jobs, args.quiet)
+    if not written:
+        print("No files generated.", file=sys.stderr)
+        sys.exit(1)
+    print(f"Generated {len(written)} files under {args.output} (scale {args.scale:g}) in {time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+trace_cache.py
+
+Transparent on-disk cache of parsed trace files.
+
+Every parsed file is stored as one .npy array per column (cellid as int32
+category codes plus its category list), so a warm load is a handful of
+memory-mapped reads instead of a text parse. An entry is rebuilt only when its
+source file changes: the size and mtime are compared first, and when only the
+mtime differs the content hash decides (so a `touch` or a fresh checkout does
+not force a rebuild).
+
+Cache location: $CICV5G_CACHE_DIR, or ~/.cache/cicv5g by default.
+Set CICV5G_NO_CACHE=1 to bypass the cache entirely.
+
+Usage examples:
+  # warm the cache for the whole dataset and report hits/rebuilds
+  python trace_cache.py --input-folder data/ --pattern "**/*.txt"
+
+  # drop every cached entry
+  python trace_cache.py --clear
+
+  # from another tool (same signature as trace_loader.read_trace)
+  from trace_cache import load_trace, load_columns
+  df = load_trace("data/W2S/n8/V30/w2s_n8_v30_run01.txt", columns=["delay(ms)", "rsrp(db)"])
+  cols = load_columns("data/W2S/n8/V30/w2s_n8_v30_run01.txt")   # dict of read-only memmaps
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from trace_loader import detect_layout, find_trace_files, read_trace
+
+CACHE_VERSION = 1
+_META = 'meta.json'
+# a stale entry is moved aside and the new one put in place at most this many times
+_REPLACE_ATTEMPTS = 5
+
+
+def default_cache_dir() -> str:
+    return os.environ.get('CICV5G_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'cicv5g')
+
+
+def cache_enabled() -> bool:
+    return os.environ.get('CICV5G_NO_CACHE', '') in ('', '0')
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _entry_dir(path: str, cache_dir: str, layout: Optional[str] = None, encoding: str = 'utf-8') -> str:
+    key = os.path.abspath(path)
+    if layout is not None or encoding != 'utf-8':
+        # a forced layout or another encoding parses differently: keep it apart from the default entry
+        key += f'\0{layout or ""}\0{encoding}'
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def _read_meta(entry: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(entry, _META), 'r', encoding='utf-8') as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == CACHE_VERSION else None
+
+
+def _is_fresh(meta: dict, path: str, entry: str) -> bool:
+    st = os.stat(path)
+    if meta['size'] != st.st_size:
+        return False
+    if meta['mtime_ns'] == st.st_mtime_ns:
+        return True
+    if meta['sha1'] != file_digest(path):
+        return False
+    # same content, new mtime: refresh the stamp so the hash is not recomputed next time
+    meta['mtime_ns'] = st.st_mtime_ns
+    _write_meta(entry, meta)
+    return True
+
+
+def _write_meta(entry: str, meta: dict):
+    tmp = os.path.join(entry, _META + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(meta, fh, indent=1)
+    os.replace(tmp, os.path.join(entry, _META))
+
+
+def _discard(entry: str):
+    """Move `entry` aside atomically and delete it; readers never see a half-deleted entry."""
+    trash = tempfile.mkdtemp(prefix='.old-', dir=os.path.dirname(entry))
+    try:
+        os.replace(entry, os.path.join(trash, 'entry'))
+    except FileNotFoundError:
+        pass
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+def build_entry(path: str, cache_dir: Optional[str] = None, encoding: str = 'utf-8',
+                layout: Optional[str] = None) -> str:
+    """Parse `path` and (re)write its cache entry atomically. Returns the entry directory."""
+    cache_dir = cache_dir or default_cache_dir()
+    entry = _entry_dir(path, cache_dir, layout, encoding)
+    st = os.stat(path)
+    digest = file_digest(path)
+    layout = layout or detect_layout(path, encoding)
+    df = read_trace(path, layout=layout, encoding=encoding)
+
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.build-', dir=os.path.dirname(entry))
+    try:
+        columns = []
+        for i, col in enumerate(df.columns):
+            series = df[col]
+            spec = {'name': col, 'file': f'{i}.npy'}
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                spec['categories'] = [str(c) for c in series.cat.categories]
+                values = series.cat.codes.to_numpy().astype('int32')
+            else:
+                values = series.to_numpy()
+            np.save(os.path.join(tmp, spec['file']), values, allow_pickle=False)
+            spec['dtype'] = str(values.dtype)
+            columns.append(spec)
+        meta = {'version': CACHE_VERSION, 'source': os.path.abspath(path), 'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns, 'sha1': digest, 'layout': layout, 'rows': len(df),
+                'columns': columns}
+        _write_meta(tmp, meta)
+        for attempt in range(_REPLACE_ATTEMPTS):
+            try:
+                os.replace(tmp, entry)
+                break
+            except OSError:
+                # entry exists: either stale, or a concurrent build (--jobs) of the same file
+                # just put its own in place - then use that one
+                other = _read_meta(entry)
+                if other is not None and other['sha1'] == digest and other['layout'] == layout:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    break
+                if attempt == _REPLACE_ATTEMPTS - 1:
+                    raise
+                _discard(entry)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return entry
+
+
+def ensure_entry(path: str, cache_dir: Optional[str] = None, encoding: str = 'utf-8',
+                 layout: Optional[str] = None) -> Tuple[str, dict, bool]:
+    """Return (entry_dir, meta, rebuilt) for `path`, rebuilding a stale or missing entry."""
+    cache_dir = cache_dir or default_cache_dir()
+    entry = _entry_dir(path, cache_dir, layout, encoding)
+    meta = _read_meta(entry)
+    if meta is not None and _is_fresh(meta, path, entry):
+        return entry, meta, False
+    entry = build_entry(path, cache_dir, encoding, layout)
+    return entry, _read_meta(entry), True
+
+
+def load_columns(path: str, columns: Optional[Sequence[str]] = None, cache_dir: Optional[str] = None,
+                 encoding: str = 'utf-8', mmap_mode: str = 'r', layout: Optional[str] = None) -> Dict[str, object]:
+    """
+    Return {column: array} backed by memory maps of the cache entry.
+
+    Numeric columns are np.memmap views (zero-copy; read-only with the default
+    mmap_mode='r', private copy-on-write with 'c'); cellid is returned as a
+    pandas Categorical. Requested columns that the file's layout lacks are omitted.
+    A forced `layout` or a non-default `encoding` gets its own cache entry.
+    """
+    with profiling.file_stage('cache', path) as st:
+        entry, meta, _ = ensure_entry(path, cache_dir, encoding, layout)
+        out = {}
+        for spec in meta['columns']:
+            if columns is not None and spec['name'] not in columns:
+                continue
+            values = np.load(os.path.join(entry, spec['file']), mmap_mode=mmap_mode, allow_pickle=False)
+            if 'categories' in spec:
+                values = pd.Categorical.from_codes(values, categories=spec['categories'])
+            out[spec['name']] = values
+        st.add(rows=meta['rows'])
+    return out
+
+
+def load_trace(path: str, columns: Optional[Sequence[str]] = None, layout: Optional[str] = None,
+               encoding: str = 'utf-8', cache_dir: Optional[str] = None, compact: bool = False) -> pd.DataFrame:
+    """Drop-in replacement for trace_loader.read_trace that serves parsed columns from the cache."""
+    if not cache_enabled():
+        return read_trace(path, columns=columns, layout=layout, encoding=encoding, compact=compact)
+    # copy-on-write maps: callers may modify the frame without touching the cache
+    arrays = load_columns(path, columns, cache_dir, encoding, mmap_mode='c', layout=layout)
+    df = pd.DataFrame(arrays, copy=False)
+    if columns is not None:
+        for col in columns:
+            if col not in df.columns:
+                df[col] = np.nan
+        df = df[list(columns)]
+    if compact:
+        from trace_schema import to_compact
+        df = to_compact(df)
+    return df
+
+
+def clear_cache(cache_dir: Optional[str] = None):
+    cache_dir = cache_dir or default_cache_dir()
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Build or inspect the parsed-trace cache.")
+    p.add_argument('--input-folder', help='Folder containing trace files to cache')
+    p.add_argument('--pattern', default='**/*.txt', help="Glob pattern, recursive (default '**/*.txt')")
+    p.add_argument('--cache-dir', help='Cache directory (default $CICV5G_CACHE_DIR or ~/.cache/cicv5g)')
+    p.add_argument('--clear', action='store_true', help='Remove all cache entries and exit')
+    p.add_argument('--quiet', action='store_true', help='Suppress per-file messages')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, 'trace_cache')
+    cache_dir = args.cache_dir or default_cache_dir()
+    if args.clear:
+        clear_cache(cache_dir)
+        print(f"Cleared {cache_dir}")
+        return
+    if not args.input_folder:
+        print("--input-folder is required unless --clear is given", file=sys.stderr)
+        sys.exit(1)
+    with profiling.stage('discover'):
+        files = find_trace_files(args.input_folder, args.pattern)
+    if not files:
+        print(f"No files found in {args.input_folder} matching {args.pattern}", file=sys.stderr)
+        sys.exit(1)
+
+    t0 = time.perf_counter()
+    rebuilt = rows = 0
+    with profiling.stage('warm') as st:
+        for f in files:
+            try:
+                _, meta, was_rebuilt = ensure_entry(f, cache_dir)
+            except (OSError, ValueError) as e:
+                print(f"Warning: skipping {f}: {e}", file=sys.stderr)
+                continue
+            rebuilt += was_rebuilt
+            rows += meta['rows']
+            if not args.quiet:
+                print(f"{'rebuilt' if was_rebuilt else 'hit':7s} {meta['rows']:8d} rows  {f}")
+        st.add(rows=rows)
+    elapsed = time.perf_counter() - t0
+    print(f"\nFiles: {len(files)}, rebuilt: {rebuilt}, rows: {rows}, elapsed: {elapsed:.3f} s, cache: {cache_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+"""
+trace_loader.py
+
+Shared fast loader for the CICV5G V2N2V trace files.
+
+All tools in this folder read the same column-oriented text format. This module
+parses it once, with pandas' C parser and explicit dtypes (switching to a
+single-blank separator whenever a file allows it, which the C tokenizer handles
+much faster than a whitespace regex), and knows about the header variants
+found under data/:
+
+  tab10   tab-separated, 10 columns (merged copies such as westn8all.txt)
+  ws10    whitespace-separated, 10 columns (most runs)
+  ws12    whitespace-separated, 10-column header but 12 fields per row
+          (early W2S runs that log currentX(m)/currentY without a header)
+  ws13    whitespace-separated, 13 columns
+          (... rsrp(db) currentX(m) currentY currentHeading(rad))
+  tab13   tab-separated, 13 columns (written by merge_txt_to_xlsx --stream and
+          trace_schema.write_trace; empty fields are missing values)
+
+Rows where the logger wrote an empty cellid (two consecutive blanks, so only 9
+fields survive whitespace splitting) are repaired: sinr/rsrp are shifted back
+into place and cellid is left missing.
+
+Parsing text is bound by the C tokenizer: on one core, reading all 140 .txt
+files under data/ (585k rows, 68 MB) takes ~1.4 s, and the 122 run files
+(286k rows) ~1.1 s, about what a plain pd.read_csv needs. Tools that read the
+same files again go through trace_cache.py, whose memory-mapped columns load
+all 140 files in ~0.35 s.
+
+Usage examples:
+  # summary of every trace below data/
+  python trace_loader.py --input-folder data/ --pattern "**/*.txt"
+
+  # from another tool
+  from trace_loader import read_trace, read_traces
+  df = read_trace("data/W2S/n8/V30/w2s_n8_v30_run04.txt", columns=["delay(ms)", "rsrp(db)"])
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+BASE_COLUMNS = ['pub_time(ms)', 'sub_time(ms)', 'delay(ms)', 'utmX(m)', 'utmY(m)', 'heading(rad)',
+                'velocity(m/s)', 'cellid(db)', 'sinr(db)', 'rsrp(db)']
+POSE_COLUMNS = ['currentX(m)', 'currentY', 'currentHeading(rad)']
+
+# layout name -> (separator, column names)
+LAYOUTS = {
+    'tab10': ('\t', BASE_COLUMNS),
+    'ws10': (r'\s+', BASE_COLUMNS),
+    'ws12': (r'\s+', BASE_COLUMNS + POSE_COLUMNS[:2]),
+    'ws13': (r'\s+', BASE_COLUMNS + POSE_COLUMNS),
+    'tab13': ('\t', BASE_COLUMNS + POSE_COLUMNS),
+}
+
+# dtypes used while parsing; integer columns fall back to float64 when a file
+# holds missing or non-integral values (e.g. '1.7212E+12' in merged copies)
+DTYPES = {
+    'pub_time(ms)': 'int64',
+    'sub_time(ms)': 'int64',
+    'delay(ms)': 'int64',
+    'utmX(m)': 'float64',
+    'utmY(m)': 'float64',
+    'heading(rad)': 'float64',
+    'velocity(m/s)': 'float64',
+    'cellid(db)': 'category',
+    'sinr(db)': 'int64',
+    'rsrp(db)': 'int64',
+    'currentX(m)': 'float64',
+    'currentY': 'float64',
+    'currentHeading(rad)': 'float64',
+}
+
+# columns needed to repair rows with an empty cellid
+_CELL_COLUMNS = ['cellid(db)', 'sinr(db)', 'rsrp(db)']
+
+# upper bound on fields per row for the robust positional read
+_MAX_FIELDS = 64
+
+# bytes inspected when choosing the separator of a trace file
+_SAMPLE_BYTES = 1 << 16
+
+
+class TraceFormatError(ValueError):
+    """Raised when a file does not match any known trace layout."""
+
+
+def find_trace_files(folder: str, pattern: str = '*.txt', recursive: bool = True) -> List[str]:
+    pattern_path = os.path.join(folder, pattern)
+    return sorted(glob.glob(pattern_path, recursive=recursive))
+
+
+def detect_layout(path: str, encoding: str = 'utf-8') -> str:
+    """Return the layout key (see LAYOUTS) of a trace file from its first two lines."""
+    with open(path, 'r', encoding=encoding, errors='ignore') as fh:
+        header = fh.readline()
+        first_row = fh.readline()
+    names = header.split()
+    if not names or names[0] != BASE_COLUMNS[0]:
+        raise TraceFormatError(f"{path}: unrecognised header {header.strip()[:80]!r}")
+    if len(names) == len(BASE_COLUMNS):
+        if '\t' in header:
+            return 'tab10'
+        if len(first_row.split()) == len(LAYOUTS['ws12'][1]):
+            return 'ws12'
+        return 'ws10'
+    if names == LAYOUTS['ws13'][1]:
+        return 'tab13' if '\t' in header else 'ws13'
+    raise TraceFormatError(f"{path}: unexpected {len(names)}-column header")
+
+
+def layout_columns(columns: Sequence[str]) -> List[str]:
+    """
+    Canonical columns of the smallest layout holding `columns`, for writers: a
+    frame with only some pose columns (ws12) is padded to all of them, since a
+    12-column header is not a layout detect_layout can tell apart.
+    """
+    if any(c in POSE_COLUMNS for c in columns):
+        return [c for c in BASE_COLUMNS if c in columns] + POSE_COLUMNS
+    return [c for c in BASE_COLUMNS if c in columns]
+
+
+def _single_space_separated(data: bytes) -> bool:
+    """True when fields are separated by exactly one blank, so ' ' splits like str.split()."""
+    return not (b'\t' in data or b'  ' in data or data.startswith(b' ') or b'\n ' in data)
+
+
+def _parse_table(data: bytes, sep: str, names: List[str], usecols: List[str]) -> pd.DataFrame:
+    dtype = {c: DTYPES[c] for c in usecols}
+    kwargs = dict(sep=sep, header=None, skiprows=1, names=names, usecols=usecols, engine='c')
+    try:
+        return pd.read_csv(io.BytesIO(data), dtype=dtype, **kwargs)
+    except pd.errors.ParserError:
+        raise
+    except (ValueError, TypeError):
+        # missing values or float-formatted integers: parse integer columns as float64
+        dtype = {c: ('float64' if t == 'int64' else t) for c, t in dtype.items()}
+        return pd.read_csv(io.BytesIO(data), dtype=dtype, **kwargs)
+
+
+def _read_table(data: bytes, sep: str, names: List[str], usecols: List[str]) -> pd.DataFrame:
+    if sep == r'\s+' and _single_space_separated(data[:_SAMPLE_BYTES]):
+        # the C tokenizer is much faster on a single-character separator; an
+        # extra name absorbs the trailing blank many loggers leave on each row.
+        # A doubled blank further down is then read as an empty field, which is
+        # what the logger meant (e.g. an empty cellid).
+        rows = data[:_SAMPLE_BYTES].split(b'\n', 2)
+        trailing = len(rows) > 1 and rows[1].rstrip(b'\r').endswith(b' ')
+        try:
+            return _parse_table(data, ' ', list(names) + ['_trailing'] if trailing else names, usecols)
+        except pd.errors.ParserError:
+            # rows disagree about the trailing blank: use the whitespace separator
+            pass
+    return _parse_table(data, sep, names, usecols)
+
+
+def _read_bytes(path: str, encoding: str) -> bytes:
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    if encoding.lower().replace('-', '') not in ('utf8', 'ascii'):
+        data = data.decode(encoding, errors='ignore').encode('utf-8')
+    return data
+
+
+def _repair_missing_cellid(df: pd.DataFrame) -> pd.DataFrame:
+    # a 9-field row shifts sinr into cellid and rsrp into sinr, leaving rsrp empty
+    shifted = df['rsrp(db)'].isna() & df['sinr(db)'].notna()
+    if shifted.any():
+        df.loc[shifted, 'rsrp(db)'] = df.loc[shifted, 'sinr(db)']
+        df.loc[shifted, 'sinr(db)'] = pd.to_numeric(df.loc[shifted, 'cellid(db)'].astype(str), errors='coerce')
+        df.loc[shifted, 'cellid(db)'] = np.nan
+        if isinstance(df['cellid(db)'].dtype, pd.CategoricalDtype):
+            df['cellid(db)'] = df['cellid(db)'].cat.remove_unused_categories()
+    return df
+
+
+def _restore_integer_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    for col in df.columns:
+        if DTYPES.get(col) != 'int64' or df[col].dtype.kind != 'f':
+            continue
+        values = df[col].to_numpy()
+        if np.isfinite(values).all() and (values == np.round(values)).all():
+            df[col] = values.astype('int64')
+    return df
+
+
+def _plan_columns(layout: str, columns: Optional[Sequence[str]]):
+    """Return (wanted, usecols, repair) for reading `columns` from a file of this layout."""
+    names = LAYOUTS[layout][1]
+    wanted = list(columns) if columns is not None else list(names)
+    usecols = [c for c in names if c in wanted]
+    repair = len(names) < len(LAYOUTS['ws13'][1]) and any(c in usecols for c in _CELL_COLUMNS)
+    if repair:
+        usecols = [c for c in names if c in wanted or c in _CELL_COLUMNS]
+    return wanted, usecols, repair
+
+
+def _finish(df: pd.DataFrame, wanted: List[str], repair: bool) -> pd.DataFrame:
+    if repair:
+        df = _repair_missing_cellid(df)
+    df = _restore_integer_dtypes(df)
+    for col in wanted:
+        if col not in df.columns:
+            df[col] = np.nan
+    if list(df.columns) == wanted:
+        return df
+    return df[wanted]
+
+
+def read_trace(path: str, columns: Optional[Sequence[str]] = None, layout: Optional[str] = None,
+               encoding: str = 'utf-8', compact: bool = False) -> pd.DataFrame:
+    """
+    Read one trace file into a DataFrame with canonical column names.
+
+    columns: subset of columns to parse (default: all columns of the layout).
+             Columns absent from this layout are returned filled with NaN.
+    compact: return the compact schema of trace_schema.py (Int64 timestamps,
+             UInt16 delay, float32 pose offsets, Int8 RSRP/SINR).
+    """
+    with profiling.file_stage('read', path) as st:
+        layout = layout or detect_layout(path, encoding)
+        wanted, usecols, repair = _plan_columns(layout, columns)
+        df = _read_table(_read_bytes(path, encoding), LAYOUTS[layout][0], LAYOUTS[layout][1], usecols)
+        df = _finish(df, wanted, repair)
+        st.add(rows=len(df))
+    if compact:
+        from trace_schema import to_compact
+        df = to_compact(df)
+    return df
+
+
+def iter_trace_chunks(path: str, chunksize: int = 100_000, columns: Optional[Sequence[str]] = None,
+                      layout: Optional[str] = None, encoding: str = 'utf-8') -> Iterator[pd.DataFrame]:
+    """
+    Yield a trace file as DataFrames of at most `chunksize` rows, with the same
+    columns, dtypes and repairs as read_trace(), without loading the whole file.
+    """
+    layout = layout or detect_layout(path, encoding)
+    wanted, usecols, repair = _plan_columns(layout, columns)
+    sep, names = LAYOUTS[layout]
+    with open(path, 'rb') as fh:
+        sample = fh.read(_SAMPLE_BYTES)
+    fallback_sep = None
+    if sep == r'\s+' and _single_space_separated(sample):
+        rows = sample.split(b'\n', 2)
+        trailing = len(rows) > 1 and rows[1].rstrip(b'\r').endswith(b' ')
+        fallback_sep, sep = sep, ' '
+        names = list(names) + ['_trailing'] if trailing else names
+    dtype = {c: DTYPES[c] for c in usecols}
+
+    done = 0
+    while True:
+        # (re)start after the rows already yielded, e.g. after switching dtypes or separator
+        reader = pd.read_csv(path, sep=sep, header=None, skiprows=1 + done, names=names, usecols=usecols,
+                             dtype=dtype, chunksize=chunksize, encoding=encoding, encoding_errors='ignore',
+                             engine='c')
+        try:
+            for chunk in reader:
+                chunk.index = pd.RangeIndex(done, done + len(chunk))
+                done += len(chunk)
+                yield _finish(chunk, wanted, repair)
+            return
+        except pd.errors.ParserError:
+            if fallback_sep is None:
+                raise
+            sep, names, fallback_sep = fallback_sep, LAYOUTS[layout][1], None
+        except (ValueError, TypeError):
+            if 'int64' not in dtype.values():
+                raise
+            dtype = {c: ('float64' if t == 'int64' else t) for c, t in dtype.items()}
+        finally:
+            reader.close()
+
+
+def read_traces(paths: Iterable[str], columns: Optional[Sequence[str]] = None, source_col: Optional[str] = 'source',
+                encoding: str = 'utf-8', quiet: bool = True) -> pd.DataFrame:
+    """Read and concatenate several trace files; `source_col` records the originating path."""
+    frames = []
+    for path in paths:
+        try:
+            df = read_trace(path, columns=columns, encoding=encoding)
+        except (OSError, ValueError) as e:
+            print(f"Warning: failed to read {path}: {e}", file=sys.stderr)
+            continue
+        if source_col:
+            df[source_col] = path
+        frames.append(df)
+        if not quiet:
+            print(f"Read {path}: {len(df)} rows")
+    if not frames:
+        return pd.DataFrame(columns=list(columns or BASE_COLUMNS))
+    combined = pd.concat(frames, ignore_index=True)
+    if source_col:
+        combined[source_col] = combined[source_col].astype('category')
+    return combined
+
+
+def read_columns(path: str, indices: Sequence[int], skip_rows: int = 1, sep: str = 'ws',
+                 encoding: str = 'utf-8') -> np.ndarray:
+    """
+    Positional numeric read: return a float64 array of shape (n_rows, len(indices)).
+
+    Rows that are too short for a requested index, or whose value is not numeric,
+    hold NaN in that position, so callers can drop them with a single mask.
+    """
+    with profiling.file_stage('read', path) as st:
+        values = parse_columns(_read_bytes(path, encoding), indices, skip_rows, sep)
+        st.add(rows=len(values))
+    return values
+
+
+def parse_columns(data: bytes, indices: Sequence[int], skip_rows: int = 1, sep: str = 'ws') -> np.ndarray:
+    """read_columns on UTF-8 bytes already in memory (e.g. the newly appended part of a log)."""
+    if not data.strip():
+        return np.empty((0, len(indices)), dtype='float64')
+    sep_actual = r'\s+' if sep == 'ws' else {'\\t': '\t'}.get(sep, sep)
+    if sep == 'ws' and _single_space_separated(data):
+        sep_actual = ' '
+    lines = data[:_SAMPLE_BYTES].split(b'\n', skip_rows + 1)
+    first_row = lines[skip_rows].decode('utf-8', errors='ignore') if len(lines) > skip_rows else ''
+    split_row = first_row.split() if sep_actual == r'\s+' else first_row.rstrip('\r\n').split(sep_actual)
+    order = sorted(set(indices))
+    kwargs = dict(sep=sep_actual, header=None, skiprows=skip_rows, engine='c', skip_blank_lines=True)
+    df = None
+    if order[-1] < len(split_row):
+        # the parser sizes the table from the first row; shorter rows are padded with NaN
+        try:
+            df = pd.read_csv(io.BytesIO(data), usecols=order, dtype='float64', **kwargs)
+        except ValueError:
+            df = None
+    if df is None:
+        # non-numeric cells or ragged rows: parse as text and coerce to NaN
+        try:
+            df = pd.read_csv(io.BytesIO(data), names=range(max(_MAX_FIELDS, order[-1] + 1)), dtype=str, **kwargs)
+        except pd.errors.ParserError:
+            return _read_columns_by_line(data, indices, skip_rows)
+        df = df[order].apply(pd.to_numeric, errors='coerce')
+    return df[list(indices)].to_numpy(dtype='float64', na_value=np.nan)
+
+
+def _read_columns_by_line(data: bytes, indices: Sequence[int], skip_rows: int) -> np.ndarray:
+    # last resort for files the C parser rejects (rows wider than _MAX_FIELDS)
+    rows = []
+    for line in data.decode('utf-8', errors='ignore').splitlines()[skip_rows:]:
+        parts = line.split()
+        if not parts:
+            continue
+        row = []
+        for idx in indices:
+            try:
+                row.append(float(parts[idx]))
+            except (IndexError, ValueError):
+                row.append(np.nan)
+        rows.append(row)
+    return np.array(rows, dtype='float64').reshape(len(rows), len(indices))
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Load CICV5G trace files and print a per-layout summary.")
+    p.add_argument('--input-folder', required=True, help='Folder containing trace files')
+    p.add_argument('--pattern', default='**/*.txt', help="Glob pattern, recursive (default '**/*.txt')")
+    p.add_argument('--columns', nargs='+', help='Only parse these columns')
+    p.add_argument('--quiet', action='store_true', help='Suppress per-file messages')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, 'trace_loader')
+    with profiling.stage('discover'):
+        files = find_trace_files(args.input_folder, args.pattern)
+    if not files:
+        print(f"No files found in {args.input_folder} matching {args.pattern}", file=sys.stderr)
+        sys.exit(1)
+
+    t0 = time.perf_counter()
+    per_layout: Dict[str, List[int]] = {}
+    total_rows = 0
+    with profiling.stage('load') as st:
+        for f in files:
+            try:
+                layout = detect_layout(f)
+                df = read_trace(f, columns=args.columns, layout=layout)
+            except (OSError, ValueError) as e:
+                print(f"Warning: skipping {f}: {e}", file=sys.stderr)
+                continue
+            per_layout.setdefault(layout, []).append(len(df))
+            total_rows += len(df)
+            if not args.quiet:
+                print(f"{layout:6s} {len(df):8d} rows  {f}")
+        st.add(rows=total_rows)
+    elapsed = time.perf_counter() - t0
+
+    print(f"\nFiles: {sum(len(v) for v in per_layout.values())}, rows: {total_rows}, elapsed: {elapsed:.3f} s")
+    for layout, counts in sorted(per_layout.items()):
+        print(f"  {layout}: {len(counts)} files, {sum(counts)} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""
+trace_query.py
+
+Filter queries over the dataset without merging it first: return the rows
+of every run that satisfy a filter such as
+
+  n78, arterial, rsrp<-90, 8<=speed<=15
+
+Terms are comma-separated and must all hold. Path terms select files and are
+those of dataset_catalog.py (scenario, network, direction, v/velocity = the
+nominal km/h of the path, period, run, rows, derived). Column terms filter
+rows; the columns are
+
+  delay, rsrp, sinr, speed (the logged velocity(m/s)), heading, utmx, utmy,
+  pub_time, sub_time
+
+compared with < <= > >= = != to a number (rsrp<-90), between two numbers
+(8<=speed<=15) or over an inclusive range (speed=8..15). Rows with a missing
+value in a filtered column never match.
+
+A query runs in three steps, cheapest first:
+  1. files whose path metadata does not match are dropped (no I/O);
+  2. files whose min/max statistics in the catalog (dataset_catalog.py build)
+     show that no row can satisfy a column term are dropped, still without
+     opening them (statistics of a file changed since the build are ignored);
+  3. the remaining files are read through the parsed-trace cache, only the
+     referenced columns: each column term is one vectorized NumPy mask,
+     evaluated in query order until no row is left, and the output columns
+     are gathered only from files with matching rows.
+The summary reports how many files each step removed and the bytes read
+against those of a full scan of the files. The catalog of a
+parquet_dataset.py export works as well: its files are read column by column,
+skipping row groups whose statistics rule out a column term. Without a catalog (--data-root) the path
+metadata comes from the file names and step 2 is skipped.
+
+Usage examples:
+  # summary: files pruned, bytes read, delay percentiles of the matching rows
+  python trace_query.py --catalog catalog.csv "n78, arterial, rsrp<-90, 8<=speed<=15"
+
+  # matching rows (delay, RSRP, speed and their run) as CSV
+  python trace_query.py --catalog catalog.csv "n8, sinr<0" --columns pub_time delay rsrp speed --output low_sinr.csv
+
+  # which files would be read, and why the others are not
+  python trace_query.py --catalog catalog.csv "w2s, delay>500" --explain
+
+  # from another tool
+  from trace_query import run_query
+  df, summary = run_query(read_catalog("catalog.csv"), "n78, rsrp<-90", columns=["delay(ms)"])
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import operator
+import os
+import re
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import profiling
+from dataset_catalog import STAT_COLUMNS, parse_path, parse_query, read_catalog, select
+
+# column-term names -> trace column
+ROW_COLUMNS = {
+    'delay': 'delay(ms)',
+    'rsrp': 'rsrp(db)',
+    'sinr': 'sinr(db)',
+    'speed': 'velocity(m/s)',
+    'heading': 'heading(rad)',
+    'utmx': 'utmX(m)',
+    'utmy': 'utmY(m)',
+    'pub_time': 'pub_time(ms)',
+    'sub_time': 'sub_time(ms)',
+}
+
+# trace column -> catalog (min field, max field)
+STAT_FIELDS = {col: (f'{key}_min', f'{key}_max') for key, col in STAT_COLUMNS.items()}
+STAT_FIELDS['pub_time(ms)'] = ('t_start', 't_end')
+
+DEFAULT_COLUMNS = ['pub_time(ms)', 'delay(ms)']
+
+_NUM = r'[-+]?\d+(?:\.\d+)?'
+_COMPARE = re.compile(rf'^(\w+)\s*(<=|>=|==|!=|<|>|=|≤|≥)\s*({_NUM})$')
+_BETWEEN = re.compile(rf'^({_NUM})\s*(<=|<|≤)\s*(\w+)\s*(<=|<|≤)\s*({_NUM})$')
+_RANGE = re.compile(rf'^(\w+)\s*=\s*({_NUM})\s*\.\.\s*({_NUM})$')
+_CANONICAL_OP = {'≤': '<=', '≥': '>=', '==': '='}
+_MIRROR = {'<': '>', '<=': '>='}
+
+# row mask of `x op v` ('!=' also excludes missing values, see scan_file)
+_MASK = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '=': operator.eq,
+         '!=': operator.ne}
+
+# could a value in [lo, hi] satisfy `x op v`?
+_MAY_MATCH = {
+    '<': lambda lo, hi, v: lo < v,
+    '<=': lambda lo, hi, v: lo <= v,
+    '>': lambda lo, hi, v: hi > v,
+    '>=': lambda lo, hi, v: hi >= v,
+    '=': lambda lo, hi, v: lo <= v <= hi,
+    '!=': lambda lo, hi, v: not lo == hi == v,
+}
+
+Predicate = Tuple[str, str, float]  # (trace column, operator, value)
+
+
+def _considered(entries: List[Dict[str, object]], path_query: str) -> List[Dict[str, object]]:
+    # the files a query ranges over: runs, plus merged copies when it says 'derived'
+    return select(entries, '', include_derived=parse_query(path_query)[1])
+
+
+def parse_filter(query: str) -> Tuple[str, List[Predicate]]:
+    """Split a query into (path query for dataset_catalog.select, row predicates)."""
+    path_terms, predicates = [], []
+    for term in (t.strip() for t in query.split(',')):
+        if not term:
+            continue
+        low = term.lower()
+        m = _RANGE.match(low)
+        if m and ROW_COLUMNS.get(m.group(1)):
+            col = ROW_COLUMNS.get(m.group(1))
+            predicates += [(col, '>=', float(m.group(2))), (col, '<=', float(m.group(3)))]
+            continue
+        m = _BETWEEN.match(low)
+        if m:
+            col = ROW_COLUMNS.get(m.group(3))
+            if col is None:
+                raise ValueError(f"Unknown column {m.group(3)!r} in {term!r} (known: {', '.join(ROW_COLUMNS)})")
+            lo_op, hi_op = (_CANONICAL_OP.get(op, op) for op in (m.group(2), m.group(4)))
+            predicates += [(col, _MIRROR[lo_op], float(m.group(1))), (col, hi_op, float(m.group(5)))]
+            continue
+        m = _COMPARE.match(low)
+        if m and ROW_COLUMNS.get(m.group(1)):
+            predicates.append((ROW_COLUMNS.get(m.group(1)), _CANONICAL_OP.get(m.group(2), m.group(2)), float(m.group(3))))
+            continue
+        path_terms.append(term)
+    return ', '.join(path_terms), predicates
+
+
+def _stats_fresh(entry: Dict[str, object]) -> bool:
+    """True when the file still has the size and mtime it had when the catalog was built."""
+    try:
+        st = os.stat(entry['path'])
+    except OSError:
+        return False
+    return st.st_size == entry.get('size') and st.st_mtime_ns == entry.get('mtime_ns')
+
+
+def may_match_range(op: str, lo, hi, value: float) -> bool:
+    """False when no value in [lo, hi] satisfies `x op value` (statistics of a file or row group)."""
+    return _MAY_MATCH[op](lo, hi, value)
+
+
+def may_match(entry: Dict[str, object], predicates: Sequence[Predicate]) -> bool:
+    """False when the entry's min/max statistics prove that no row satisfies all predicates."""
+    for col, op, value in predicates:
+        fields = STAT_FIELDS.get(col)
+        if fields is None:
+            continue
+        lo, hi = entry.get(fields[0]), entry.get(fields[1])
+        if lo is None or hi is None:
+            continue
+        if not may_match_range(op, lo, hi, value):
+            return False
+    return True
+
+
+def plan(entries: List[Dict[str, object]], query: str):
+    """
+    Decide which catalog entries a query has to read.
+
+    Returns (to_read, predicates, counts) where counts holds the number of
+    entries considered and dropped by path metadata and by statistics.
+    """
+    path_query, predicates = parse_filter(query)
+    considered = _considered(entries, path_query)
+    by_path = select(entries, path_query)
+    to_read = [e for e in by_path if not predicates or not _stats_fresh(e) or may_match(e, predicates)]
+    counts = {'files': len(considered), 'pruned_path': len(considered) - len(by_path),
+              'pruned_stats': len(by_path) - len(to_read), 'scan_bytes': sum(e.get('size') or 0 for e in considered)}
+    return to_read, predicates, counts
+
+
+def scan_file(path: str, predicates: Sequence[Predicate], columns: Sequence[str]):
+    """
+    Rows of one trace file satisfying every predicate.
+
+    Returns ({column: array of the matching rows}, rows in the file, bytes read).
+    Only the referenced columns are loaded; with the cache they are memory maps,
+    so the bytes read are those of the columns actually touched. Files of a
+    parquet_dataset.py export are read without the row groups whose
+    statistics rule out a predicate (bytes read: compressed column chunks).
+    """
+    import numpy as np
+    from trace_cache import cache_enabled, load_columns
+
+    needed = list(dict.fromkeys([p[0] for p in predicates] + list(columns)))
+    cached = cache_enabled() and not path.endswith('.parquet')
+    nbytes = None
+    if path.endswith('.parquet'):
+        from parquet_dataset import read_columns
+        cols, _, nbytes = read_columns(path, needed, predicates)
+    elif cached:
+        cols = load_columns(path, needed)
+    else:
+        import pandas as pd
+        from trace_loader import read_trace
+        df = read_trace(path, columns=needed)
+        # columns the layout lacks come back all-missing: treat them as absent
+        cols = {c: (df[c].array if isinstance(df[c].dtype, pd.CategoricalDtype) else df[c].to_numpy())
+                for c in df.columns if df[c].notna().any()}
+    n = len(next(iter(cols.values()))) if cols else 0
+    touched = set()
+    mask = np.ones(n, dtype=bool)
+    for col, op, value in predicates:
+        if col not in cols:
+            mask[:] = False
+            break
+        x = np.asarray(cols[col])
+        touched.add(col)
+        mask &= _MASK[op](x, value)
+        if op == '!=' and x.dtype.kind == 'f':
+            mask &= ~np.isnan(x)
+        if not mask.any():
+            break
+    out = None
+    if mask.any():
+        k = int(mask.sum())
+        out = {c: cols[c][mask] if c in cols else np.full(k, np.nan) for c in columns}
+        touched.update(c for c in columns if c in cols)
+    if cached:
+        nbytes = sum(getattr(cols[c], 'codes', cols[c]).nbytes for c in touched)
+    elif nbytes is None:
+        nbytes = os.path.getsize(path)
+    return out, n, nbytes
+
+
+def run_query(entries: List[Dict[str, object]], query: str, columns: Optional[Sequence[str]] = None,
+              quiet: bool = True):
+    """
+    Run `query` over catalog entries (dataset_catalog.read_catalog).
+
+    Returns (DataFrame of the matching rows with `columns` and the run's
+    relpath in 'source', summary dict).
+    """
+    import pandas as pd
+
+    with profiling.stage('plan'):
+        to_read, predicates, summary = plan(entries, query)
+    columns = list(columns) if columns else list(dict.fromkeys(DEFAULT_COLUMNS + [p[0] for p in predicates]))
+    frames = []
+    summary.update(read=0, matched_files=0, rows_read=0, rows=0, bytes_read=0)
+    with profiling.stage('scan') as st:
+        for e in to_read:
+            try:
+                out, n, nbytes = scan_file(e['path'], predicates, columns)
+            except (OSError, ValueError) as err:
+                print(f"Warning: skipping {e['path']}: {err}", file=sys.stderr)
+                continue
+            summary['read'] += 1
+            summary['rows_read'] += n
+            summary['bytes_read'] += nbytes
+            if out is None:
+                continue
+            df = pd.DataFrame(out, columns=columns)
+            df['source'] = e['relpath']
+            frames.append(df)
+            summary['matched_files'] += 1
+            summary['rows'] += len(df)
+            if not quiet:
+                print(f"{len(df):8d} of {n:8d} rows  {e['relpath']}")
+        st.add(rows=summary['rows_read'], bytes=summary['bytes_read'])
+    if frames:
+        result = pd.concat(frames, ignore_index=True)
+        result['source'] = result['source'].astype('category')
+    else:
+        result = pd.DataFrame(columns=columns + ['source'])
+    return result, summary
+
+
+def scan_entries(data_root: str) -> List[Dict[str, object]]:
+    """Catalog-like entries for the .txt files under data_root, from their paths only (no statistics)."""
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(data_root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.lower().endswith('.txt'):
+                continue
+            path = os.path.join(dirpath, name)
+            relpath = os.path.relpath(path, data_root).replace(os.sep, '/')
+            entry = {'path': os.path.abspath(path), 'relpath': relpath, 'size': os.path.getsize(path), 'rows': None}
+            entry.update(parse_path(relpath))
+            entries.append(entry)
+    return entries
+
+
+def explain(entries: List[Dict[str, object]], query: str):
+    """Yield (relpath, decision) for every run: 'read', 'path' or 'stats'."""
+    to_read, _, _ = plan(entries, query)
+    path_query = parse_filter(query)[0]
+    read = {e['relpath'] for e in to_read}
+    by_path = {e['relpath'] for e in select(entries, path_query)}
+    for e in _considered(entries, path_query):
+        rel = e['relpath']
+        yield rel, 'read' if rel in read else ('stats' if rel in by_path else 'path')
+
+
+def _mb(n: int) -> str:
+    return f"{n / 2**20:.2f} MB"
+
+
+def print_summary(result, summary: dict, elapsed: float):
+    print(f"Files: {summary['files']} runs, {summary['pruned_path']} skipped by path metadata, "
+          f"{summary['pruned_stats']} by min/max statistics, {summary['read']} read "
+          f"({summary['matched_files']} with matches)")
+    print(f"Rows: {summary['rows']} of {summary['rows_read']} read match")
+    share = summary['bytes_read'] / summary['scan_bytes'] * 100 if summary['scan_bytes'] else 0.0
+    print(f"Bytes read: {_mb(summary['bytes_read'])} of {_mb(summary['scan_bytes'])} for a full scan "
+          f"({share:.1f} %), elapsed {elapsed:.3f} s")
+    if 'delay(ms)' in result.columns and len(result):
+        import numpy as np
+        d = result['delay(ms)'].to_numpy(dtype='float64', na_value=np.nan)
+        d = d[~np.isnan(d)]
+        if len(d):
+            p50, p95, p99 = np.percentile(d, [50, 95, 99])
+            print(f"delay(ms): mean {d.mean():.1f}, p50 {p50:g}, p95 {p95:g}, p99 {p99:g}, max {d.max():g}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Filter trace rows by path metadata and column values.")
+    p.add_argument('query', help='Filter, e.g. "n78, arterial, rsrp<-90, 8<=speed<=15"')
+    src = p.add_mutually_exclusive_group()
+    src.add_argument('--catalog', default='catalog.csv', help='Catalog built by dataset_catalog.py (default catalog.csv)')
+    src.add_argument('--data-root', help='Scan this folder instead of a catalog (path metadata only, no statistics)')
+    p.add_argument('--columns', nargs='+',
+                   help="Output columns (short or full names, 'all' for every base column; "
+                        "default pub_time, delay and the filtered columns)")
+    p.add_argument('--output', help='Write the matching rows as CSV')
+    p.add_argument('--explain', action='store_true', help='Print which files would be read and why, then exit')
+    p.add_argument('--quiet', action='store_true', help='Suppress per-file messages')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def resolve_columns(names: Optional[Sequence[str]]) -> Optional[List[str]]:
+    if not names:
+        return None
+    if [n.lower() for n in names] == ['all']:
+        from trace_loader import BASE_COLUMNS
+        return list(BASE_COLUMNS)
+    return [ROW_COLUMNS.get(n.lower(), 'cellid(db)' if n.lower() == 'cellid' else n) for n in names]
+
+
+def main():
+    args = parse_args()
+    profiling.enable(args, 'trace_query')
+    with profiling.stage('discover'):
+        if args.data_root:
+            entries = scan_entries(args.data_root)
+        else:
+            if not os.path.exists(args.catalog):
+                print(f"Catalog {args.catalog} not found (build it with dataset_catalog.py build, "
+                      f"or pass --data-root)", file=sys.stderr)
+                sys.exit(2)
+            entries = read_catalog(args.catalog)
+    try:
+        parse_query(parse_filter(args.query)[0])
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.explain:
+        for relpath, decision in explain(entries, args.query):
+            print(f"{decision:5s}  {relpath}")
+        return
+
+    t0 = time.perf_counter()
+    result, summary = run_query(entries, args.query, resolve_columns(args.columns), quiet=args.quiet)
+    elapsed = time.perf_counter() - t0
+    if args.output:
+        with profiling.stage('write', rows=len(result)):
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            result.to_csv(args.output, index=False)
+        print(f"Wrote {len(result)} rows to {args.output}")
+    print_summary(result, summary, elapsed)
+
+
+if __name__ == '__main__':
+    main()
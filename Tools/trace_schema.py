@@ -0,0 +1,319 @@
+"""
+trace_schema.py
+
+Canonical compact in-memory schema for trace records.
+
+  pub_time(ms), sub_time(ms)   Int64     exact millisecond timestamps
+  delay(ms)                    UInt16
+  utmX/utmY, currentX/currentY float32   offsets in metres from a per-frame origin
+  heading, velocity            float32
+  cellid(db)                   category
+  sinr(db), rsrp(db)           Int8
+
+Integer columns use pandas' nullable dtypes, so a missing value stays
+missing instead of turning the whole column into float64 (which is how
+'1.7212E+12' timestamps got into merged copies). UTM coordinates are ~3.5e6 m,
+where float32 steps are 0.25 m; stored as offsets from an origin on a 100 m
+grid (df.attrs['utm_origin']) they keep sub-millimetre steps over the whole
+test area. A 13-column record takes 54 bytes instead of 97 with the loader's
+int64/float64 columns (113 with a plain pandas read_csv): about 1.8x smaller,
+and 1.7x over all of data/ (41.9 -> 24.0 MiB), not several-fold. Most of what
+is left is the seven float32 pose columns (28 bytes) and the two exact Int64
+timestamps (18 bytes with their missing-value masks); int32 offsets from a
+per-frame start time would save another 8 bytes per record.
+
+to_compact() refuses values that cannot be represented exactly (fractional
+values in integer columns) and stores values outside the column's range as
+missing - e.g. the modem writes sinr 2032 with rsrp 0 and no cellid when it
+has no measurement. Such replacements are counted in df.attrs['out_of_range'].
+to_full() restores int64 timestamps and absolute float64 positions (rounded to
+the millimetre); write_trace() writes either kind as text with timestamps as
+plain integers, in the columns of a trace_loader layout (ws12 frames get an
+empty currentHeading(rad) column), so a write/read round trip keeps them exact.
+--round-trip checks this for every file, full and compact.
+
+Usage examples:
+  # memory per record (default dtypes vs compact) and timestamp check for every file
+  python trace_schema.py --input-folder data/
+
+  # also write every file back (full and compact) and compare what the loader reads
+  python trace_schema.py --input-folder data/ --round-trip --quiet
+
+  # from another tool
+  from trace_cache import load_trace
+  df = load_trace(path, compact=True)       # or trace_schema.to_compact(frame)
+  x = trace_schema.absolute(df, 'utmX(m)')  # float64 metres
+
+Dependencies:
+  numpy, pandas
+"""
+import argparse
+import glob
+import math
+import os
+import sys
+import tempfile
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+COMPACT_DTYPES = {
+    'pub_time(ms)': 'Int64',
+    'sub_time(ms)': 'Int64',
+    'delay(ms)': 'UInt16',
+    'utmX(m)': 'float32',
+    'utmY(m)': 'float32',
+    'heading(rad)': 'float32',
+    'velocity(m/s)': 'float32',
+    'cellid(db)': 'category',
+    'sinr(db)': 'Int8',
+    'rsrp(db)': 'Int8',
+    'currentX(m)': 'float32',
+    'currentY': 'float32',
+    'currentHeading(rad)': 'float32',
+}
+
+TIMESTAMP_COLUMNS = ['pub_time(ms)', 'sub_time(ms)']
+
+# position column -> axis of the origin it is stored relative to (0: x, 1: y)
+POSITION_COLUMNS = {'utmX(m)': 0, 'currentX(m)': 0, 'utmY(m)': 1, 'currentY': 1}
+
+ORIGIN_GRID_M = 100.0
+POSITION_DECIMALS = 3
+
+# relative tolerances of round_trip_errors: a few ulps of float64, half an ulp of float32
+_FLOAT64_RTOL = 1e-15
+_FLOAT32_RTOL = 2.0 ** -24
+
+
+def default_origin(df: pd.DataFrame) -> Tuple[float, float]:
+    """Lower-left corner (on a 100 m grid) of the positions in `df`; (0, 0) if it has none."""
+    origin = []
+    for axis in (0, 1):
+        cols = [c for c, a in POSITION_COLUMNS.items() if a == axis and c in df.columns]
+        lo = min((np.nanmin(df[c].to_numpy(dtype='float64', na_value=np.nan)) for c in cols
+                  if df[c].notna().any()), default=0.0)
+        origin.append(math.floor(lo / ORIGIN_GRID_M) * ORIGIN_GRID_M)
+    return origin[0], origin[1]
+
+
+def _to_integer(series: pd.Series, dtype: str) -> Tuple[pd.Series, int]:
+    if series.dtype.kind in 'iu' and not series.isna().any():
+        values = series.to_numpy(dtype='int64')
+    else:
+        values = series.to_numpy(dtype='float64', na_value=np.nan)
+    if values.dtype.kind == 'f':
+        finite = np.isfinite(values)
+        if (values[finite] != np.round(values[finite])).any():
+            raise ValueError(f"{series.name}: fractional values cannot be stored as {dtype}")
+    info = np.iinfo(pd.api.types.pandas_dtype(dtype).numpy_dtype)
+    with np.errstate(invalid='ignore'):
+        outside = (values < info.min) | (values > info.max)
+    missing = pd.isna(values) | outside
+    data = np.where(missing, 0, values).astype(info.dtype)
+    return pd.Series(pd.arrays.IntegerArray(data, missing), index=series.index, name=series.name), int(outside.sum())
+
+
+def to_compact(df: pd.DataFrame, origin: Optional[Tuple[float, float]] = None) -> pd.DataFrame:
+    """Convert a trace frame to COMPACT_DTYPES (columns not in the schema are kept as they are)."""
+    if df.attrs.get('utm_origin') is not None:
+        df = to_full(df)
+    if origin is None:
+        origin = default_origin(df)
+    out = {}
+    dropped = {}
+    for col in df.columns:
+        dtype = COMPACT_DTYPES.get(col)
+        series = df[col]
+        if dtype is None:
+            out[col] = series
+        elif dtype == 'category':
+            out[col] = series.astype('category')
+        elif dtype[0] in 'IU':
+            out[col], n = _to_integer(series, dtype)
+            if n:
+                dropped[col] = n
+        elif col in POSITION_COLUMNS:
+            out[col] = (series.to_numpy(dtype='float64', na_value=np.nan) - origin[POSITION_COLUMNS[col]]).astype('float32')
+        else:
+            out[col] = series.to_numpy(dtype='float32', na_value=np.nan)
+    compact = pd.DataFrame(out, index=df.index)
+    compact.attrs['utm_origin'] = [float(origin[0]), float(origin[1])]
+    compact.attrs['out_of_range'] = dropped
+    return compact
+
+
+def absolute(df: pd.DataFrame, column: str) -> np.ndarray:
+    """Absolute float64 values of a position column of a compact frame (mm-rounded)."""
+    values = df[column].to_numpy(dtype='float64', na_value=np.nan)
+    origin = df.attrs.get('utm_origin')
+    if origin is None or column not in POSITION_COLUMNS:
+        return values
+    return np.round(values + origin[POSITION_COLUMNS[column]], POSITION_DECIMALS)
+
+
+def to_full(df: pd.DataFrame) -> pd.DataFrame:
+    """Inverse of to_compact: int64 timestamps (Int64 if any is missing), absolute float64 positions."""
+    out = {}
+    for col in df.columns:
+        dtype = COMPACT_DTYPES.get(col)
+        series = df[col]
+        if col in POSITION_COLUMNS:
+            out[col] = absolute(df, col)
+        elif dtype is None or dtype == 'category':
+            out[col] = series
+        elif dtype[0] in 'IU':
+            out[col] = series.astype('int64') if not series.isna().any() else series.astype('Int64')
+        else:
+            out[col] = series.astype('float64')
+    return pd.DataFrame(out, index=df.index)
+
+
+def exact_integers(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Frame with integral float columns of the schema's integer columns turned into
+    (nullable) integers, so writers do not print 1722419206673.0 or 1.7212E+12.
+    """
+    df = df.copy(deep=False)
+    for col in df.columns:
+        dtype = COMPACT_DTYPES.get(col)
+        if dtype is None or dtype[0] not in 'IU' or df[col].dtype.kind != 'f':
+            continue
+        values = df[col].to_numpy()
+        finite = np.isfinite(values)
+        if (values[finite] == np.round(values[finite])).all():
+            df[col] = pd.array(np.where(finite, values, 0).astype('int64'), dtype='Int64')
+            df.loc[~finite, col] = pd.NA
+    return df
+
+
+def write_trace(df: pd.DataFrame, path: str, sep: str = '\t'):
+    """Write a full or compact frame as a text trace; timestamps are written as exact integers."""
+    from trace_loader import layout_columns
+
+    if df.attrs.get('utm_origin') is not None:
+        # float32 columns stay float32 so they are written with their own shortest repr
+        df = df.assign(**{c: absolute(df, c) for c in df.columns if c in POSITION_COLUMNS})
+    columns = layout_columns(df.columns)
+    if set(df.columns) <= set(columns) and list(df.columns) != columns:
+        df = df.reindex(columns=columns)
+    exact_integers(df).to_csv(path, sep=sep, index=False, na_rep='')
+
+
+def _same_values(a: pd.Series, b: pd.Series, rtol: float) -> bool:
+    if isinstance(a.dtype, pd.CategoricalDtype) or isinstance(b.dtype, pd.CategoricalDtype):
+        a, b = a.astype(object), b.astype(object)
+        missing = a.isna().to_numpy()
+        return bool((missing == b.isna().to_numpy()).all() and (a[~missing].astype(str).to_numpy()
+                                                                == b[~missing].astype(str).to_numpy()).all())
+    x, y = a.to_numpy(dtype='float64', na_value=np.nan), b.to_numpy(dtype='float64', na_value=np.nan)
+    if not rtol:
+        return np.array_equal(x, y, equal_nan=True)
+    return bool(np.isclose(x, y, rtol=rtol, atol=0, equal_nan=True).all())
+
+
+def round_trip_errors(df: pd.DataFrame) -> List[str]:
+    """
+    Write `df` (full or compact) with write_trace, read it back with trace_loader.read_trace
+    and return the columns whose values differ (to_full values for a compact frame).
+
+    Integer and category columns must come back exactly. Float columns may differ in
+    the last bit, since pandas' C parser does not always round to the nearest double;
+    float32 columns of a compact frame are compared at float32 precision.
+    """
+    from trace_loader import read_trace
+
+    expected = to_full(df) if df.attrs.get('utm_origin') is not None else df
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        write_trace(df, path)
+        back = read_trace(path)
+    except ValueError as e:
+        return [f"unreadable: {e}"]
+    finally:
+        os.remove(path)
+    errors = []
+    for c in expected.columns:
+        if expected[c].dtype.kind == 'f':
+            rtol = _FLOAT32_RTOL if df[c].dtype == 'float32' and c not in POSITION_COLUMNS else _FLOAT64_RTOL
+        else:
+            rtol = 0.0
+        if c not in back.columns or len(back) != len(expected) or not _same_values(
+                expected[c].reset_index(drop=True), back[c], rtol):
+            errors.append(c)
+    errors += [f"{c} (added, not empty)" for c in back.columns if c not in expected.columns and back[c].notna().any()]
+    return errors
+
+
+def coarse_timestamps(values: np.ndarray) -> bool:
+    """True when millisecond timestamps look rounded (all multiples of 1000), e.g. '1.7212E+12' in a file."""
+    values = np.asarray(values, dtype='float64')
+    values = values[np.isfinite(values)]
+    return len(values) > 1 and bool((np.mod(values, 1000) == 0).all())
+
+
+def memory_per_record(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True, index=False).sum() / max(len(df), 1)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Report default vs compact memory per record and check timestamps.")
+    p.add_argument('--input-folder', required=True, help='Folder containing trace files')
+    p.add_argument('--pattern', default='**/*.txt', help="Glob pattern, recursive (default '**/*.txt')")
+    p.add_argument('--round-trip', action='store_true',
+                   help='Also write every file back with write_trace (full and compact) and compare the re-read values')
+    p.add_argument('--quiet', action='store_true', help='Only print the totals and problems')
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def main():
+    from trace_loader import read_trace
+
+    args = parse_args()
+    profiling.enable(args, 'trace_schema')
+    with profiling.stage('discover'):
+        files = sorted(glob.glob(os.path.join(args.input_folder, args.pattern), recursive=True))
+    if not files:
+        print("No input files found. Exiting.", file=sys.stderr)
+        sys.exit(2)
+    rows = full_bytes = compact_bytes = failed = 0
+    for f in files:
+        try:
+            df = read_trace(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: skipping {f}: {e}", file=sys.stderr)
+            continue
+        with profiling.stage('compact', rows=len(df)):
+            compact = to_compact(df)
+        rows += len(df)
+        full_bytes += memory_per_record(df) * len(df)
+        compact_bytes += memory_per_record(compact) * len(df)
+        if not args.quiet:
+            print(f"{memory_per_record(df):6.1f} -> {memory_per_record(compact):5.1f} B/record  {f}")
+        if any(coarse_timestamps(df[c].to_numpy(dtype='float64', na_value=np.nan)) for c in TIMESTAMP_COLUMNS if c in df):
+            print(f"Warning: {f}: timestamps are rounded in the file (e.g. 1.7212E+12); they cannot be recovered",
+                  file=sys.stderr)
+        for col, n in compact.attrs['out_of_range'].items():
+            print(f"Note: {f}: {n} {col} value(s) outside the compact range stored as missing", file=sys.stderr)
+        if args.round_trip:
+            with profiling.stage('round_trip', rows=2 * len(df)):
+                for kind, frame in (('full', df), ('compact', compact)):
+                    errors = round_trip_errors(frame)
+                    if errors:
+                        failed += 1
+                        print(f"Error: {f}: {kind} round trip changed {', '.join(errors)}", file=sys.stderr)
+    print(f"{len(files)} files, {rows} records: {full_bytes / 2**20:.1f} MiB with default dtypes, "
+          f"{compact_bytes / 2**20:.1f} MiB compact ({full_bytes / max(compact_bytes, 1):.1f}x smaller)")
+    if args.round_trip:
+        print(f"Round trip: {failed} of {2 * len(files)} writes changed values")
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()